@@ -1,17 +1,38 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, g, has_request_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
+from sqlalchemy import event as sa_event
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+from werkzeug.http import is_resource_modified
+from werkzeug.wsgi import wrap_file
+from urllib.parse import quote
 from datetime import datetime, timedelta
 import os
-import time
 import secrets
 import json
-import shutil
+import subprocess
 import base64
 import uuid
 import random
+import hashlib
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from feed_cache import FeedCache
+from feed_events import FeedEventPublisher, DEFAULT_EVENT_SOCKET
+from user_cache import UserSummaryCache, UserSummary
+from sqlite_tuning import DEFAULT_SQLITE_PRAGMAS, parse_pragmas, apply_pragmas, copy_database
+from migrations import upgrade_database
+from write_queue import WriteQueueClient, WriteQueueUnavailable, DEFAULT_WRITE_QUEUE_SOCKET
+from sql_profiler import RequestSqlProfiler, DEFAULT_N_PLUS_ONE_THRESHOLD, DEFAULT_SLOW_REQUEST_MS, DEFAULT_SLOW_REQUEST_LOG
+import user_apis
+from image_variants import IMAGE_VARIANTS, generate_variants, clear_variants
+from image_worker import ImageTaskPublisher, DEFAULT_IMAGE_WORKER_SOCKET
+from image_store import hash_stream, blob_name, image_names, fold_uploads
+from upload_storage import IMAGE_EXTENSIONS, original_path, find_original, copy_originals, clear_originals
+from image_serving import ImageStatCache, locate_image, set_cache_headers
 
 # 创建一个函数生成北京时间（UTC+8）而不是UTC
 def beijing_time():
@@ -41,18 +62,62 @@ def handle_exception(e):
 
 # 配置数据库
 basedir = os.path.abspath(os.path.dirname(__file__))
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, 'instance', 'school.db')
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+    'CAMPUS_DATABASE_URI', 'sqlite:///' + os.path.join(basedir, 'instance', 'school.db'))
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# 连接池按工作进程计算：每个 gunicorn 工作进程一个连接池，PostgreSQL 的总连接数约为 workers × (POOL_SIZE + MAX_OVERFLOW)
+# 同步工作进程一次只处理一个请求，默认值已足够，可用环境变量按部署调整
+if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': int(os.environ.get('CAMPUS_DB_POOL_SIZE', 2)),
+        'max_overflow': int(os.environ.get('CAMPUS_DB_MAX_OVERFLOW', 2)),
+        'pool_recycle': int(os.environ.get('CAMPUS_DB_POOL_RECYCLE', 1800)),  # 秒，早于数据库或中间件断开空闲连接
+        'pool_timeout': int(os.environ.get('CAMPUS_DB_POOL_TIMEOUT', 10)),
+        'pool_pre_ping': True
+    }
 app.config['UPLOAD_FOLDER'] = os.path.join(basedir, 'uploads')
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB 文件上传限制
 app.config['TEACHER_REGISTER_CODE'] = 'teacher123'  # 教师注册码
+app.config['FEED_CACHE_SIZE'] = 128  # 每个工作进程缓存的动态列表页面数
+app.config['USER_CACHE_SIZE'] = 4096  # 每个工作进程缓存的用户摘要数
+app.config['FEED_EVENT_SOCKET'] = DEFAULT_EVENT_SOCKET  # 实时推送服务 sse_hub.py 的事件套接字，置空则不发布
+app.config['WRITE_QUEUE_SOCKET'] = DEFAULT_WRITE_QUEUE_SOCKET  # 点赞、评论交给 write_queue.py 合并提交，置空则在请求中直接提交
+app.config['IMAGE_WORKER_SOCKET'] = DEFAULT_IMAGE_WORKER_SOCKET  # 图片处理服务 image_worker.py 的套接字，置空或服务未启动时在请求中生成各尺寸
+# 图片交给 nginx 发送时 internal location 的前缀（见 shiny.conf.check 中的 /images/_files/），置空则由工作进程以 sendfile 发送
+app.config['IMAGE_ACCEL_REDIRECT'] = os.environ.get('CAMPUS_IMAGE_ACCEL_REDIRECT', '')
+app.config['IMAGE_STAT_CACHE_SIZE'] = 4096  # 每个工作进程缓存的图片路径和 stat 结果数
+app.config['UNREFERENCED_IMAGE_GRACE_HOURS'] = 24  # 没有动态引用的图片保留的小时数，上传后还未发布动态的图片在此期间不会被删除
+app.config['PASSWORD_HASH_WORKERS'] = os.cpu_count() or 1  # 批量导入时计算密码哈希的进程数
+app.config['IMPORT_PROGRESS_DIR'] = os.path.join(basedir, 'instance', 'imports')  # 花名册导入进度文件，各工作进程共享
+app.config['IMPORT_PROGRESS_RETENTION_HOURS'] = 24  # 导入进度文件保留的小时数，开始新的导入时删除更早的文件
+# 每个 SQLite 连接建立时执行的 PRAGMA，可用环境变量覆盖，如 CAMPUS_SQLITE_PRAGMAS="journal_mode=WAL,busy_timeout=10000"
+app.config['SQLITE_PRAGMAS'] = (parse_pragmas(os.environ['CAMPUS_SQLITE_PRAGMAS'])
+                                if 'CAMPUS_SQLITE_PRAGMAS' in os.environ else dict(DEFAULT_SQLITE_PRAGMAS))
+# 按请求统计 SQL：同一条查询在一个请求中执行超过阈值次数视为 N+1；慢请求和 N+1 以 JSON 行写入慢请求日志
+# 调试模式或 CAMPUS_SQL_DEBUG_HEADERS=1 时统计结果同时写入 X-SQL-* 响应头
+app.config['SQL_N_PLUS_ONE_THRESHOLD'] = int(os.environ.get('CAMPUS_SQL_N_PLUS_ONE_THRESHOLD', DEFAULT_N_PLUS_ONE_THRESHOLD))
+app.config['SLOW_REQUEST_MS'] = int(os.environ.get('CAMPUS_SLOW_REQUEST_MS', DEFAULT_SLOW_REQUEST_MS))
+app.config['SLOW_REQUEST_LOG'] = os.environ.get('CAMPUS_SLOW_REQUEST_LOG', DEFAULT_SLOW_REQUEST_LOG)
+app.config['SQL_DEBUG_HEADERS'] = os.environ.get('CAMPUS_SQL_DEBUG_HEADERS') == '1'
 
 # 确保上传目录存在
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+os.makedirs(app.config['IMPORT_PROGRESS_DIR'], exist_ok=True)
 
 # 初始化数据库
 db = SQLAlchemy(app)
 
+def configure_sqlite_connection(dbapi_connection, connection_record):
+    apply_pragmas(dbapi_connection, app.config['SQLITE_PRAGMAS'])
+
+sql_profiler = RequestSqlProfiler()
+
+# 连接池中的每个新连接都执行调优 PRAGMA（只创建引擎，不在导入时连接数据库，preload_app 下各工作进程各自建立连接）
+with app.app_context():
+    if db.engine.dialect.name == 'sqlite':
+        sa_event.listen(db.engine, 'connect', configure_sqlite_connection)
+    sql_profiler.init_app(app, db.engine)
+
 # 用户模型
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -67,6 +132,7 @@ class User(db.Model):
     grade = db.Column(db.Integer, nullable=True)  # 年级（1-5）
     class_name = db.Column(db.Integer, nullable=True)  # 班级（1-6）
     created_at = db.Column(db.DateTime, default=beijing_time)
+    deleted_at = db.Column(db.DateTime, nullable=True)  # 删除时间，不为空表示已删除、等待 purger.py 清理
 
 # 动态模型
 class Post(db.Model):
@@ -76,8 +142,20 @@ class Post(db.Model):
     images = db.Column(db.String(500), nullable=True)  # 存储图片文件名，用逗号分隔
     created_at = db.Column(db.DateTime, default=beijing_time)
     comments_disabled = db.Column(db.Boolean, default=False)  # 是否禁止评论
+    like_count = db.Column(db.Integer, nullable=False, default=0)  # 点赞数（冗余计数，与点赞表同事务更新）
+    comment_count = db.Column(db.Integer, nullable=False, default=0)  # 评论数（含回复，冗余计数）
+    deleted_at = db.Column(db.DateTime, nullable=True)  # 删除时间，不为空表示已删除、等待 purger.py 清理
     user = db.relationship('User', backref=db.backref('posts', lazy='dynamic'))
     comments = db.relationship('Comment', backref='post', lazy='dynamic', cascade="all, delete-orphan")
+    # 与动态列表的排序 (created_at DESC, id DESC) 一致的复合索引，用于游标分页，只包含未删除的动态；
+    # 已删除的动态由单独的部分索引供 purger.py 查找；其余索引见 migrations.py
+    __table_args__ = (
+        db.Index('ix_post_live_created_at_id', 'created_at', 'id',
+                 sqlite_where=db.text('deleted_at IS NULL'), postgresql_where=db.text('deleted_at IS NULL')),
+        db.Index('ix_post_deleted_at', 'deleted_at',
+                 sqlite_where=db.text('deleted_at IS NOT NULL'), postgresql_where=db.text('deleted_at IS NOT NULL')),
+        db.Index('ix_post_user_id_created_at', 'user_id', 'created_at'),
+    )
 
 # 评论模型
 class Comment(db.Model):
@@ -91,6 +169,11 @@ class Comment(db.Model):
     user = db.relationship('User', foreign_keys=[user_id], backref=db.backref('comments', lazy='dynamic'))
     parent = db.relationship('Comment', remote_side=[id], backref=db.backref('replies', lazy='dynamic'), uselist=False)
     replied_to_user = db.relationship('User', foreign_keys=[replied_to_user_id])
+    # 按动态取顶层评论、按父评论取回复，均按时间排序
+    __table_args__ = (
+        db.Index('ix_comment_post_parent_created', 'post_id', 'parent_id', 'created_at'),
+        db.Index('ix_comment_parent_created', 'parent_id', 'created_at'),
+    )
 
 # 点赞模型
 class Like(db.Model):
@@ -100,7 +183,62 @@ class Like(db.Model):
     created_at = db.Column(db.DateTime, default=beijing_time)
     user = db.relationship('User', backref=db.backref('likes', lazy='dynamic'))
     post = db.relationship('Post', backref=db.backref('likes', lazy='dynamic', cascade='all, delete-orphan'))
-    __table_args__ = (db.UniqueConstraint('user_id', 'post_id', name='unique_user_post_like'),)
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'post_id', name='unique_user_post_like'),
+        db.Index('ix_like_post_id', 'post_id'),
+    )
+
+# 归档表：archive.py 把较早的动态连同评论和点赞移到这里，热表及其索引只保留近期数据。
+# 保留原来的ID，不设外键；点赞数和评论数在读取归档时实时统计
+class ArchivedPost(db.Model):
+    __tablename__ = 'post_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    images = db.Column(db.String(500), nullable=True)
+    created_at = db.Column(db.DateTime)
+    comments_disabled = db.Column(db.Boolean, default=False)
+    archived_at = db.Column(db.DateTime, default=beijing_time)
+    __table_args__ = (
+        db.Index('ix_post_archive_created_at_id', 'created_at', 'id'),
+        db.Index('ix_post_archive_user_id_created_at', 'user_id', 'created_at'),
+    )
+
+class ArchivedComment(db.Model):
+    __tablename__ = 'comment_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    content = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime)
+    user_id = db.Column(db.Integer, nullable=False)
+    post_id = db.Column(db.Integer, nullable=False)
+    parent_id = db.Column(db.Integer, nullable=True)
+    replied_to_user_id = db.Column(db.Integer, nullable=True)
+    __table_args__ = (
+        db.Index('ix_comment_archive_post_id', 'post_id'),
+        db.Index('ix_comment_archive_parent_id', 'parent_id'),
+    )
+
+class ArchivedLike(db.Model):
+    __tablename__ = 'like_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    post_id = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime)
+    __table_args__ = (
+        db.Index('ix_like_archive_post_id', 'post_id'),
+        db.Index('ix_like_archive_user_id_post_id', 'user_id', 'post_id'),
+    )
+
+# 上传图片按内容命名，记录被多少条动态引用（见 image_store.py）
+class ImageBlob(db.Model):
+    __tablename__ = 'image_blob'
+    name = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.Integer, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    uploaded_at = db.Column(db.DateTime, nullable=False, default=beijing_time)
+    __table_args__ = (
+        db.Index('ix_image_blob_ref_count_uploaded_at', 'ref_count', 'uploaded_at'),
+    )
 
 # 系统配置模型
 class SystemConfig(db.Model):
@@ -132,6 +270,263 @@ class SystemConfig(db.Model):
         db.session.commit()
         return config
 
+# 动态变更记录：自增ID即动态版本号，任何影响动态列表内容的写操作都在同一事务中追加一条
+class FeedChange(db.Model):
+    __tablename__ = 'feed_change'
+    id = db.Column(db.Integer, primary_key=True)
+    post_id = db.Column(db.Integer, nullable=True)  # 不设外键，动态删除后仍保留记录
+    user_id = db.Column(db.Integer, nullable=True)  # 用户展示信息变更时记录用户ID
+    kind = db.Column(db.String(20), nullable=False)
+    created_at = db.Column(db.DateTime, default=beijing_time)
+
+# 不针对具体动态或用户、需要客户端重新加载完整列表的变更类型
+FEED_RESET_KINDS = {'clear', 'restore'}
+
+# PostgreSQL 中序号在插入时分配、事务提交顺序可能不同，增量接口按序号读取会漏掉后提交的小序号变更。
+# 记录变更前先取事务级咨询锁，使写入变更的事务按序号顺序提交（SQLite 本身只有一个写事务，无需加锁）
+FEED_CHANGE_LOCK_ID = 0x6665656401
+
+def lock_feed_changes():
+    if db.engine.dialect.name == 'postgresql' and not db.session.info.get('feed_change_locked'):
+        db.session.execute(db.text('SELECT pg_advisory_xact_lock(:lock_id)'), {'lock_id': FEED_CHANGE_LOCK_ID})
+        db.session.info['feed_change_locked'] = True
+
+def record_feed_change(kind, post_id=None, user_id=None, **details):
+    """记录一次动态变更，随调用方的事务一起提交；提交成功后连同 details 作为实时事件发布"""
+    lock_feed_changes()
+    change = FeedChange(kind=kind, post_id=post_id, user_id=user_id)
+    db.session.add(change)
+    db.session.info.setdefault('pending_feed_changes', []).append((change, details))
+    return change
+
+def record_feed_changes(kind, post_ids):
+    """为多条动态记录同一类变更，一条 INSERT 写入全部行，随调用方的事务一起提交"""
+    rows = [{'kind': kind, 'post_id': post_id, 'created_at': beijing_time()} for post_id in post_ids]
+    if not rows:
+        return
+    lock_feed_changes()
+    statement = db.insert(FeedChange).returning(FeedChange.id, FeedChange.post_id)
+    db.session.info.setdefault('inserted_feed_events', []).extend(
+        {'seq': row.id, 'kind': kind, 'post_id': row.post_id, 'user_id': None}
+        for row in db.session.execute(statement, rows))
+
+# 实时事件只在事务真正提交后发布，回滚的变更不会推送给客户端
+feed_events = FeedEventPublisher(app.config['FEED_EVENT_SOCKET'])
+
+@sa_event.listens_for(db.session, 'before_commit')
+def collect_feed_events(session):
+    pending = session.info.pop('pending_feed_changes', None)
+    events = session.info.pop('inserted_feed_events', [])
+    if pending:
+        # 先写入以获得变更序号
+        session.flush()
+        events += [
+            dict(details, seq=change.id, kind=change.kind, post_id=change.post_id, user_id=change.user_id)
+            for change, details in pending
+        ]
+    if events:
+        session.info['feed_events'] = sorted(events, key=lambda feed_event: feed_event['seq'])
+
+@sa_event.listens_for(db.session, 'after_commit')
+def publish_feed_events(session):
+    session.info.pop('feed_change_locked', None)
+    for feed_event in session.info.pop('feed_events', []):
+        feed_events.publish(feed_event)
+
+@sa_event.listens_for(db.session, 'after_rollback')
+def discard_feed_events(session):
+    session.info.pop('feed_change_locked', None)
+    session.info.pop('pending_feed_changes', None)
+    session.info.pop('inserted_feed_events', None)
+    session.info.pop('feed_events', None)
+
+def current_feed_version():
+    """当前动态版本号，即最大的变更序号"""
+    return db.session.query(db.func.max(FeedChange.id)).scalar() or 0
+
+def feed_etag(version, viewer_id, *params):
+    """动态列表的 ETag：由版本号、浏览者和分页参数决定"""
+    raw = '|'.join(str(part) for part in (version, viewer_id) + params)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:20]
+
+# 与浏览者无关的动态列表页面缓存
+feed_cache = FeedCache(app.config['FEED_CACHE_SIZE'])
+
+# 用户摘要缓存：代数保存在 system_config 中，用户信息变更时在同一事务中递增
+USER_GENERATION_KEY = 'user_cache_generation'
+user_cache = UserSummaryCache(app.config['USER_CACHE_SIZE'])
+
+def current_user_generation():
+    value = db.session.query(SystemConfig.value).filter_by(key=USER_GENERATION_KEY).scalar()
+    return int(value) if value else 0
+
+def bump_user_generation(at_least=None):
+    """递增用户缓存代数；指定 at_least 时直接设为 at_least + 1（用于恢复备份后保证代数不回退）"""
+    if at_least is None:
+        value = db.cast(db.cast(SystemConfig.value, db.Integer) + 1, db.String)
+    else:
+        value = str(at_least + 1)
+    updated = SystemConfig.query.filter_by(key=USER_GENERATION_KEY).update(
+        {SystemConfig.value: value}, synchronize_session=False)
+    if not updated:
+        db.session.add(SystemConfig(
+            key=USER_GENERATION_KEY,
+            value=str(at_least + 1) if at_least is not None else '1',
+            description='用户缓存代数，用户信息变更时递增'
+        ))
+
+def invalidate_user_summary(user_id=None):
+    """用户信息变更时调用：在当前事务中递增代数，并立即失效本进程的缓存条目"""
+    bump_user_generation()
+    user_cache.invalidate(int(user_id) if user_id is not None else None)
+
+def ensure_user_cache_fresh():
+    # 每个请求只检查一次代数
+    if has_request_context():
+        if g.get('user_cache_checked'):
+            return
+        g.user_cache_checked = True
+    user_cache.check_generation(current_user_generation())
+
+def load_user_summaries(user_ids):
+    return [UserSummary(*row) for row in query_in_chunks(
+        lambda ids: db.session.query(
+            User.id, User.username, User.real_name, User.is_teacher, User.is_admin,
+            User.is_active, User.is_first_login, User.can_post
+        ).filter(User.id.in_(ids), User.deleted_at.is_(None)),
+        user_ids)]
+
+def get_user_summaries(user_ids):
+    """批量获取用户摘要，返回 {id: UserSummary}，不存在的用户不出现在结果中"""
+    ids = set()
+    for user_id in user_ids:
+        try:
+            ids.add(int(user_id))
+        except (TypeError, ValueError):
+            continue
+    ensure_user_cache_fresh()
+    return user_cache.get_many(ids, load_user_summaries)
+
+def get_user_summary(user_id):
+    """获取单个用户的摘要，用于只读取展示信息和权限字段的场景，不存在时返回 None"""
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+    return get_user_summaries([user_id]).get(user_id)
+
+# 删除动态和用户时只记录删除时间，读取时按未删除处理，由 purger.py 在后台分批物理删除
+def get_live_post(post_id):
+    """获取未删除的动态，已删除、等待清理的动态视为不存在"""
+    return Post.query.filter(Post.id == post_id, Post.deleted_at.is_(None)).first()
+
+def get_live_user(user_id):
+    """获取未删除的用户"""
+    return User.query.filter(User.id == user_id, User.deleted_at.is_(None)).first()
+
+# 单次 IN 查询的参数个数上限，避免超出 SQLite 的变量数限制
+IN_QUERY_CHUNK_SIZE = 500
+
+# 原子地调整动态的冗余计数，需与对应的增删操作在同一事务中提交
+def adjust_post_counters(post_id, likes=0, comments=0):
+    values = {}
+    if likes:
+        values[Post.like_count] = Post.like_count + likes
+    if comments:
+        values[Post.comment_count] = Post.comment_count + comments
+    if values:
+        Post.query.filter_by(id=post_id).update(values, synchronize_session=False)
+
+def refresh_post_counters(post_ids=None):
+    """根据点赞表和评论表重新计算冗余计数，post_ids 为空时重算全部动态"""
+    like_count = db.session.query(db.func.count(Like.id)).filter(Like.post_id == Post.id).scalar_subquery()
+    comment_count = db.session.query(db.func.count(Comment.id)).filter(Comment.post_id == Post.id).scalar_subquery()
+    values = {Post.like_count: like_count, Post.comment_count: comment_count}
+    
+    if post_ids is None:
+        return Post.query.update(values, synchronize_session=False)
+    
+    post_ids = list(post_ids)
+    updated = 0
+    for i in range(0, len(post_ids), IN_QUERY_CHUNK_SIZE):
+        chunk = post_ids[i:i + IN_QUERY_CHUNK_SIZE]
+        updated += Post.query.filter(Post.id.in_(chunk)).update(values, synchronize_session=False)
+    return updated
+
+def with_direct_replies(build_criteria, model=Comment):
+    """build_criteria(评论别名) 选中的评论加上它们的直接回复，与原来逐条删除评论及其 replies 的范围一致"""
+    def criteria(comment):
+        parent = db.aliased(model)
+        return db.or_(build_criteria(comment),
+                      comment.parent_id.in_(db.select(parent.id).where(build_criteria(parent))))
+    return criteria
+
+def comment_post_ids(build_criteria):
+    """delete_comments_where 将要删除的评论所在的动态ID，用于删除后重算计数"""
+    doomed = db.aliased(Comment)
+    criteria = with_direct_replies(build_criteria)
+    return {row[0] for row in db.session.query(doomed.post_id).filter(criteria(doomed)).distinct()}
+
+def delete_comments_where(build_criteria, model=Comment):
+    """
+    批量删除 build_criteria 选中的评论及其直接回复，返回删除的条数；model 为 ArchivedComment 时作用于归档评论。
+    更深层的回复改为顶层评论，与逐条 db.session.delete 时 ORM 置空 parent_id 的结果一致
+    """
+    doomed = db.aliased(model)
+    doomed_ids = db.select(doomed.id).where(with_direct_replies(build_criteria, model)(doomed))
+    model.query.filter(model.parent_id.in_(doomed_ids), model.id.not_in(doomed_ids)).update(
+        {model.parent_id: None}, synchronize_session=False)
+    return model.query.filter(model.id.in_(doomed_ids)).delete(synchronize_session=False)
+
+# 动态列表分页配置
+FEED_DEFAULT_LIMIT = 20
+FEED_MAX_LIMIT = 50
+FEED_COMMENT_PREVIEW = 5  # 分页模式下每条动态内嵌的顶层评论数
+FEED_REPLY_PREVIEW = 3  # 内嵌评论及评论分页中每条评论附带的回复数
+
+# 增量变更接口每次最多处理的变更记录数
+CHANGES_DEFAULT_LIMIT = 200
+CHANGES_MAX_LIMIT = 1000
+
+# 评论分页配置
+COMMENT_DEFAULT_LIMIT = 20
+COMMENT_MAX_LIMIT = 50
+
+def encode_cursor(row):
+    """将动态或评论的 (created_at, id) 编码为不透明的分页游标"""
+    raw = f"{row.created_at.isoformat()}|{row.id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """解析分页游标，返回 (created_at, id)，格式错误时抛出 ValueError"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8')
+        created_at, row_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except Exception:
+        raise ValueError('无效的分页游标')
+
+def parse_page_args(default_limit, max_limit):
+    """解析请求中的 limit / cursor 参数，返回 (limit, cursor, (created_at, id) 或 None)，参数错误时抛出 ValueError"""
+    try:
+        limit = int(request.args.get('limit', default_limit))
+    except ValueError:
+        raise ValueError('limit 必须是整数')
+    limit = max(1, min(limit, max_limit))
+    
+    cursor = request.args.get('cursor')
+    return limit, cursor, decode_cursor(cursor) if cursor else None
+
+def after_cursor(model, cursor_key, descending=False):
+    """游标之后的过滤条件，排序为 (created_at, id) 升序或降序"""
+    created_at, row_id = cursor_key
+    if descending:
+        return db.or_(model.created_at < created_at,
+                      db.and_(model.created_at == created_at, model.id < row_id))
+    return db.or_(model.created_at > created_at,
+                  db.and_(model.created_at == created_at, model.id > row_id))
+
 # 检查文件类型是否允许
 def allowed_file(filename, allowed_extensions=None):
     if allowed_extensions is None:
@@ -139,32 +534,118 @@ def allowed_file(filename, allowed_extensions=None):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in allowed_extensions
 
+image_tasks = ImageTaskPublisher(app.config['IMAGE_WORKER_SOCKET'])
+image_stats = ImageStatCache(app.config['IMAGE_STAT_CACHE_SIZE'])
+
 # 添加图片访问路由
 @app.route('/api/images/<filename>')
 def get_image(filename):
-    """统一提供图片文件访问"""
+    """
+    统一提供图片文件访问，size 为 thumb、feed、full 时返回对应尺寸：
+    浏览器支持 WebP 时优先返回 WebP 版本，还没有生成时返回原图。
+    缓存头、304 和 Range 的处理以及交给 nginx 或 sendfile 发送见 image_serving.py
+    """
+    size = request.args.get('size', 'original')
+    if size != 'original' and size not in IMAGE_VARIANTS:
+        return jsonify({"error": "不支持的图片尺寸"}), 400
+    webp = size != 'original' and 'image/webp' in request.headers.get('Accept', '')
+    key = (filename, size, webp)
     try:
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        if not os.path.exists(file_path):
-            return jsonify({"error": "图片不存在"}), 404
-            
-        # 获取文件大小
-        file_size = os.path.getsize(file_path)
-        
-        # 设置正确的Content-Length头
-        response = send_from_directory(app.config['UPLOAD_FOLDER'], filename)
-        response.headers['Content-Length'] = file_size
+        image = image_stats.get(key)
+        if image is None:
+            image = locate_image(app.config['UPLOAD_FOLDER'], filename, size, webp)
+            if image is None:
+                return jsonify({"error": "图片不存在"}), 404
+            # 尺寸还没有生成时返回的原图不缓存，生成后下一次请求就能找到
+            if image.immutable:
+                image_stats.put(key, image)
+
+        if not is_resource_modified(request.environ, etag=image.etag, last_modified=image.mtime):
+            response = set_cache_headers(app.response_class(status=304), image)
+        elif app.config['IMAGE_ACCEL_REDIRECT']:
+            # nginx 从 internal location 发送文件，Range 请求也由 nginx 处理
+            relative_path = os.path.relpath(image.path, app.config['UPLOAD_FOLDER']).replace(os.sep, '/')
+            response = set_cache_headers(app.response_class(mimetype=image.mimetype), image)
+            response.headers['X-Accel-Redirect'] = app.config['IMAGE_ACCEL_REDIRECT'] + quote(relative_path)
+        else:
+            try:
+                data = wrap_file(request.environ, open(image.path, 'rb'))
+            except FileNotFoundError:
+                # 缓存的路径已失效（迁移时移入了分层目录，或已被 purger.py 删除），不经缓存重新查找一次；
+                # 仍然打不开（如正在合并或清理）时返回 404，不再重试
+                image_stats.discard(key)
+                image = locate_image(app.config['UPLOAD_FOLDER'], filename, size, webp)
+                if image is None:
+                    return jsonify({"error": "图片不存在"}), 404
+                try:
+                    data = wrap_file(request.environ, open(image.path, 'rb'))
+                except FileNotFoundError:
+                    return jsonify({"error": "图片不存在"}), 404
+            response = app.response_class(data, mimetype=image.mimetype, direct_passthrough=True)
+            response.content_length = image.size
+            set_cache_headers(response, image)
+            try:
+                response = response.make_conditional(request.environ, accept_ranges=True, complete_length=image.size)
+            except RequestedRangeNotSatisfiable:
+                data.close()
+                return jsonify({"error": "请求的范围无效"}), 416, {'Content-Range': f'bytes */{image.size}'}
+
+        if size != 'original':
+            # 同一地址按 Accept 返回不同格式，缓存需要区分
+            response.vary.add('Accept')
         return response
     except Exception as e:
         print(f"访问图片出错: {str(e)}")
         return jsonify({"error": "访问图片失败"}), 500
 
+def store_uploaded_image(file, filename):
+    """
+    按内容哈希保存上传的图片，返回 (文件名, 是否新写入)。
+    先更新 image_blob 的上传时间并提交，purger.py 就不会在这之后删除该文件；
+    文件已存在时不再写盘。正在被 purger.py 删除的行会让这里的写入等到删除提交，此时文件已删除，重新写入。
+    """
+    name = blob_name(hash_stream(file.stream), filename)
+    file.stream.seek(0, os.SEEK_END)
+    size = file.stream.tell()
+    file.stream.seek(0)
+    now = beijing_time()
+    statement = dialect_insert(ImageBlob).values(name=name, size=size, ref_count=0, uploaded_at=now)
+    db.session.execute(statement.on_conflict_do_update(index_elements=['name'], set_={'uploaded_at': now}))
+    db.session.commit()
+
+    if find_original(app.config['UPLOAD_FOLDER'], name):
+        return name, False
+    path = original_path(app.config['UPLOAD_FOLDER'], name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # 先写临时文件再改名，同时上传相同图片的请求不会读到写了一半的文件
+    temporary_path = f'{path}.{uuid.uuid4().hex[:8]}.tmp'
+    file.save(temporary_path)
+    os.replace(temporary_path, path)
+    return name, True
+
+def add_image_references(images, delta):
+    """动态 images 字段中的每张图片引用数加 delta，同一条动态中重复的图片只计一次"""
+    names = image_names(images)
+    if names:
+        ImageBlob.query.filter(ImageBlob.name.in_(names)).update(
+            {ImageBlob.ref_count: ImageBlob.ref_count + delta}, synchronize_session=False)
+
+def release_image_references(images_list):
+    """物理删除动态后减少其图片的引用数，按减少的数量分组更新"""
+    releases = Counter()
+    for images in images_list:
+        releases.update(image_names(images))
+    by_count = {}
+    for name, count in releases.items():
+        by_count.setdefault(count, []).append(name)
+    for count, names in by_count.items():
+        for i in range(0, len(names), 500):
+            ImageBlob.query.filter(ImageBlob.name.in_(names[i:i + 500])).update(
+                {ImageBlob.ref_count: ImageBlob.ref_count - count}, synchronize_session=False)
+
 @app.route('/api/uploads', methods=['POST'])
 def upload_file():
     """处理文件上传请求"""
-    # 在函数内定义允许的文件扩展名
-    ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp', 'bmp', 'svg', 'tiff'}
-    
     print("\n====== 开始处理文件上传请求 =======")
     
     # 打印请求的详细信息，用于调试
@@ -224,34 +705,35 @@ def upload_file():
             file_ext = os.path.splitext(filename)[1].lower()
             
             print(f"  检查文件扩展名: {file_ext.lstrip('.')}")
-            print(f"  允许的扩展名: {ALLOWED_EXTENSIONS}")
+            print(f"  允许的扩展名: {IMAGE_EXTENSIONS}")
             
-            if file_ext.lstrip('.') not in ALLOWED_EXTENSIONS:
+            if file_ext.lstrip('.') not in IMAGE_EXTENSIONS:
                 print(f"  错误: 不允许的扩展名: {file_ext}")
                 continue
             
-            # 生成唯一文件名
-            timestamp = int(time.time())
-            unique_id = uuid.uuid4().hex[:8]
-            name, ext = os.path.splitext(filename)
-            safe_filename = f"{name}_{timestamp}_{unique_id}{ext}"
-            
             # 打印路径信息
             print(f"  当前工作目录: {os.getcwd()}")
             print(f"  上传目录: {app.config['UPLOAD_FOLDER']}")
             
-            # 保存到后端目录
-            backend_filepath = os.path.join(app.config['UPLOAD_FOLDER'], safe_filename)
-            print(f"  尝试保存文件到: {backend_filepath}")
-            
             try:
-                file.save(backend_filepath)
-                backend_filesize = os.path.getsize(backend_filepath)
+                safe_filename, created = store_uploaded_image(file, filename)
+                if not created:
+                    # 相同内容的图片已经保存过（如转发的图片），直接使用，不再写盘和生成其他尺寸
+                    print(f"  图片已存在，复用: {safe_filename}")
+                    saved_filenames.append(safe_filename)
+                    continue
                 print(f"  文件保存成功: {safe_filename}")
-                print(f"  文件大小: {backend_filesize} 字节")
+                
+                # 列表和预览使用的较小尺寸交给图片处理服务生成，服务不可用时在请求中生成
+                if image_tasks.submit(safe_filename):
+                    print("  已提交图片处理服务生成其他尺寸")
+                else:
+                    variants = generate_variants(app.config['UPLOAD_FOLDER'], safe_filename)
+                    print(f"  生成其他尺寸: {variants}")
                 
                 saved_filenames.append(safe_filename)
             except Exception as e:
+                db.session.rollback()
                 print(f"  保存文件失败: {str(e)}")
                 print(f"  错误类型: {type(e)}")
                 print(f"  错误详情: {str(e)}")
@@ -372,7 +854,7 @@ def login():
         print("错误: 缺少用户名或密码")
         return jsonify({'error': '请提供用户名和密码'}), 400
     
-    user = User.query.filter_by(username=data['username']).first()
+    user = User.query.filter_by(username=data['username'], deleted_at=None).first()
     print(f"查询到的用户: {user}")
     
     if not user:
@@ -423,7 +905,7 @@ def create_post():
     disable_comments = data.get('disable_comments', False)
     
     # 获取用户信息
-    user = User.query.get(user_id)
+    user = get_user_summary(user_id)
     if not user:
         return jsonify({'error': '用户不存在'}), 404
     
@@ -441,7 +923,7 @@ def create_post():
     
     # 创建新动态
     new_post = Post(
-        user_id=user_id,
+        user_id=user.id,
         content=content,
         images=images,
         comments_disabled=disable_comments
@@ -449,12 +931,190 @@ def create_post():
     
     try:
         db.session.add(new_post)
+        db.session.flush()
+        add_image_references(images, 1)
+        record_feed_change('post_create', new_post.id, author_id=user.id)
         db.session.commit()
         return jsonify({'message': '动态发布成功', 'post_id': new_post.id}), 201
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': f'发布失败: {str(e)}'}), 500
 
+# 只读查询直接选取需要的列，得到轻量的行对象（支持属性访问），不创建 ORM 实例、不进入会话标识映射
+FEED_POST_COLUMNS = (
+    Post.id, Post.user_id, Post.content, Post.images, Post.created_at,
+    Post.comments_disabled, Post.like_count, Post.comment_count
+)
+FEED_COMMENT_COLUMNS = (
+    Comment.id, Comment.post_id, Comment.parent_id, Comment.user_id,
+    Comment.replied_to_user_id, Comment.content, Comment.created_at
+)
+USER_LIST_COLUMNS = (
+    User.id, User.username, User.real_name, User.is_teacher, User.is_admin,
+    User.is_active, User.grade, User.class_name, User.created_at
+)
+
+def query_in_chunks(build_query, ids):
+    """按块执行 IN 查询并合并结果，build_query 接收一块 ID 列表并返回查询对象"""
+    ids = list(ids)
+    rows = []
+    for i in range(0, len(ids), IN_QUERY_CHUNK_SIZE):
+        rows.extend(build_query(ids[i:i + IN_QUERY_CHUNK_SIZE]).all())
+    return rows
+
+def first_comments_per_group(group_column, ids, per_group=None, *criteria):
+    """按 group_column 分组，每组按 (created_at, id) 取前 per_group 条评论；per_group 为 None 时取全部"""
+    def build_query(chunk):
+        filters = (group_column.in_(chunk),) + criteria
+        if per_group is None:
+            return db.session.query(*FEED_COMMENT_COLUMNS).filter(*filters)
+        row_number = db.func.row_number().over(
+            partition_by=group_column,
+            order_by=(Comment.created_at, Comment.id)
+        ).label('row_number')
+        ranked = db.session.query(Comment.id.label('id'), row_number).filter(*filters).subquery()
+        return (db.session.query(*FEED_COMMENT_COLUMNS)
+                .join(ranked, Comment.id == ranked.c.id)
+                .filter(ranked.c.row_number <= per_group))
+    
+    rows = query_in_chunks(build_query, ids)
+    rows.sort(key=lambda c: (c.created_at, c.id))
+    return rows
+
+def count_replies(comment_ids):
+    """统计每条评论的回复数，返回 {comment_id: count}"""
+    return dict(query_in_chunks(
+        lambda ids: db.session.query(Comment.parent_id, db.func.count(Comment.id))
+            .filter(Comment.parent_id.in_(ids)).group_by(Comment.parent_id),
+        comment_ids))
+
+def comment_user_ids(comments):
+    """评论及回复涉及的所有用户ID（评论者和被回复者）"""
+    user_ids = set()
+    for comment in comments:
+        user_ids.add(comment.user_id)
+        if comment.replied_to_user_id:
+            user_ids.add(comment.replied_to_user_id)
+    return user_ids
+
+def serialize_comment(comment, users):
+    comment_user = users[comment.user_id]
+    return {
+        'id': comment.id,
+        'content': comment.content,
+        'created_at': comment.created_at.isoformat(),
+        'user_id': comment.user_id,
+        'username': comment_user.username,
+        'real_name': comment_user.real_name,
+        'is_teacher': comment_user.is_teacher
+    }
+
+def serialize_reply(reply, users):
+    replied_to_user = users.get(reply.replied_to_user_id) if reply.replied_to_user_id else None
+    reply_data = serialize_comment(reply, users)
+    reply_data.update({
+        'replied_to_user_id': reply.replied_to_user_id,
+        'replied_to_username': replied_to_user.username if replied_to_user else None,
+        'replied_to_real_name': replied_to_user.real_name if replied_to_user else None,
+        'replied_to_is_teacher': replied_to_user.is_teacher if replied_to_user else None
+    })
+    return reply_data
+
+def assemble_threads(comments, replies, users, reply_counts=None, reply_limit=None):
+    """将顶层评论与回复拼装为评论串；指定 reply_limit 时附带回复总数和回复分页游标"""
+    replies_by_parent = {}
+    for reply in replies:
+        replies_by_parent.setdefault(reply.parent_id, []).append(reply)
+    
+    threads = []
+    for comment in comments:
+        comment_replies = replies_by_parent.get(comment.id, [])
+        comment_data = serialize_comment(comment, users)
+        comment_data['replies'] = [serialize_reply(reply, users) for reply in comment_replies]
+        if reply_limit is not None:
+            reply_count = reply_counts.get(comment.id, 0)
+            has_more = reply_count > len(comment_replies)
+            comment_data['reply_count'] = reply_count
+            comment_data['has_more_replies'] = has_more
+            comment_data['replies_next_cursor'] = encode_cursor(comment_replies[-1]) if has_more and comment_replies else None
+        threads.append((comment, comment_data))
+    return threads
+
+def serialize_post(post, users, like_count, comment_count, comments):
+    post_author = users[post.user_id]
+    return {
+        'id': post.id,
+        'content': post.content,
+        'created_at': post.created_at.isoformat(),
+        'user_id': post.user_id,
+        'username': post_author.username,
+        'real_name': post_author.real_name,
+        'is_teacher': post_author.is_teacher,
+        'images': post.images.split(',') if post.images else [],
+        'like_count': like_count,
+        # 即使评论被禁用也显示数量
+        'comment_count': comment_count,
+        'comments': comments,
+        'disable_comments': post.comments_disabled
+    }
+
+def build_feed_body(posts, comment_limit=None, reply_limit=None):
+    """批量组装与浏览者无关的动态列表：作者、评论、回复及相关用户均通过固定数量的集合查询获取，
+    点赞数和评论数直接读取动态上的冗余计数。
+    指定 comment_limit / reply_limit 时每条动态只内嵌前几条评论和回复作为预览，其余通过评论接口分页获取"""
+    if not posts:
+        return []
+    
+    enabled_ids = [post.id for post in posts if not post.comments_disabled]
+    preview = comment_limit is not None
+    
+    # 1. 顶层评论及其回复，按时间顺序排序（预览模式多取一条用于判断是否还有更多评论）
+    comments = first_comments_per_group(
+        Comment.post_id, enabled_ids, comment_limit + 1 if preview else None, Comment.parent_id.is_(None))
+    if preview:
+        comments_by_post = {}
+        for comment in comments:
+            comments_by_post.setdefault(comment.post_id, []).append(comment)
+        more_comments = {post_id for post_id, rows in comments_by_post.items() if len(rows) > comment_limit}
+        comments = [comment for rows in comments_by_post.values() for comment in rows[:comment_limit]]
+        comments.sort(key=lambda c: (c.created_at, c.id))
+    
+    comment_ids = [comment.id for comment in comments]
+    replies = first_comments_per_group(Comment.parent_id, comment_ids, reply_limit)
+    reply_counts = count_replies(comment_ids) if reply_limit is not None else None
+    
+    # 2. 所有涉及的用户
+    users = get_user_summaries({post.user_id for post in posts} | comment_user_ids(comments) | comment_user_ids(replies))
+    
+    # 在内存中拼装
+    threads_by_post = {}
+    for comment, comment_data in assemble_threads(comments, replies, users, reply_counts, reply_limit):
+        threads_by_post.setdefault(comment.post_id, []).append((comment, comment_data))
+    
+    result = []
+    for post in posts:
+        threads = threads_by_post.get(post.id, [])
+        post_data = serialize_post(post, users, post.like_count, post.comment_count,
+                                   [comment_data for _, comment_data in threads])
+        if preview:
+            has_more = post.id in more_comments
+            post_data['has_more_comments'] = has_more
+            post_data['comments_next_cursor'] = encode_cursor(threads[-1][0]) if has_more else None
+        result.append(post_data)
+    return result
+
+def apply_viewer_overlay(body, viewer_id):
+    """在共享的动态列表上叠加当前用户的点赞状态，不修改缓存中的原始数据"""
+    liked_ids = {row[0] for row in query_in_chunks(
+        lambda ids: db.session.query(Like.post_id)
+            .filter(Like.user_id == viewer_id, Like.post_id.in_(ids)),
+        [item['id'] for item in body])}
+    return [dict(item, is_liked=item['id'] in liked_ids) for item in body]
+
+def build_feed(posts, viewer_id):
+    """组装指定用户看到的动态列表"""
+    return apply_viewer_overlay(build_feed_body(posts), viewer_id)
+
 # 获取动态列表
 @app.route('/api/posts', methods=['GET'])
 def get_posts():
@@ -463,80 +1123,239 @@ def get_posts():
     if not user_id:
         return jsonify({'error': '用户ID不能为空'}), 401
     
-    user = User.query.get(user_id)
+    # 分页模式：传入 limit 或 cursor 时按 (created_at, id) 游标分页，否则返回全部动态
+    page_mode = 'limit' in request.args or 'cursor' in request.args
+    limit = cursor = cursor_key = None
+    
+    if page_mode:
+        try:
+            limit, cursor, cursor_key = parse_page_args(FEED_DEFAULT_LIMIT, FEED_MAX_LIMIT)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    
+    # 客户端缓存仍然有效时直接返回 304，不查询动态、不序列化
+    # 用户被删除或修改会产生新的版本号，因此可以先于用户检查进行
+    version = current_feed_version()
+    etag = feed_etag(version, user_id, limit, cursor)
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    
+    user = get_user_summary(user_id)
     if not user:
         return jsonify({'error': '用户不存在'}), 404
     
-    posts = Post.query.order_by(Post.created_at.desc()).all()
-    result = []
-    
-    for post in posts:
-        post_author = User.query.get(post.user_id)
-        # 检查用户是否点赞过该动态
-        is_liked = Like.query.filter_by(post_id=post.id, user_id=user_id).first() is not None
-        
-        # 获取评论，按时间顺序排序
-        comments_list = []
-        if not post.comments_disabled:
-            comments = Comment.query.filter_by(post_id=post.id, parent_id=None).order_by(Comment.created_at.asc()).all()
-            
-            for comment in comments:
-                comment_user = User.query.get(comment.user_id)
-                comment_data = {
-                    'id': comment.id,
-                    'content': comment.content,
-                    'created_at': comment.created_at.isoformat(),
-                    'user_id': comment.user_id,
-                    'username': comment_user.username,
-                    'real_name': comment_user.real_name,
-                    'is_teacher': comment_user.is_teacher,
-                    'replies': []
-                }
-                
-                # 获取回复，按时间顺序排序
-                replies = Comment.query.filter_by(parent_id=comment.id).order_by(Comment.created_at.asc()).all()
-                for reply in replies:
-                    reply_user = User.query.get(reply.user_id)
-                    replied_to_user = User.query.get(reply.replied_to_user_id) if reply.replied_to_user_id else None
-                    
-                    reply_data = {
-                        'id': reply.id,
-                        'content': reply.content,
-                        'created_at': reply.created_at.isoformat(),
-                        'user_id': reply.user_id,
-                        'username': reply_user.username,
-                        'real_name': reply_user.real_name,
-                        'is_teacher': reply_user.is_teacher,
-                        'replied_to_user_id': reply.replied_to_user_id,
-                        'replied_to_username': replied_to_user.username if replied_to_user else None,
-                        'replied_to_real_name': replied_to_user.real_name if replied_to_user else None,
-                        'replied_to_is_teacher': replied_to_user.is_teacher if replied_to_user else None
-                    }
-                    comment_data['replies'].append(reply_data)
-                
-                comments_list.append(comment_data)
-        
-        # 获取评论数（即使评论被禁用也显示数量）
-        comment_count = Comment.query.filter_by(post_id=post.id).count()
-        
-        post_data = {
-            'id': post.id,
-            'content': post.content,
-            'created_at': post.created_at.isoformat(),
-            'user_id': post.user_id,
-            'username': post_author.username,
-            'real_name': post_author.real_name,
-            'is_teacher': post_author.is_teacher,
-            'images': post.images.split(',') if post.images else [],
-            'like_count': Like.query.filter_by(post_id=post.id).count(),
-            'comment_count': comment_count,
-            'is_liked': is_liked,
-            'comments': comments_list,
-            'disable_comments': post.comments_disabled
+    def load_page():
+        query = (db.session.query(*FEED_POST_COLUMNS).filter(Post.deleted_at.is_(None))
+                 .order_by(Post.created_at.desc(), Post.id.desc()))
+        
+        if not page_mode:
+            return {'posts': build_feed_body(query.all())}
+        
+        if cursor_key:
+            query = query.filter(after_cursor(Post, cursor_key, descending=True))
+        
+        # 多取一条用于判断是否还有下一页
+        posts = query.limit(limit + 1).all()
+        has_more = len(posts) > limit
+        posts = posts[:limit]
+        return {
+            # 分页模式下每条动态只内嵌评论预览
+            'posts': build_feed_body(posts, FEED_COMMENT_PREVIEW, FEED_REPLY_PREVIEW),
+            'next_cursor': encode_cursor(posts[-1]) if has_more else None,
+            'has_more': has_more
         }
-        result.append(post_data)
     
-    return jsonify(result), 200
+    # 页面内容对所有用户相同，按版本号缓存；仅点赞状态按当前用户叠加
+    page = feed_cache.build(version, (limit, cursor), load_page)
+    result = apply_viewer_overlay(page['posts'], user.id)
+    
+    response = jsonify(dict(page, posts=result) if page_mode else result)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    # 客户端以此作为增量接口 /api/posts/changes 的起点
+    response.headers['X-Feed-Version'] = str(version)
+    return response, 200
+
+# 增量获取动态变更（新增、修改、重新计数、删除），用于客户端轮询
+@app.route('/api/posts/changes', methods=['GET'])
+def get_post_changes():
+    user_id = request.args.get('user_id')
+    
+    if not user_id:
+        return jsonify({'error': '用户ID不能为空'}), 401
+    
+    try:
+        since = int(request.args.get('since', 0))
+        limit = max(1, min(int(request.args.get('limit', CHANGES_DEFAULT_LIMIT)), CHANGES_MAX_LIMIT))
+    except ValueError:
+        return jsonify({'error': 'since 和 limit 必须是整数'}), 400
+    
+    user = get_user_summary(user_id)
+    if not user:
+        return jsonify({'error': '用户不存在'}), 404
+    
+    changes = FeedChange.query.filter(FeedChange.id > since).order_by(FeedChange.id.asc()).limit(limit + 1).all()
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    
+    if not changes:
+        return jsonify({
+            'posts': [], 'deleted': [], 'users': [],
+            'reset': False, 'cursor': since, 'has_more': False
+        }), 200
+    
+    changed_post_ids = {change.post_id for change in changes if change.post_id is not None}
+    changed_user_ids = {change.user_id for change in changes if change.user_id is not None}
+    reset = any(change.kind in FEED_RESET_KINDS for change in changes)
+    
+    # 仍然存在的动态返回最新内容，已删除的只返回ID作为墓碑
+    posts = query_in_chunks(lambda ids: db.session.query(*FEED_POST_COLUMNS).filter(
+        Post.id.in_(ids), Post.deleted_at.is_(None)), changed_post_ids)
+    posts.sort(key=lambda post: (post.created_at, post.id), reverse=True)
+    deleted = sorted(changed_post_ids - {post.id for post in posts})
+    
+    users = get_user_summaries(changed_user_ids)
+    
+    return jsonify({
+        'posts': apply_viewer_overlay(build_feed_body(posts, FEED_COMMENT_PREVIEW, FEED_REPLY_PREVIEW), user.id),
+        'deleted': deleted,
+        # 展示信息有变化的用户，客户端据此更新已加载动态中的姓名等信息
+        'users': [{
+            'id': u.id,
+            'username': u.username,
+            'real_name': u.real_name,
+            'is_teacher': u.is_teacher
+        } for u in users.values()],
+        # 系统被清空或恢复时无法增量同步，客户端需要重新加载完整列表
+        'reset': reset,
+        'cursor': changes[-1].id,
+        'has_more': has_more
+    }), 200
+
+# 动态列表缓存统计（仅管理员可用，数据为处理本次请求的工作进程）
+@app.route('/api/system/feed-cache', methods=['GET'])
+def get_feed_cache_stats():
+    user_id = request.args.get('user_id')
+    
+    if not user_id:
+        return jsonify({'error': '管理员ID不能为空'}), 400
+    
+    admin = get_user_summary(user_id)
+    if not admin or not admin.is_admin:
+        return jsonify({'error': '权限不足，只有超级管理员可以查看缓存统计'}), 403
+    
+    stats = feed_cache.stats()
+    stats['current_version'] = current_feed_version()
+    stats['user_cache'] = user_cache.stats()
+    return jsonify(stats), 200
+
+# 高频写操作：只包含写入部分，不提交事务，由 run_write 在请求中直接提交或交给写队列合并提交
+def dialect_insert(model):
+    """支持 ON CONFLICT 的 INSERT 语句"""
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(model)
+
+def insert_like_ignoring_conflict(user_id, post_id):
+    """INSERT ... ON CONFLICT DO NOTHING，返回是否插入了新行；同一用户并发点赞时不会违反 unique_user_post_like"""
+    statement = dialect_insert(Like).values(user_id=user_id, post_id=post_id, created_at=beijing_time())
+    statement = statement.on_conflict_do_nothing(index_elements=['user_id', 'post_id'])
+    return db.session.execute(statement).rowcount == 1
+
+def apply_like_toggle(user_id, post_id):
+    """切换点赞状态，返回 {'is_liked', 'likes'}"""
+    # 先尝试取消点赞，没有可删除的行再插入；两条语句都按实际影响的行数调整计数
+    removed = Like.query.filter_by(user_id=user_id, post_id=post_id).delete(synchronize_session=False)
+    if removed:
+        is_liked, delta = False, -removed
+    else:
+        # 插入冲突说明并发的请求刚刚点过赞，结果同样是已点赞，计数已由对方调整
+        is_liked = True
+        delta = 1 if insert_like_ignoring_conflict(user_id, post_id) else 0
+    adjust_post_counters(post_id, likes=delta)
+    like_count = db.session.query(Post.like_count).filter_by(id=post_id).scalar()
+    record_feed_change('like', post_id, like_count=like_count)
+    return {'is_liked': is_liked, 'likes': like_count}
+
+def apply_new_comment(post_id, user, content, parent_id=None, replied_to_user_id=None):
+    """添加评论，user 为发表者的用户摘要字段，返回新评论的 {'id', 'created_at'}"""
+    new_comment = Comment(
+        content=content,
+        user_id=user['id'],
+        post_id=post_id,
+        parent_id=parent_id,
+        replied_to_user_id=replied_to_user_id
+    )
+    db.session.add(new_comment)
+    db.session.flush()
+    adjust_post_counters(post_id, comments=1)
+    record_feed_change('comment', post_id, comment={
+        'id': new_comment.id,
+        'content': new_comment.content,
+        'created_at': new_comment.created_at.isoformat(),
+        'user_id': user['id'],
+        'username': user['username'],
+        'real_name': user['real_name'],
+        'is_teacher': user['is_teacher'],
+        'parent_id': parent_id,
+        'replied_to_user_id': replied_to_user_id
+    })
+    return {'id': new_comment.id, 'created_at': new_comment.created_at.isoformat()}
+
+WRITE_OPERATIONS = {
+    'like': apply_like_toggle,
+    'comment': apply_new_comment
+}
+
+write_queue = WriteQueueClient(app.config['WRITE_QUEUE_SOCKET'])
+
+def run_write(kind, **params):
+    """执行一个高频写操作并提交；启用写队列时交给单写入进程，写队列未启动时退回到当前请求中直接提交"""
+    if write_queue.enabled:
+        try:
+            return write_queue.submit(kind, params)
+        except WriteQueueUnavailable:
+            pass
+    result = WRITE_OPERATIONS[kind](**params)
+    db.session.commit()
+    return result
+
+def execute_write_batch(items):
+    """
+    写队列使用：在一个事务中依次执行 [(kind, params)]，每个操作使用独立的保存点，失败只回滚它自己。
+    返回与 items 一一对应的 (True, 结果) 或 (False, 错误信息)
+    """
+    if db.engine.dialect.name == 'sqlite':
+        # pysqlite 不会在 SAVEPOINT 之前开启事务，最外层保存点释放时会直接提交，因此先显式开启写事务
+        db.session.execute(db.text('BEGIN IMMEDIATE'))
+    pending = db.session.info.setdefault('pending_feed_changes', [])
+    results = []
+    for kind, params in items:
+        if kind not in WRITE_OPERATIONS:
+            results.append((False, f'未知的写操作: {kind}'))
+            continue
+        mark = len(pending)
+        savepoint = db.session.begin_nested()
+        try:
+            result = WRITE_OPERATIONS[kind](**params)
+            savepoint.commit()
+            results.append((True, result))
+        except Exception as e:
+            savepoint.rollback()
+            # 回滚的操作不发布实时事件
+            del pending[mark:]
+            results.append((False, str(e)))
+    try:
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return [(False, str(e))] * len(items)
+    return results
 
 # 点赞/取消点赞动态
 @app.route('/api/posts/<int:post_id>/like', methods=['POST'])
@@ -548,34 +1367,23 @@ def toggle_like(post_id):
     
     user_id = data.get('user_id')
     
-    user = User.query.get(user_id)
+    user = get_user_summary(user_id)
     if not user:
         return jsonify({'error': '用户不存在'}), 404
     
-    post = Post.query.get(post_id)
+    post = get_live_post(post_id)
     if not post:
         return jsonify({'error': '动态不存在'}), 404
     
-    # 检查是否已经点赞
-    existing_like = Like.query.filter_by(user_id=user_id, post_id=post_id).first()
+    try:
+        result = run_write('like', user_id=user.id, post_id=post_id)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'点赞失败: {str(e)}'}), 500
     
-    if existing_like:
-        # 已经点赞，取消点赞
-        db.session.delete(existing_like)
-        db.session.commit()
-        like_count = Like.query.filter_by(post_id=post_id).count()
-        return jsonify({'message': '已取消点赞', 'is_liked': False, 'likes': like_count}), 200
-    else:
-        # 未点赞，添加点赞
-        new_like = Like(user_id=user_id, post_id=post_id)
-        try:
-            db.session.add(new_like)
-            db.session.commit()
-            like_count = Like.query.filter_by(post_id=post_id).count()
-            return jsonify({'message': '点赞成功', 'is_liked': True, 'likes': like_count}), 201
-        except Exception as e:
-            db.session.rollback()
-            return jsonify({'error': f'点赞失败: {str(e)}'}), 500
+    if result['is_liked']:
+        return jsonify({'message': '点赞成功', 'is_liked': True, 'likes': result['likes']}), 201
+    return jsonify({'message': '已取消点赞', 'is_liked': False, 'likes': result['likes']}), 200
 
 # 发表评论
 @app.route('/api/posts/<int:post_id>/comments', methods=['POST'])
@@ -590,11 +1398,11 @@ def add_comment(post_id):
     parent_id = data.get('parent_id')
     replied_to_user_id = data.get('replied_to_user_id')
     
-    user = User.query.get(user_id)
+    user = get_user_summary(user_id)
     if not user:
         return jsonify({'error': '用户不存在'}), 404
     
-    post = Post.query.get(post_id)
+    post = get_live_post(post_id)
     if not post:
         return jsonify({'error': '动态不存在'}), 404
     
@@ -609,24 +1417,15 @@ def add_comment(post_id):
     if user.is_first_login:
         return jsonify({'error': '请先完善个人信息和修改密码后再发表评论'}), 403
     
-    # 创建新评论
-    new_comment = Comment(
-        content=content,
-        user_id=user_id,
-        post_id=post_id,
-        parent_id=parent_id,
-        replied_to_user_id=replied_to_user_id
-    )
-    
     try:
-        db.session.add(new_comment)
-        db.session.commit()
+        result = run_write('comment', post_id=post_id, user=user._asdict(), content=content,
+                           parent_id=parent_id, replied_to_user_id=replied_to_user_id)
         
         # 返回评论信息
         comment_data = {
-            'id': new_comment.id,
-            'content': new_comment.content,
-            'created_at': new_comment.created_at.isoformat(),
+            'id': result['id'],
+            'content': content,
+            'created_at': result['created_at'],
             'user_id': user_id,
             'username': user.username,
             'real_name': user.real_name,
@@ -635,7 +1434,7 @@ def add_comment(post_id):
         }
         
         if replied_to_user_id:
-            replied_to_user = User.query.get(replied_to_user_id)
+            replied_to_user = get_user_summary(replied_to_user_id)
             if replied_to_user:
                 comment_data['replied_to_username'] = replied_to_user.username
                 comment_data['replied_to_real_name'] = replied_to_user.real_name
@@ -646,6 +1445,182 @@ def add_comment(post_id):
         db.session.rollback()
         return jsonify({'error': f'评论失败: {str(e)}'}), 500
 
+# 分页获取动态的顶层评论，每条评论附带前几条回复
+@app.route('/api/posts/<int:post_id>/comments', methods=['GET'])
+def get_post_comments(post_id):
+    user_id = request.args.get('user_id')
+    
+    if not user_id:
+        return jsonify({'error': '用户ID不能为空'}), 401
+    
+    try:
+        limit, cursor, cursor_key = parse_page_args(COMMENT_DEFAULT_LIMIT, COMMENT_MAX_LIMIT)
+        reply_limit = max(0, min(int(request.args.get('reply_limit', FEED_REPLY_PREVIEW)), COMMENT_MAX_LIMIT))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    user = get_user_summary(user_id)
+    if not user:
+        return jsonify({'error': '用户不存在'}), 404
+    
+    post = get_live_post(post_id)
+    if not post:
+        return jsonify({'error': '动态不存在'}), 404
+    
+    # 评论被禁用时与动态列表一致，不返回评论内容
+    if post.comments_disabled:
+        return jsonify({
+            'comments': [],
+            'next_cursor': None,
+            'has_more': False,
+            'comment_count': post.comment_count,
+            'disable_comments': True
+        }), 200
+    
+    query = db.session.query(*FEED_COMMENT_COLUMNS).filter(Comment.post_id == post_id, Comment.parent_id.is_(None))
+    if cursor_key:
+        query = query.filter(after_cursor(Comment, cursor_key))
+    
+    # 多取一条用于判断是否还有下一页
+    comments = query.order_by(Comment.created_at.asc(), Comment.id.asc()).limit(limit + 1).all()
+    has_more = len(comments) > limit
+    comments = comments[:limit]
+    
+    comment_ids = [comment.id for comment in comments]
+    replies = first_comments_per_group(Comment.parent_id, comment_ids, reply_limit)
+    users = get_user_summaries(comment_user_ids(comments) | comment_user_ids(replies))
+    threads = assemble_threads(comments, replies, users, count_replies(comment_ids), reply_limit)
+    
+    return jsonify({
+        'comments': [comment_data for _, comment_data in threads],
+        'next_cursor': encode_cursor(comments[-1]) if has_more else None,
+        'has_more': has_more,
+        'comment_count': post.comment_count,
+        'disable_comments': False
+    }), 200
+
+# 分页获取评论的回复
+@app.route('/api/comments/<int:comment_id>/replies', methods=['GET'])
+def get_comment_replies(comment_id):
+    user_id = request.args.get('user_id')
+    
+    if not user_id:
+        return jsonify({'error': '用户ID不能为空'}), 401
+    
+    try:
+        limit, cursor, cursor_key = parse_page_args(COMMENT_DEFAULT_LIMIT, COMMENT_MAX_LIMIT)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    user = get_user_summary(user_id)
+    if not user:
+        return jsonify({'error': '用户不存在'}), 404
+    
+    comment = Comment.query.get(comment_id)
+    if not comment:
+        return jsonify({'error': '评论不存在'}), 404
+    
+    if comment.post.deleted_at:
+        return jsonify({'error': '评论不存在'}), 404
+    
+    if comment.post.comments_disabled:
+        return jsonify({'error': '该动态已禁止评论'}), 403
+    
+    query = db.session.query(*FEED_COMMENT_COLUMNS).filter(Comment.parent_id == comment_id)
+    if cursor_key:
+        query = query.filter(after_cursor(Comment, cursor_key))
+    
+    replies = query.order_by(Comment.created_at.asc(), Comment.id.asc()).limit(limit + 1).all()
+    has_more = len(replies) > limit
+    replies = replies[:limit]
+    users = get_user_summaries(comment_user_ids(replies))
+    
+    return jsonify({
+        'replies': [serialize_reply(reply, users) for reply in replies],
+        'next_cursor': encode_cursor(replies[-1]) if has_more else None,
+        'has_more': has_more,
+        'reply_count': count_replies([comment_id]).get(comment_id, 0)
+    }), 200
+
+# 归档动态：不经过动态列表缓存，评论全部内嵌，点赞数和评论数实时统计，只用于查看往年内容
+ARCHIVED_POST_COLUMNS = (
+    ArchivedPost.id, ArchivedPost.user_id, ArchivedPost.content, ArchivedPost.images,
+    ArchivedPost.created_at, ArchivedPost.comments_disabled
+)
+ARCHIVED_COMMENT_COLUMNS = (
+    ArchivedComment.id, ArchivedComment.post_id, ArchivedComment.parent_id, ArchivedComment.user_id,
+    ArchivedComment.replied_to_user_id, ArchivedComment.content, ArchivedComment.created_at
+)
+
+def build_archive_body(posts, viewer_id):
+    """组装归档动态列表，格式与动态列表相同，另带 archived 标记"""
+    post_ids = [post.id for post in posts]
+    comments = query_in_chunks(
+        lambda ids: db.session.query(*ARCHIVED_COMMENT_COLUMNS).filter(ArchivedComment.post_id.in_(ids)), post_ids)
+    comments.sort(key=lambda c: (c.created_at, c.id))
+    like_counts = dict(query_in_chunks(
+        lambda ids: db.session.query(ArchivedLike.post_id, db.func.count(ArchivedLike.id))
+            .filter(ArchivedLike.post_id.in_(ids)).group_by(ArchivedLike.post_id),
+        post_ids))
+    liked_ids = {row[0] for row in query_in_chunks(
+        lambda ids: db.session.query(ArchivedLike.post_id)
+            .filter(ArchivedLike.user_id == viewer_id, ArchivedLike.post_id.in_(ids)),
+        post_ids)}
+    
+    comment_counts = {}
+    for comment in comments:
+        comment_counts[comment.post_id] = comment_counts.get(comment.post_id, 0) + 1
+    top_level = [comment for comment in comments if comment.parent_id is None]
+    replies = [comment for comment in comments if comment.parent_id is not None]
+    users = get_user_summaries({post.user_id for post in posts} | comment_user_ids(comments))
+    
+    threads_by_post = {}
+    for comment, comment_data in assemble_threads(top_level, replies, users):
+        threads_by_post.setdefault(comment.post_id, []).append(comment_data)
+    
+    result = []
+    for post in posts:
+        threads = [] if post.comments_disabled else threads_by_post.get(post.id, [])
+        post_data = serialize_post(post, users, like_counts.get(post.id, 0), comment_counts.get(post.id, 0), threads)
+        post_data.update({'is_liked': post.id in liked_ids, 'archived': True})
+        result.append(post_data)
+    return result
+
+# 分页获取归档动态，可按发布者筛选
+@app.route('/api/archive/posts', methods=['GET'])
+def get_archived_posts():
+    user_id = request.args.get('user_id')
+    
+    if not user_id:
+        return jsonify({'error': '用户ID不能为空'}), 401
+    
+    try:
+        limit, cursor, cursor_key = parse_page_args(FEED_DEFAULT_LIMIT, FEED_MAX_LIMIT)
+        author_id = request.args.get('author_id', type=int)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    user = get_user_summary(user_id)
+    if not user:
+        return jsonify({'error': '用户不存在'}), 404
+    
+    query = db.session.query(*ARCHIVED_POST_COLUMNS).order_by(ArchivedPost.created_at.desc(), ArchivedPost.id.desc())
+    if author_id:
+        query = query.filter(ArchivedPost.user_id == author_id)
+    if cursor_key:
+        query = query.filter(after_cursor(ArchivedPost, cursor_key, descending=True))
+    
+    # 多取一条用于判断是否还有下一页
+    posts = query.limit(limit + 1).all()
+    has_more = len(posts) > limit
+    posts = posts[:limit]
+    
+    return jsonify({
+        'posts': build_archive_body(posts, user.id),
+        'next_cursor': encode_cursor(posts[-1]) if has_more else None,
+        'has_more': has_more
+    }), 200
+
 # 删除动态
 @app.route('/api/posts/<int:post_id>', methods=['DELETE'])
 def delete_post(post_id):
@@ -654,11 +1629,11 @@ def delete_post(post_id):
     if not user_id:
         return jsonify({'error': '用户ID不能为空'}), 400
     
-    post = Post.query.get(post_id)
+    post = get_live_post(post_id)
     if not post:
         return jsonify({'error': '动态不存在'}), 404
     
-    user = User.query.get(user_id)
+    user = get_user_summary(user_id)
     if not user:
         return jsonify({'error': '用户不存在'}), 404
     
@@ -669,24 +1644,9 @@ def delete_post(post_id):
         return jsonify({'error': '没有权限删除此动态'}), 403
     
     try:
-        # 删除与动态相关的所有内容
-        
-        # 1. 删除与该动态相关的所有点赞
-        likes = Like.query.filter_by(post_id=post.id).all()
-        for like in likes:
-            db.session.delete(like)
-        
-        # 2. 删除与该动态相关的所有评论和回复
-        comments = Comment.query.filter_by(post_id=post.id).all()
-        for comment in comments:
-            # 删除该评论下的所有回复
-            replies = Comment.query.filter_by(parent_id=comment.id).all()
-            for reply in replies:
-                db.session.delete(reply)
-            db.session.delete(comment)
-        
-        # 3. 删除动态
-        db.session.delete(post)
+        # 只标记删除时间，点赞、评论、图片文件和动态本身由 purger.py 在后台删除
+        post.deleted_at = beijing_time()
+        record_feed_change('post_delete', post.id)
         db.session.commit()
         
         return jsonify({'message': '动态已成功删除'}), 200
@@ -703,10 +1663,10 @@ def delete_comment(comment_id):
         return jsonify({'error': '用户ID不能为空'}), 400
     
     comment = Comment.query.get(comment_id)
-    if not comment:
+    if not comment or comment.post.deleted_at:
         return jsonify({'error': '评论不存在'}), 404
     
-    user = User.query.get(user_id)
+    user = get_user_summary(user_id)
     if not user:
         return jsonify({'error': '用户不存在'}), 404
     
@@ -715,13 +1675,13 @@ def delete_comment(comment_id):
         return jsonify({'error': '没有权限删除此评论'}), 403
     
     try:
-        # 删除该评论下的所有回复
-        replies = Comment.query.filter_by(parent_id=comment.id).all()
-        for reply in replies:
-            db.session.delete(reply)
-        
-        # 删除评论
-        db.session.delete(comment)
+        # 一次删除评论及其下的所有回复，然后重算涉及的动态的评论数
+        this_comment = lambda c: c.id == comment.id
+        affected_post_ids = comment_post_ids(this_comment)
+        delete_comments_where(this_comment)
+        refresh_post_counters(affected_post_ids)
+        record_feed_change('comment_delete', comment.post_id)
+        record_feed_changes('recount', affected_post_ids - {comment.post_id})
         db.session.commit()
         
         return jsonify({'message': '评论已成功删除'}), 200
@@ -739,11 +1699,11 @@ def toggle_disable_comments(post_id):
     
     user_id = data.get('user_id')
     
-    post = Post.query.get(post_id)
+    post = get_live_post(post_id)
     if not post:
         return jsonify({'error': '动态不存在'}), 404
     
-    user = User.query.get(user_id)
+    user = get_user_summary(user_id)
     if not user:
         return jsonify({'error': '用户不存在'}), 404
     
@@ -756,6 +1716,7 @@ def toggle_disable_comments(post_id):
     try:
         # 切换评论禁用状态
         post.comments_disabled = not post.comments_disabled
+        record_feed_change('post_update', post.id)
         db.session.commit()
         
         status = '禁止' if post.comments_disabled else '允许'
@@ -795,6 +1756,20 @@ def init_db():
     except Exception as e:
         return jsonify({'error': f'重置数据库失败: {str(e)}'}), 500
 
+def serialize_user_rows(users):
+    """用户列表的序列化，users 为 USER_LIST_COLUMNS 查询得到的行"""
+    return [{
+        'id': user.id,
+        'username': user.username,
+        'real_name': user.real_name,
+        'is_teacher': user.is_teacher,
+        'is_admin': user.is_admin,
+        'is_active': user.is_active,
+        'grade': user.grade,
+        'class_name': user.class_name,
+        'created_at': user.created_at.isoformat()
+    } for user in users]
+
 # 获取用户列表（仅管理员可用）
 @app.route('/api/users', methods=['GET'])
 def get_users():
@@ -803,29 +1778,17 @@ def get_users():
     if not user_id:
         return jsonify({'error': '用户ID不能为空'}), 401
     
-    admin = User.query.get(user_id)
+    admin = get_user_summary(user_id)
     if not admin or not admin.is_admin:
         return jsonify({'error': '权限不足，只有超级管理员可以查看用户列表'}), 403
     
     # 排除超级管理员自己
-    users = User.query.filter(User.id != admin.id).order_by(User.created_at.desc()).all()
+    users = (db.session.query(*USER_LIST_COLUMNS)
+             .filter(User.id != admin.id, User.deleted_at.is_(None))
+             .order_by(User.created_at.desc())
+             .all())
     
-    result = []
-    for user in users:
-        user_data = {
-            'id': user.id,
-            'username': user.username,
-            'real_name': user.real_name,
-            'is_teacher': user.is_teacher,
-            'is_admin': user.is_admin,
-            'is_active': user.is_active,
-            'grade': user.grade,
-            'class_name': user.class_name,
-            'created_at': user.created_at.isoformat()
-        }
-        result.append(user_data)
-    
-    return jsonify(result), 200
+    return jsonify(serialize_user_rows(users)), 200
 
 # 禁用/启用用户（仅管理员可用）
 @app.route('/api/users/<int:target_user_id>/toggle-active', methods=['PUT'])
@@ -837,11 +1800,11 @@ def toggle_user_active(target_user_id):
     
     admin_id = data.get('user_id')
     
-    admin = User.query.get(admin_id)
+    admin = get_user_summary(admin_id)
     if not admin or not admin.is_admin:
         return jsonify({'error': '权限不足，只有超级管理员可以禁用/启用用户'}), 403
     
-    target_user = User.query.get(target_user_id)
+    target_user = get_live_user(target_user_id)
     if not target_user:
         return jsonify({'error': '目标用户不存在'}), 404
     
@@ -851,6 +1814,7 @@ def toggle_user_active(target_user_id):
     
     # 切换用户状态
     target_user.is_active = not target_user.is_active
+    invalidate_user_summary(target_user.id)
     
     try:
         db.session.commit()
@@ -881,11 +1845,11 @@ def reset_user_password(target_user_id):
     if not any(c.isalpha() for c in new_password) or not any(c.isdigit() for c in new_password):
         return jsonify({'error': '密码必须包含字母和数字'}), 400
     
-    admin = User.query.get(admin_id)
+    admin = get_user_summary(admin_id)
     if not admin or not admin.is_admin:
         return jsonify({'error': '权限不足，只有超级管理员可以重置密码'}), 403
     
-    target_user = User.query.get(target_user_id)
+    target_user = get_live_user(target_user_id)
     if not target_user:
         return jsonify({'error': '目标用户不存在'}), 404
     
@@ -893,6 +1857,7 @@ def reset_user_password(target_user_id):
     
     # 重置密码
     target_user.password_hash = generate_password_hash(new_password)
+    invalidate_user_summary(target_user.id)
     
     try:
         db.session.commit()
@@ -923,7 +1888,7 @@ def change_password():
         return jsonify({'error': '新密码必须包含字母和数字'}), 400
     
     # 获取用户
-    user = User.query.get(user_id)
+    user = get_live_user(user_id)
     if not user:
         return jsonify({'error': '用户不存在'}), 404
     
@@ -952,11 +1917,11 @@ def delete_user(target_user_id):
     if not user_id:
         return jsonify({'error': '管理员ID不能为空'}), 400
     
-    admin = User.query.get(user_id)
+    admin = get_user_summary(user_id)
     if not admin or not admin.is_admin:
         return jsonify({'error': '权限不足，只有超级管理员可以删除用户'}), 403
     
-    target_user = User.query.get(target_user_id)
+    target_user = get_live_user(target_user_id)
     if not target_user:
         return jsonify({'error': '目标用户不存在'}), 404
     
@@ -965,46 +1930,45 @@ def delete_user(target_user_id):
         return jsonify({'error': '不能删除自己的账号'}), 400
     
     try:
-        # 删除用户相关的所有内容
-        # 1. 删除该用户的点赞
-        likes = Like.query.filter_by(user_id=target_user_id).all()
-        for like in likes:
-            db.session.delete(like)
-        
-        # 2. 删除该用户的评论和回复
-        comments = Comment.query.filter_by(user_id=target_user_id).all()
-        for comment in comments:
-            # 删除该评论下的所有回复
-            replies = Comment.query.filter_by(parent_id=comment.id).all()
-            for reply in replies:
-                db.session.delete(reply)
-            db.session.delete(comment)
-        
-        # 3. 删除该用户的动态
-        posts = Post.query.filter_by(user_id=target_user_id).all()
-        for post in posts:
-            # 删除与该动态相关的所有点赞
-            post_likes = Like.query.filter_by(post_id=post.id).all()
-            for like in post_likes:
-                db.session.delete(like)
-            
-            # 删除与该动态相关的所有评论和回复
-            post_comments = Comment.query.filter_by(post_id=post.id).all()
-            for comment in post_comments:
-                # 删除该评论下的所有回复
-                replies = Comment.query.filter_by(parent_id=comment.id).all()
-                for reply in replies:
-                    db.session.delete(reply)
-                db.session.delete(comment)
-            
-            # 删除动态
-            db.session.delete(post)
-        
-        # 4. 最后删除用户
-        db.session.delete(target_user)
+        real_name = target_user.real_name
+        now = beijing_time()
+        post_ids = [row.id for row in db.session.query(Post.id).filter(
+            Post.user_id == target_user_id, Post.deleted_at.is_(None))]
+        
+        # 1. 标记用户和该用户的动态为已删除，动态下的点赞、评论和图片由 purger.py 在后台删除，用户随后删除
+        target_user.deleted_at = now
+        target_user.is_active = False
+        Post.query.filter(Post.user_id == target_user_id, Post.deleted_at.is_(None)).update(
+            {Post.deleted_at: now}, synchronize_session=False)
+        record_feed_changes('post_delete', post_ids)
+        
+        # 2. 该用户在其他动态下的点赞、评论及其回复会影响他人动态的内容和计数，立即删除
+        #    （包括该用户自己已标记删除的动态，这些动态的计数同样重算，归档或恢复时才正确）
+        user_comments = lambda comment: comment.user_id == target_user_id
+        liked_post_ids = {row.post_id for row in db.session.query(Like.post_id).filter(Like.user_id == target_user_id)}
+        touched_post_ids = liked_post_ids | comment_post_ids(user_comments)
+        affected_post_ids = touched_post_ids.difference(post_ids)
+        Like.query.filter(Like.user_id == target_user_id).delete(synchronize_session=False)
+        delete_comments_where(user_comments)
+        
+        # 3. 归档表中的同类内容（归档动态的计数实时统计，无需重算）
+        archived_post_ids = db.select(ArchivedPost.id).where(ArchivedPost.user_id == target_user_id)
+        ArchivedLike.query.filter(db.or_(ArchivedLike.user_id == target_user_id,
+                                         ArchivedLike.post_id.in_(archived_post_ids))).delete(synchronize_session=False)
+        delete_comments_where(lambda comment: db.or_(comment.user_id == target_user_id,
+                                                     comment.post_id.in_(archived_post_ids)), ArchivedComment)
+        release_image_references(row.images for row in db.session.query(ArchivedPost.images).filter(
+            ArchivedPost.user_id == target_user_id))
+        ArchivedPost.query.filter_by(user_id=target_user_id).delete(synchronize_session=False)
+        
+        # 4. 重算被删除了点赞、评论的动态上的计数，其他用户的动态通知客户端更新
+        refresh_post_counters(touched_post_ids)
+        record_feed_changes('recount', affected_post_ids)
+        record_feed_change('user', user_id=target_user_id)
+        invalidate_user_summary(target_user_id)
         db.session.commit()
         
-        return jsonify({'message': f'用户 {target_user.real_name} 已成功删除'}), 200
+        return jsonify({'message': f'用户 {real_name} 已成功删除'}), 200
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': f'删除用户失败: {str(e)}'}), 500
@@ -1029,7 +1993,7 @@ def get_system_config():
     
     # 以下配置需要认证
     if user_id:
-        user = User.query.get(user_id)
+        user = get_user_summary(user_id)
         if not user:
             return jsonify({'error': '用户不存在'}), 404
     else:
@@ -1074,7 +2038,7 @@ def update_system_config():
     description = data.get('description')
     
     # 验证是否为超级管理员
-    admin = User.query.get(admin_id)
+    admin = get_user_summary(admin_id)
     if not admin or not admin.is_admin:
         return jsonify({'error': '权限不足，只有超级管理员可以修改系统配置'}), 403
     
@@ -1090,6 +2054,45 @@ def update_system_config():
         db.session.rollback()
         return jsonify({'error': f'更新系统配置失败: {str(e)}'}), 500
 
+# 数据库备份文件：SQLite 为数据库文件副本，PostgreSQL 为 pg_dump 的自定义格式转储
+DATABASE_BACKUP_NAMES = {'sqlite': 'school.db', 'postgresql': 'school.dump'}
+
+def database_backup_name():
+    return DATABASE_BACKUP_NAMES[db.engine.dialect.name]
+
+def run_pg_tool(args):
+    """调用 pg_dump/pg_restore，密码通过环境变量传递，不出现在进程列表中"""
+    url = db.engine.url
+    dsn = url.set(drivername='postgresql', password=None).render_as_string(hide_password=False)
+    env = dict(os.environ, PGPASSWORD=url.password or '')
+    result = subprocess.run(args + ['--dbname', dsn], env=env, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.decode('utf-8', 'replace').strip() or f'{args[0]} 执行失败')
+
+def backup_database(backup_dir):
+    """把当前数据库备份到 backup_dir"""
+    backup_db_path = os.path.join(backup_dir, database_backup_name())
+    if db.engine.dialect.name == 'sqlite':
+        copy_database(db.engine.url.database, backup_db_path)
+    else:
+        run_pg_tool(['pg_dump', '--format=custom', '--no-owner', '--file', backup_db_path])
+    return backup_db_path
+
+def restore_database(backup_db_path):
+    """用备份覆盖当前数据库，调用前需释放所有连接"""
+    if db.engine.dialect.name == 'sqlite':
+        # 通过备份接口写入，WAL 模式下直接覆盖文件会与残留的 -wal 文件不一致
+        copy_database(backup_db_path, db.engine.url.database)
+    else:
+        run_pg_tool(['pg_restore', '--clean', '--if-exists', '--no-owner', '--single-transaction', backup_db_path])
+
+def sync_id_sequence(model):
+    """显式指定主键插入后，让 PostgreSQL 的自增序列跟上当前最大ID"""
+    if db.engine.dialect.name == 'postgresql':
+        table = model.__tablename__
+        db.session.execute(db.text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT MAX(id) FROM {table}))"))
+
 # 一键备份系统
 @app.route('/api/system/backup', methods=['POST'])
 def backup_system():
@@ -1101,7 +2104,7 @@ def backup_system():
     admin_id = data.get('user_id')
     
     # 验证是否为超级管理员
-    admin = User.query.get(admin_id)
+    admin = get_user_summary(admin_id)
     if not admin or not admin.is_admin:
         return jsonify({'error': '权限不足，只有超级管理员可以执行此操作'}), 403
     
@@ -1115,20 +2118,13 @@ def backup_system():
         os.makedirs(backup_dir, exist_ok=True)
         
         # 备份数据库
-        db_path = os.path.join(basedir, 'instance', 'school.db')
-        backup_db_path = os.path.join(backup_dir, 'school.db')
-        shutil.copy2(db_path, backup_db_path)
+        backup_database(backup_dir)
         
-        # 备份上传目录
+        # 备份上传目录，只复制原图（按相同的分层目录保存），不复制各尺寸版本
         uploads_path = app.config['UPLOAD_FOLDER']
         backup_uploads_path = os.path.join(backup_dir, 'uploads')
         os.makedirs(backup_uploads_path, exist_ok=True)
-        
-        # 仅复制文件，不复制目录结构
-        for filename in os.listdir(uploads_path):
-            file_path = os.path.join(uploads_path, filename)
-            if os.path.isfile(file_path):
-                shutil.copy2(file_path, os.path.join(backup_uploads_path, filename))
+        copy_originals(uploads_path, backup_uploads_path)
         
         return jsonify({
             'message': f'系统备份成功，备份已保存到 {backup_dir}',
@@ -1149,7 +2145,7 @@ def clear_system():
     admin_id = data.get('user_id')
     
     # 验证是否为超级管理员
-    admin = User.query.get(admin_id)
+    admin = get_user_summary(admin_id)
     if not admin or not admin.is_admin:
         return jsonify({'error': '权限不足，只有超级管理员可以执行此操作'}), 403
     
@@ -1163,20 +2159,13 @@ def clear_system():
         os.makedirs(backup_dir, exist_ok=True)
         
         # 备份数据库
-        db_path = os.path.join(basedir, 'instance', 'school.db')
-        backup_db_path = os.path.join(backup_dir, 'school.db')
-        shutil.copy2(db_path, backup_db_path)
+        backup_database(backup_dir)
         
-        # 备份上传目录
+        # 备份上传目录，只复制原图（按相同的分层目录保存），不复制各尺寸版本
         uploads_path = app.config['UPLOAD_FOLDER']
         backup_uploads_path = os.path.join(backup_dir, 'uploads')
         os.makedirs(backup_uploads_path, exist_ok=True)
-        
-        # 仅复制文件，不复制目录结构
-        for filename in os.listdir(uploads_path):
-            file_path = os.path.join(uploads_path, filename)
-            if os.path.isfile(file_path):
-                shutil.copy2(file_path, os.path.join(backup_uploads_path, filename))
+        copy_originals(uploads_path, backup_uploads_path)
         
         # 清空系统数据，但保留超级管理员用户
         # 1. 删除所有点赞
@@ -1185,8 +2174,11 @@ def clear_system():
         # 2. 删除所有评论
         db.session.query(Comment).delete()
         
-        # 3. 删除所有动态
+        # 3. 删除所有动态（包括已归档的动态、评论和点赞）
         db.session.query(Post).delete()
+        for archive_model in (ArchivedLike, ArchivedComment, ArchivedPost):
+            db.session.query(archive_model).delete()
+        db.session.query(ImageBlob).delete()
         
         # 4. 删除除了超级管理员以外的所有用户
         admin_users = User.query.filter_by(is_admin=True).all()
@@ -1198,12 +2190,13 @@ def clear_system():
         if admin_user:
             admin_user.password_hash = generate_password_hash('yzxm5t1234s')
         
-        # 6. 清空上传目录，但保留目录结构
-        for filename in os.listdir(uploads_path):
-            file_path = os.path.join(uploads_path, filename)
-            if os.path.isfile(file_path):
-                os.remove(file_path)
+        # 6. 清空上传目录（包括各尺寸图片），但保留上传目录本身
+        clear_originals(uploads_path)
+        clear_variants(uploads_path)
+        image_stats.clear()
         
+        record_feed_change('clear')
+        invalidate_user_summary()
         db.session.commit()
         
         return jsonify({
@@ -1224,7 +2217,7 @@ def get_backups():
         return jsonify({'error': '管理员ID不能为空'}), 400
     
     # 验证是否为超级管理员
-    admin = User.query.get(user_id)
+    admin = get_user_summary(user_id)
     if not admin or not admin.is_admin:
         return jsonify({'error': '权限不足，只有超级管理员可以查看备份'}), 403
     
@@ -1248,7 +2241,7 @@ def get_backups():
                     formatted_time = timestamp
                 
                 # 检查是否包含数据库和上传文件
-                has_db = os.path.exists(os.path.join(path, 'school.db'))
+                has_db = any(os.path.exists(os.path.join(path, name)) for name in DATABASE_BACKUP_NAMES.values())
                 has_uploads = os.path.exists(os.path.join(path, 'uploads'))
                 
                 backups.append({
@@ -1278,7 +2271,7 @@ def restore_system():
     backup_path = data.get('backup_path')
     
     # 验证是否为超级管理员
-    admin = User.query.get(admin_id)
+    admin = get_user_summary(admin_id)
     if not admin or not admin.is_admin:
         return jsonify({'error': '权限不足，只有超级管理员可以执行此操作'}), 403
     
@@ -1294,7 +2287,7 @@ def restore_system():
             return jsonify({'error': '指定的备份不存在'}), 404
         
         # 检查备份是否完整
-        backup_db_path = os.path.join(backup_path, 'school.db')
+        backup_db_path = os.path.join(backup_path, database_backup_name())
         backup_uploads_path = os.path.join(backup_path, 'uploads')
         
         if not os.path.exists(backup_db_path):
@@ -1308,34 +2301,48 @@ def restore_system():
         os.makedirs(current_backup_dir, exist_ok=True)
         
         # 备份当前数据库
-        db_path = os.path.join(basedir, 'instance', 'school.db')
-        current_backup_db_path = os.path.join(current_backup_dir, 'school.db')
-        shutil.copy2(db_path, current_backup_db_path)
+        backup_database(current_backup_dir)
         
         # 备份当前上传目录
         uploads_path = app.config['UPLOAD_FOLDER']
         current_backup_uploads_path = os.path.join(current_backup_dir, 'uploads')
         os.makedirs(current_backup_uploads_path, exist_ok=True)
+        copy_originals(uploads_path, current_backup_uploads_path)
         
-        for filename in os.listdir(uploads_path):
-            file_path = os.path.join(uploads_path, filename)
-            if os.path.isfile(file_path):
-                shutil.copy2(file_path, os.path.join(current_backup_uploads_path, filename))
+        # 恢复数据库前记录当前动态版本号
+        previous_version = current_feed_version()
+        previous_generation = current_user_generation()
+        db.session.remove()
+        db.engine.dispose()
         
         # 恢复数据库
-        shutil.copy2(backup_db_path, db_path)
-        
-        # 清空当前上传目录
-        for filename in os.listdir(uploads_path):
-            file_path = os.path.join(uploads_path, filename)
-            if os.path.isfile(file_path):
-                os.remove(file_path)
+        restore_database(backup_db_path)
+        
+        # 清空当前上传目录并恢复上传文件；备份中只有原图，恢复后由图片处理服务重新生成其他尺寸，此前返回原图
+        # 旧备份中平铺的文件同样按分层目录恢复
+        clear_originals(uploads_path)
+        clear_variants(uploads_path)
+        image_stats.clear()
+        copy_originals(backup_uploads_path, uploads_path)
+        
+        # 旧备份可能缺少后来添加的列和索引，先升级到当前结构（旧规则命名的图片在升级时改为按内容命名）
+        upgrade_database(db)
+        # 按恢复的文件和动态重算图片引用数
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            fold_uploads(connection, db.metadata, uploads_path)
+        # 恢复后的版本号可能小于各工作进程已缓存的版本号，追加一条变更使其严格大于恢复前的版本
+        restored_version = current_feed_version()
+        bump_user_generation(at_least=max(previous_generation, current_user_generation()))
+        user_cache.invalidate()
+        change = record_feed_change('restore')
+        change.id = max(previous_version, restored_version) + 1
+        db.session.flush()
+        sync_id_sequence(FeedChange)
+        db.session.commit()
+        feed_cache.clear()
         
-        # 恢复上传文件
-        for filename in os.listdir(backup_uploads_path):
-            file_path = os.path.join(backup_uploads_path, filename)
-            if os.path.isfile(file_path):
-                shutil.copy2(file_path, os.path.join(uploads_path, filename))
+        if not image_tasks.request_backfill():
+            print("图片处理服务未启动，请运行 python image_variants.py 为恢复的图片生成其他尺寸")
         
         return jsonify({
             'message': '系统已成功恢复',
@@ -1356,7 +2363,7 @@ def admin_add_user():
     admin_id = data.get('admin_id')
     
     # 验证操作者是否为超级管理员
-    admin = User.query.get(admin_id)
+    admin = get_user_summary(admin_id)
     if not admin or not admin.is_admin:
         return jsonify({'error': '权限不足，只有超级管理员可以添加用户'}), 403
     
@@ -1450,6 +2457,83 @@ def admin_add_user():
         return jsonify({'error': f'创建用户失败: {str(e)}'}), 500
 
 # 批量导入学生账号
+# 批量导入：每个 INSERT 语句写入的行数，以及不同密码达到多少个时改用进程池计算哈希
+IMPORT_INSERT_CHUNK_SIZE = 200
+PARALLEL_HASH_MIN_PASSWORDS = 4
+DEFAULT_STUDENT_PASSWORD = "yzx1234s"
+
+def hash_passwords(passwords):
+    """
+    为每个不同的密码计算一次哈希，返回 {密码: 哈希}。
+    相同密码（通常是默认密码）共用同一个哈希；首次登录必须修改密码，修改后各自重新加盐。
+    不同密码较多时分散到多个进程计算，哈希计算是 CPU 密集的，线程无法并行
+    """
+    distinct = list(dict.fromkeys(passwords))
+    if len(distinct) < PARALLEL_HASH_MIN_PASSWORDS:
+        return {password: generate_password_hash(password) for password in distinct}
+    workers = min(len(distinct), app.config['PASSWORD_HASH_WORKERS'])
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        hashes = executor.map(generate_password_hash, distinct, chunksize=max(1, len(distinct) // (workers * 4)))
+        return dict(zip(distinct, hashes))
+
+def validate_student_fields(student):
+    """检查用户名、密码格式，返回 (错误信息, 用户名, 密码)，通过时错误信息为 None"""
+    if not student.get('username') or not student.get('grade') or not student.get('class_name'):
+        return '用户名、年级和班级不能为空', None, None
+    
+    # 验证用户名：6-16个字符，首字符必须是字母
+    username = student['username']
+    if not (6 <= len(username) <= 16):
+        return '用户名长度必须在6-16个字符之间', None, None
+    if not username[0].isalpha():
+        return '用户名必须以字母开头', None, None
+    
+    # 处理密码：如果为空，使用固定的默认密码
+    password = student.get('password', '')
+    if not password:
+        password = DEFAULT_STUDENT_PASSWORD
+    else:
+        if len(password) < 7:
+            return '密码长度不能少于7位', None, None
+        if not any(c.isalpha() for c in password) or not any(c.isdigit() for c in password):
+            return '密码必须包含字母和数字', None, None
+    return None, username, password
+
+def validate_grade_and_class(student):
+    """返回 (错误信息, 年级, 班级)"""
+    try:
+        grade = int(student['grade'])
+        class_name = int(student['class_name'])
+    except (ValueError, TypeError):
+        return '年级和班级必须是数字', None, None
+    if not (1 <= grade <= 5 and 1 <= class_name <= 6):
+        return '年级必须在1-5年级之间，班级必须在1-6班之间', None, None
+    return None, grade, class_name
+
+def student_row(username, password_hash, real_name, grade, class_name):
+    return {
+        'username': username,
+        'password_hash': password_hash,
+        'real_name': real_name,
+        'is_teacher': False,  # 一定是学生
+        'is_admin': False,  # 一定不是管理员
+        'is_active': True,  # 默认启用
+        'can_post': True,  # 默认允许发布内容
+        'is_first_login': True,  # 必须首次登录修改密码和姓名
+        'grade': grade,
+        'class_name': class_name
+    }
+
+def insert_students(rows):
+    """分块批量插入学生账号，由调用方提交"""
+    for i in range(0, len(rows), IMPORT_INSERT_CHUNK_SIZE):
+        db.session.execute(db.insert(User), rows[i:i + IMPORT_INSERT_CHUNK_SIZE])
+
+def find_existing_usernames(usernames):
+    """返回已存在的用户名集合（包括已删除、等待清理的用户）"""
+    return {row.username for row in query_in_chunks(
+        lambda names: db.session.query(User.username).filter(User.username.in_(names)), usernames)}
+
 @app.route('/api/admin/import-students', methods=['POST'])
 def import_students():
     data = request.get_json()
@@ -1461,7 +2545,7 @@ def import_students():
     students = data.get('students')
     
     # 验证操作者是否为超级管理员
-    admin = User.query.get(admin_id)
+    admin = get_user_summary(admin_id)
     if not admin or not admin.is_admin:
         return jsonify({'error': '权限不足，只有超级管理员可以批量导入账号'}), 403
     
@@ -1469,131 +2553,165 @@ def import_students():
     if not isinstance(students, list) or len(students) == 0:
         return jsonify({'error': '学生数据格式不正确或为空'}), 400
     
-    # 创建的用户列表
-    created_users = []
     errors = []
     
+    def reject(index, message):
+        errors.append({'index': index, 'error': message, 'data': students[index]})
+    
+    # 1. 逐行检查用户名和密码格式
+    candidates = []
     for i, student in enumerate(students):
-        # 验证必需字段
-        if not student.get('username') or not student.get('grade') or not student.get('class_name'):
-            errors.append({
-                'index': i,
-                'error': '用户名、年级和班级不能为空',
-                'data': student
-            })
-            continue
-        
-        # 验证用户名：6-16个字符，首字符必须是字母
-        username = student['username']
-        if not (6 <= len(username) <= 16):
-            errors.append({
-                'index': i,
-                'error': '用户名长度必须在6-16个字符之间',
-                'data': student
-            })
-            continue
-        
-        if not username[0].isalpha():
-            errors.append({
-                'index': i,
-                'error': '用户名必须以字母开头',
-                'data': student
-            })
-            continue
-        
-        # 处理密码：如果为空，生成默认密码
-        password = student.get('password', '')
-        if not password:
-            # 使用固定的默认密码
-            password = "yzx1234s"
+        error, username, password = validate_student_fields(student)
+        if error:
+            reject(i, error)
         else:
-            # 验证用户提供的密码
-            if len(password) < 7:
-                errors.append({
-                    'index': i,
-                    'error': '密码长度不能少于7位',
-                    'data': student
-                })
-                continue
-            
-            if not any(c.isalpha() for c in password) or not any(c.isdigit() for c in password):
-                errors.append({
-                    'index': i,
-                    'error': '密码必须包含字母和数字',
-                    'data': student
-                })
-                continue
-        
-        # 检查用户名是否已存在
-        existing_user = User.query.filter_by(username=username).first()
-        if existing_user:
-            errors.append({
-                'index': i,
-                'error': '用户名已存在',
-                'data': student
-            })
+            candidates.append((i, student, username, password))
+    
+    # 2. 一次查询出已存在的用户名（包括已删除、等待清理的用户）
+    existing_usernames = find_existing_usernames({username for _, _, username, _ in candidates})
+    
+    # 3. 按原顺序检查重名和年级班级，本次导入中先出现的用户名同样视为已存在
+    accepted = []
+    for i, student, username, password in candidates:
+        if username in existing_usernames:
+            reject(i, '用户名已存在')
             continue
-        
-        # 验证年级和班级
-        try:
-            grade = int(student['grade'])
-            class_name = int(student['class_name'])
-            
-            if not (1 <= grade <= 5 and 1 <= class_name <= 6):
-                errors.append({
-                    'index': i,
-                    'error': '年级必须在1-5年级之间，班级必须在1-6班之间',
-                    'data': student
-                })
-                continue
-        except (ValueError, TypeError):
-            errors.append({
-                'index': i,
-                'error': '年级和班级必须是数字',
-                'data': student
-            })
+        error, grade, class_name = validate_grade_and_class(student)
+        if error:
+            reject(i, error)
             continue
-        
-        # 创建新用户
-        new_user = User(
-            username=username,
-            password_hash=generate_password_hash(password),
-            real_name=student.get('real_name', username),  # 如果real_name为空，使用username作为默认值
-            is_teacher=False,  # 一定是学生
-            is_admin=False,  # 一定不是管理员
-            is_active=True,  # 默认启用
-            can_post=True,  # 默认允许发布内容
-            is_first_login=True,  # 必须首次登录修改密码和姓名
-            grade=grade,
-            class_name=class_name
-        )
-        
-        try:
-            db.session.add(new_user)
-            created_users.append({
-                'username': new_user.username,
-                'grade': new_user.grade,
-                'class_name': new_user.class_name,
-                'password': password  # 返回生成的密码
-            })
-        except Exception as e:
-            errors.append({
-                'index': i,
-                'error': f'创建用户失败: {str(e)}',
-                'data': student
-            })
+        existing_usernames.add(username)
+        accepted.append((student, username, password, grade, class_name))
+    errors.sort(key=lambda error: error['index'])
     
-    # 提交事务
     try:
+        # 4. 每个不同的密码只计算一次哈希，然后分块批量插入
+        password_hashes = hash_passwords(password for _, _, password, _, _ in accepted)
+        # 如果real_name为空，使用username作为默认值
+        insert_students([student_row(username, password_hashes[password], student.get('real_name', username),
+                                     grade, class_name)
+                         for student, username, password, grade, class_name in accepted])
         db.session.commit()
-        return jsonify({
-            'message': f'成功导入 {len(created_users)} 个学生账号',
-            'created_users': created_users,
-            'errors': errors
-        }), 201
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': f'批量导入失败: {str(e)}'}), 500
+    
+    created_users = [{
+        'username': username,
+        'grade': grade,
+        'class_name': class_name,
+        'password': password  # 返回生成的密码
+    } for _, username, password, grade, class_name in accepted]
+    return jsonify({
+        'message': f'成功导入 {len(created_users)} 个学生账号',
+        'created_users': created_users,
+        'errors': errors
+    }), 201
+
+# 上传 Excel/CSV 花名册批量导入学生账号
+# 文件按行流式读取，每 IMPORT_ROSTER_CHUNK_SIZE 行校验、查重、插入并提交一次，内存占用与文件大小无关
+IMPORT_ROSTER_CHUNK_SIZE = 1000
+
+def import_progress_path(import_id):
+    """导入进度文件路径，import_id 只允许字母、数字、- 和 _，不合法时返回 None"""
+    if not import_id or len(import_id) > 64 or not all(c.isalnum() or c in '-_' for c in import_id):
+        return None
+    return os.path.join(app.config['IMPORT_PROGRESS_DIR'], f'{import_id}.json')
+
+@app.route('/api/user/batch_import', methods=['POST'])
+def batch_import_users():
+    admin = get_user_summary(request.form.get('admin_id'))
+    if not admin or not admin.is_admin:
+        return jsonify({'error': '权限不足，只有超级管理员可以批量导入账号'}), 403
+    
+    if 'file' not in request.files:
+        return jsonify({'error': '没有上传文件'}), 400
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({'error': '没有选择文件'}), 400
+    if not user_apis.allowed_file(file.filename):
+        return jsonify({'error': '不支持的文件格式，请上传 xlsx 或 CSV 文件'}), 400
+    
+    # 前端可以自带 import_id，上传过程中轮询 /api/user/batch_import/<import_id> 查看进度
+    import_id = request.form.get('import_id') or uuid.uuid4().hex
+    progress_path = import_progress_path(import_id)
+    if not progress_path:
+        return jsonify({'error': '导入ID格式不正确'}), 400
+    user_apis.expire_progress(app.config['IMPORT_PROGRESS_DIR'], app.config['IMPORT_PROGRESS_RETENTION_HOURS'] * 3600)
+    stats = user_apis.RosterImportStats(import_id)
+    try:
+        user_apis.create_progress(progress_path, stats)
+    except FileExistsError:
+        return jsonify({'error': '导入ID已被使用，请重新选择文件'}), 409
+    
+    def validate(record):
+        error, username, password = validate_student_fields({
+            'username': record['登录账号'],
+            'password': record.get('密码', ''),
+            'grade': record['年级'],
+            'class_name': record['班级']
+        })
+        if error:
+            return error, None
+        error, grade, class_name = validate_grade_and_class({'grade': record['年级'], 'class_name': record['班级']})
+        if error:
+            return error, None
+        return None, {
+            'username': username,
+            'password': password,
+            'real_name': record.get('姓名') or username,
+            'grade': grade,
+            'class_name': class_name
+        }
+    
+    # 默认密码的哈希整个导入只计算一次，其他密码按块计算
+    default_password_hash = generate_password_hash(DEFAULT_STUDENT_PASSWORD)
+    
+    def insert_users(accepted):
+        password_hashes = hash_passwords(row['password'] for row in accepted
+                                         if row['password'] != DEFAULT_STUDENT_PASSWORD)
+        password_hashes[DEFAULT_STUDENT_PASSWORD] = default_password_hash
+        insert_students([student_row(row['username'], password_hashes[row['password']], row['real_name'],
+                                     row['grade'], row['class_name']) for row in accepted])
+        db.session.commit()
+    
+    try:
+        records = user_apis.iter_roster_records(user_apis.iter_roster_rows(file.stream, file.filename))
+        user_apis.import_roster(records, validate, find_existing_usernames, insert_users, stats,
+                                chunk_size=IMPORT_ROSTER_CHUNK_SIZE,
+                                progress=lambda stats: user_apis.write_progress(progress_path, stats))
+    except user_apis.RosterError as e:
+        db.session.rollback()
+        message = str(e)
+        if stats.created:
+            message += f'（此前已导入 {stats.created} 个用户）'
+        return jsonify({'error': message, 'import_id': import_id}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'导入失败：{str(e)}（此前已导入 {stats.created} 个用户）', 'import_id': import_id}), 500
+    
+    return jsonify({
+        'message': f'成功导入 {stats.created} 个用户',
+        'import_id': import_id,
+        'processed': stats.processed,
+        'created': stats.created,
+        'failed': stats.failed,
+        'errors': stats.errors or None  # 最多返回 MAX_ERROR_MESSAGES 条，总数见 failed
+    })
+
+@app.route('/api/user/batch_import/<import_id>', methods=['GET'])
+def get_batch_import_progress(import_id):
+    admin = get_user_summary(request.args.get('user_id'))
+    if not admin or not admin.is_admin:
+        return jsonify({'error': '权限不足'}), 403
+    progress_path = import_progress_path(import_id)
+    if not progress_path:
+        return jsonify({'error': '导入ID格式不正确'}), 400
+    try:
+        with open(progress_path, encoding='utf-8') as progress_file:
+            return jsonify(json.load(progress_file))
+    except FileNotFoundError:
+        return jsonify({'error': '导入任务不存在'}), 404
 
 # 更新用户密码和个人信息（首次登录使用）
 @app.route('/api/users/update-profile', methods=['POST'])
@@ -1625,7 +2743,7 @@ def update_first_login_profile():
         print("错误: 姓名昵称必须是汉字")
         return jsonify({'error': '姓名昵称必须是汉字'}), 400
     
-    user = User.query.get(user_id)
+    user = get_live_user(user_id)
     if not user:
         print(f"错误: 未找到ID为{user_id}的用户")
         return jsonify({'error': '用户不存在'}), 404
@@ -1637,6 +2755,8 @@ def update_first_login_profile():
         user.password_hash = generate_password_hash(password)
         user.real_name = real_name
         user.is_first_login = False  # 标记为非首次登录
+        record_feed_change('user', user_id=user.id)
+        invalidate_user_summary(user.id)
         
         db.session.commit()
         print(f"更新用户信息 - 之后: id={user.id}, username={user.username}, is_first_login={user.is_first_login}")
@@ -1667,8 +2787,5 @@ def update_first_login_profile():
 
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()  # 确保所有表存在
-        # 初始化系统配置
-        if not SystemConfig.query.filter_by(key='register_enabled').first():
-            SystemConfig.set_config('register_enabled', 'true', '是否开启用户注册功能')
+        upgrade_database(db)  # 建表并执行未执行的迁移（含默认系统配置）
     app.run(host='0.0.0.0', port=5000, debug=True) 
\ No newline at end of file
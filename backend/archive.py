@@ -0,0 +1,96 @@
+"""
+冷热数据归档
+
+动态列表、评论和点赞的查询都在 post、comment、like 三张热表上进行，往年的内容会让这些表和索引一直增长。
+本脚本把发布时间早于指定天数的动态，连同它们的评论和点赞，分批移到 post_archive、comment_archive、
+like_archive 归档表（同一数据库，备份和恢复不需要额外处理）。每批在一个事务中完成：复制到归档表、
+从热表删除、为每条动态记录一次 'archive' 变更，客户端按删除处理，动态列表缓存随之失效。
+归档后的动态通过 /api/archive/posts 查看。
+
+挂在其他动态下、回复了被归档评论的回复改为顶层评论留在热表中，与删除评论时的处理一致。
+
+用法: python archive.py [--days 365] [--batch-size 200] [--dry-run]
+     天数默认取环境变量 CAMPUS_ARCHIVE_AFTER_DAYS，可配合 campus-archive.timer 定期执行
+"""
+
+import argparse
+import os
+import time
+from datetime import timedelta
+
+from app import (app, db, Post, Comment, Like, ArchivedPost, ArchivedComment, ArchivedLike,
+                 record_feed_changes, beijing_time)
+
+DEFAULT_ARCHIVE_AFTER_DAYS = int(os.environ.get('CAMPUS_ARCHIVE_AFTER_DAYS', 365))
+DEFAULT_BATCH_SIZE = 200
+
+
+def copy_rows(source, target, criteria, **values):
+    """INSERT INTO target SELECT ... FROM source WHERE criteria：同名列直接复制，values 为额外写入的固定值"""
+    names = [column.name for column in target.__table__.columns if column.name not in values]
+    columns = [source.__table__.c[name] for name in names]
+    columns += [db.literal(value, target.__table__.c[name].type) for name, value in values.items()]
+    statement = db.insert(target).from_select(names + list(values), db.select(*columns).where(criteria))
+    return db.session.execute(statement).rowcount
+
+
+def archive_batch(cutoff, batch_size):
+    """归档一批早于 cutoff 的动态并提交，返回 (动态数, 评论数, 点赞数)"""
+    # 已删除、等待 purger.py 清理的动态不归档
+    post_ids = [row.id for row in db.session.query(Post.id)
+                .filter(Post.created_at < cutoff, Post.deleted_at.is_(None))
+                .order_by(Post.created_at, Post.id).limit(batch_size)]
+    if not post_ids:
+        return 0, 0, 0
+
+    try:
+        archived_comments = db.select(Comment.id).where(Comment.post_id.in_(post_ids))
+        Comment.query.filter(Comment.parent_id.in_(archived_comments), Comment.post_id.not_in(post_ids)).update(
+            {Comment.parent_id: None}, synchronize_session=False)
+
+        comments = copy_rows(Comment, ArchivedComment, Comment.post_id.in_(post_ids))
+        likes = copy_rows(Like, ArchivedLike, Like.post_id.in_(post_ids))
+        copy_rows(Post, ArchivedPost, Post.id.in_(post_ids), archived_at=beijing_time())
+
+        Comment.query.filter(Comment.post_id.in_(post_ids)).delete(synchronize_session=False)
+        Like.query.filter(Like.post_id.in_(post_ids)).delete(synchronize_session=False)
+        Post.query.filter(Post.id.in_(post_ids)).delete(synchronize_session=False)
+        record_feed_changes('archive', post_ids)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return len(post_ids), comments, likes
+
+
+def archive_posts(days, batch_size=DEFAULT_BATCH_SIZE):
+    """归档发布时间早于 days 天的全部动态，返回 (动态数, 评论数, 点赞数)"""
+    cutoff = beijing_time() - timedelta(days=days)
+    totals = [0, 0, 0]
+    while True:
+        start = time.perf_counter()
+        counts = archive_batch(cutoff, batch_size)
+        if not counts[0]:
+            break
+        totals = [total + count for total, count in zip(totals, counts)]
+        print(f"归档 {counts[0]} 条动态、{counts[1]} 条评论、{counts[2]} 个点赞 "
+              f"({(time.perf_counter() - start) * 1000:.0f}ms)")
+    return tuple(totals)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='归档较早的动态')
+    parser.add_argument('--days', type=int, default=DEFAULT_ARCHIVE_AFTER_DAYS, help='归档发布超过多少天的动态')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='每个事务归档的动态数')
+    parser.add_argument('--dry-run', action='store_true', help='只统计，不归档')
+    args = parser.parse_args()
+
+    with app.app_context():
+        cutoff = beijing_time() - timedelta(days=args.days)
+        if args.dry_run:
+            pending = Post.query.filter(Post.created_at < cutoff, Post.deleted_at.is_(None)).count()
+            print(f"发布于 {cutoff:%Y-%m-%d %H:%M} 之前、待归档的动态: {pending} 条")
+        else:
+            print(f"开始归档发布于 {cutoff:%Y-%m-%d %H:%M} 之前的动态...")
+            posts, comments, likes = archive_posts(args.days, args.batch_size)
+            print(f"归档完成，共 {posts} 条动态、{comments} 条评论、{likes} 个点赞")
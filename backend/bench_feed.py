@@ -0,0 +1,153 @@
+"""
+动态列表与用户列表只读查询的性能对比
+
+在临时 SQLite 数据库中生成大量数据，分别用 ORM 实例和按列查询得到的行对象
+组装动态列表（分页与全量）和用户列表，输出耗时和 tracemalloc 峰值内存。
+
+用法: python bench_feed.py [--users 2000] [--posts 20000] [--comments 4] [--replies 2] [--likes 5] [--rounds 5]
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+parser = argparse.ArgumentParser(description='只读查询性能对比')
+parser.add_argument('--users', type=int, default=2000)
+parser.add_argument('--posts', type=int, default=20000)
+parser.add_argument('--comments', type=int, default=4, help='每条动态的顶层评论数')
+parser.add_argument('--replies', type=int, default=2, help='每条评论的回复数')
+parser.add_argument('--likes', type=int, default=5, help='每条动态的点赞数')
+parser.add_argument('--rounds', type=int, default=5)
+args = parser.parse_args()
+
+# 必须在导入 app 之前指定数据库，避免写入正式数据库
+db_file = os.path.join(tempfile.mkdtemp(prefix='campus_bench_'), 'bench.db')
+os.environ['CAMPUS_DATABASE_URI'] = 'sqlite:///' + db_file
+
+import app as campus
+from app import app, db, User, Post, Comment, Like
+
+
+def seed():
+    random.seed(42)
+    start = datetime(2024, 9, 1)
+    users = [{
+        'id': i, 'username': f'student{i:06d}', 'password_hash': 'x', 'real_name': f'学生{i}',
+        'is_teacher': i % 20 == 0, 'is_admin': i == 1, 'is_active': True, 'is_first_login': False,
+        'can_post': True, 'grade': i % 5 + 1, 'class_name': i % 6 + 1,
+        'created_at': start + timedelta(minutes=i)
+    } for i in range(1, args.users + 1)]
+    posts, comments, likes = [], [], []
+    comment_id = 0
+    for post_id in range(1, args.posts + 1):
+        created = start + timedelta(minutes=post_id * 3)
+        posts.append({
+            'id': post_id, 'user_id': random.randint(1, args.users), 'content': f'动态内容 {post_id} ' * 4,
+            'images': 'a.jpg,b.jpg' if post_id % 3 == 0 else '', 'created_at': created,
+            'comments_disabled': False, 'like_count': args.likes,
+            'comment_count': args.comments * (1 + args.replies)
+        })
+        for c in range(args.comments):
+            comment_id += 1
+            parent_id = comment_id
+            commenter = random.randint(1, args.users)
+            comments.append({
+                'id': comment_id, 'post_id': post_id, 'parent_id': None, 'user_id': commenter,
+                'replied_to_user_id': None, 'content': f'评论 {comment_id}',
+                'created_at': created + timedelta(seconds=c * 10)
+            })
+            for r in range(args.replies):
+                comment_id += 1
+                comments.append({
+                    'id': comment_id, 'post_id': post_id, 'parent_id': parent_id,
+                    'user_id': random.randint(1, args.users), 'replied_to_user_id': commenter,
+                    'content': f'回复 {comment_id}', 'created_at': created + timedelta(seconds=c * 10 + r + 1)
+                })
+        for liker in random.sample(range(1, args.users + 1), min(args.likes, args.users)):
+            likes.append({'user_id': liker, 'post_id': post_id, 'created_at': created})
+
+    with app.app_context():
+        db.create_all()
+        for model, rows in ((User, users), (Post, posts), (Comment, comments), (Like, likes)):
+            for i in range(0, len(rows), 5000):
+                db.session.execute(model.__table__.insert(), rows[i:i + 5000])
+        db.session.commit()
+    return len(comments), len(likes)
+
+
+def measure(label, func):
+    """多轮执行取最短耗时，另外单独执行一次统计峰值内存"""
+    timings = []
+    for _ in range(args.rounds):
+        with app.app_context():
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+    with app.app_context():
+        tracemalloc.start()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return label, min(timings), peak
+
+
+def use_orm_entities(enabled):
+    """切换组装函数使用 ORM 实例还是按列查询的行"""
+    if enabled:
+        campus.FEED_POST_COLUMNS = (Post,)
+        campus.FEED_COMMENT_COLUMNS = (Comment,)
+        campus.USER_LIST_COLUMNS = (User,)
+    else:
+        campus.FEED_POST_COLUMNS = ROW_COLUMNS['post']
+        campus.FEED_COMMENT_COLUMNS = ROW_COLUMNS['comment']
+        campus.USER_LIST_COLUMNS = ROW_COLUMNS['user']
+
+
+def feed_page():
+    posts = (db.session.query(*campus.FEED_POST_COLUMNS)
+             .order_by(Post.created_at.desc(), Post.id.desc())
+             .limit(campus.FEED_DEFAULT_LIMIT).all())
+    campus.build_feed_body(posts, campus.FEED_COMMENT_PREVIEW, campus.FEED_REPLY_PREVIEW)
+
+
+def feed_full():
+    posts = db.session.query(*campus.FEED_POST_COLUMNS).order_by(Post.created_at.desc(), Post.id.desc()).all()
+    campus.build_feed_body(posts)
+
+
+def user_list():
+    users = db.session.query(*campus.USER_LIST_COLUMNS).filter(User.id != 1).order_by(User.created_at.desc()).all()
+    campus.serialize_user_rows(users)
+
+
+ROW_COLUMNS = {
+    'post': campus.FEED_POST_COLUMNS,
+    'comment': campus.FEED_COMMENT_COLUMNS,
+    'user': campus.USER_LIST_COLUMNS
+}
+
+if __name__ == '__main__':
+    print(f"生成数据: {args.users} 个用户, {args.posts} 条动态 ...")
+    comment_total, like_total = seed()
+    print(f"共 {comment_total} 条评论, {like_total} 个点赞, 数据库: {db_file}\n")
+
+    print(f"{'场景':<12}{'模式':<8}{'最短耗时(ms)':>14}{'峰值内存(KB)':>16}")
+    for name, func in (('动态分页', feed_page), ('动态全量', feed_full), ('用户列表', user_list)):
+        results = {}
+        for mode in ('ORM', '行'):
+            use_orm_entities(mode == 'ORM')
+            _, seconds, peak = measure(name, func)
+            results[mode] = (seconds, peak)
+            print(f"{name:<12}{mode:<8}{seconds * 1000:>14.2f}{peak / 1024:>16.1f}")
+        orm, rows = results['ORM'], results['行']
+        print(f"{'':<12}{'提升':<8}{orm[0] / rows[0]:>13.2f}x{orm[1] / max(rows[1], 1):>15.2f}x")
+    use_orm_entities(False)
+
+    shutil.rmtree(os.path.dirname(db_file), ignore_errors=True)
+    sys.exit(0)
@@ -0,0 +1,222 @@
+"""
+花名册批量导入压测
+
+生成一个 --rows 行（默认 5 万）的学生花名册（xlsx 和 CSV 各一份），在临时 SQLite 数据库上
+通过 /api/user/batch_import 导入，输出耗时、每秒行数和导入期间 Python 内存峰值（tracemalloc）。
+作为对比，--baseline 额外测试“先把整个文件读入内存再导入”的方式；安装了 pandas 时同时测试
+旧实现使用的 pandas.read_excel + iterrows 读取整表的耗时和内存（只读取，不写库）。
+
+花名册中约 1% 的行是重复账号、1% 的年级不合法，用于检查错误统计；其余行使用默认密码。
+
+用法: python bench_import.py [--rows 50000] [--chunk-size 1000] [--baseline]
+"""
+
+import argparse
+import contextlib
+import csv
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from xml.sax.saxutils import escape
+
+HEADER = ['登录账号', '姓名', '年级', '班级', '密码']
+
+
+def roster_rows(count):
+    for i in range(count):
+        username = f'stu{i:07d}'
+        grade = (i % 5) + 1
+        if i % 100 == 37:
+            username = f'stu{i - 1:07d}'  # 与上一行重复
+        elif i % 100 == 71:
+            grade = 9  # 不合法的年级
+        yield [username, f'学生{i}', grade, (i % 6) + 1, '']
+
+
+def write_csv(path, rows):
+    with open(path, 'w', encoding='utf-8-sig', newline='') as roster:
+        writer = csv.writer(roster)
+        writer.writerow(HEADER)
+        writer.writerows(rows)
+
+
+def column_name(index):
+    name = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        name = chr(ord('A') + remainder) + name
+    return name
+
+
+def write_xlsx(path, rows):
+    """按 Excel 的方式写出最简 xlsx：文本放在共享字符串表中，数字直接写入单元格"""
+    shared, shared_index = [], {}
+    sheet = io.StringIO()
+    sheet.write('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+    for row_number, values in enumerate([HEADER] + list(rows), start=1):
+        sheet.write(f'<row r="{row_number}">')
+        for index, value in enumerate(values):
+            reference = f'{column_name(index)}{row_number}'
+            if isinstance(value, (int, float)):
+                sheet.write(f'<c r="{reference}"><v>{value}</v></c>')
+            elif value != '':
+                if value not in shared_index:
+                    shared_index[value] = len(shared)
+                    shared.append(value)
+                sheet.write(f'<c r="{reference}" t="s"><v>{shared_index[value]}</v></c>')
+        sheet.write('</row>')
+    sheet.write('</sheetData></worksheet>')
+
+    strings = ''.join(f'<si><t>{escape(value)}</t></si>' for value in shared)
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml',
+                         '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                         '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                         '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                         '<Default Extension="xml" ContentType="application/xml"/>'
+                         '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+                         '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+                         '<Override PartName="/xl/sharedStrings.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>'
+                         '</Types>')
+        archive.writestr('_rels/.rels',
+                         '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                         '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                         '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+                         '</Relationships>')
+        archive.writestr('xl/workbook.xml',
+                         '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                         '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+                         'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+                         '<sheets><sheet name="学生名单" sheetId="1" r:id="rId1"/></sheets></workbook>')
+        archive.writestr('xl/_rels/workbook.xml.rels',
+                         '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                         '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                         '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+                         '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings" Target="sharedStrings.xml"/>'
+                         '</Relationships>')
+        archive.writestr('xl/worksheets/sheet1.xml', sheet.getvalue())
+        archive.writestr('xl/sharedStrings.xml',
+                         '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                         f'<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" count="{len(shared)}" '
+                         f'uniqueCount="{len(shared)}">{strings}</sst>')
+
+
+def reset_database():
+    from app import app, db, User, user_cache
+    from werkzeug.security import generate_password_hash
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.add(User(id=1, username='admin', password_hash=generate_password_hash('admin'),
+                            real_name='管理员', is_admin=True, is_teacher=True))
+        db.session.commit()
+    user_cache.invalidate()
+
+
+def measure(label, run, rows):
+    """先计时执行一次，再在 tracemalloc 下执行一次取内存峰值（跟踪内存会明显拖慢执行，不能同时计时）"""
+    start = time.perf_counter()
+    result = run()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<20} {elapsed:7.2f}s {rows / elapsed:9.0f} 行/秒  内存峰值 {peak / 1024 / 1024:6.1f}MB  {result}")
+    return elapsed, peak
+
+
+def import_via_api(path, chunk_size):
+    import app as app_module
+    app_module.IMPORT_ROSTER_CHUNK_SIZE = chunk_size
+    reset_database()
+    with open(path, 'rb') as roster, contextlib.redirect_stdout(io.StringIO()):
+        response = app_module.app.test_client().post('/api/user/batch_import', data={
+            'admin_id': '1', 'file': (roster, os.path.basename(path))
+        }, content_type='multipart/form-data')
+    data = response.get_json()
+    assert response.status_code == 200, data
+    return data
+
+
+def import_loaded(path, chunk_size):
+    """对比：先把整个文件的记录读入列表，再走同样的分块写库流程（校验从简，只比较读取方式的内存差异）"""
+    import app as app_module
+    import user_apis
+    reset_database()
+    app_module.IMPORT_ROSTER_CHUNK_SIZE = chunk_size
+    with open(path, 'rb') as roster:
+        records = list(user_apis.iter_roster_records(user_apis.iter_roster_rows(roster, path)))
+    stats = user_apis.RosterImportStats('baseline')
+
+    def validate(record):
+        return None, {'username': record['登录账号'], 'password': app_module.DEFAULT_STUDENT_PASSWORD,
+                      'real_name': record['姓名'], 'grade': int(record['年级']), 'class_name': int(record['班级'])}
+
+    password_hash = app_module.generate_password_hash(app_module.DEFAULT_STUDENT_PASSWORD)
+
+    def insert_users(accepted):
+        app_module.insert_students([app_module.student_row(row['username'], password_hash, row['real_name'],
+                                                           row['grade'], row['class_name']) for row in accepted])
+        app_module.db.session.commit()
+
+    with app_module.app.app_context():
+        user_apis.import_roster(records, validate, app_module.find_existing_usernames, insert_users, stats,
+                                chunk_size=chunk_size)
+    return {'records': len(records), 'created': stats.created}
+
+
+def read_with_pandas(path):
+    import pandas
+    frame = pandas.read_excel(path) if path.endswith('.xlsx') else pandas.read_csv(path)
+    rows = 0
+    for _, row in frame.iterrows():
+        str(row['登录账号']).strip()
+        rows += 1
+    return {'rows': rows}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='花名册批量导入压测')
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--chunk-size', type=int, default=1000, help='每次校验、查重和提交的行数')
+    parser.add_argument('--baseline', action='store_true', help='同时测试整表读入内存的方式')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='campus_import_bench_')
+    os.environ['CAMPUS_DATABASE_URI'] = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+    os.environ['CAMPUS_FEED_EVENT_SOCKET'] = ''
+    os.environ['CAMPUS_WRITE_QUEUE_SOCKET'] = ''
+    os.environ.setdefault('CAMPUS_SLOW_REQUEST_LOG', os.devnull)
+    import app  # noqa: F401  导入应用不计入测量
+
+    try:
+        paths = {}
+        for extension, writer in (('csv', write_csv), ('xlsx', write_xlsx)):
+            paths[extension] = os.path.join(workdir, f'roster.{extension}')
+            writer(paths[extension], roster_rows(args.rows))
+            print(f"{extension:<5} {args.rows} 行, {os.path.getsize(paths[extension]) / 1024 / 1024:.1f}MB")
+        print()
+
+        for extension, path in paths.items():
+            measure(f'流式导入 {extension}', lambda: {
+                key: value for key, value in import_via_api(path, args.chunk_size).items()
+                if key in ('processed', 'created', 'failed')}, args.rows)
+            if args.baseline:
+                measure(f'整表读入后导入 {extension}', lambda: import_loaded(path, args.chunk_size), args.rows)
+                try:
+                    import pandas  # noqa: F401
+                except ImportError:
+                    print(f"{'pandas 读取 ' + extension:<20} 未安装 pandas，跳过")
+                else:
+                    measure(f'pandas 读取 {extension}', lambda: read_with_pandas(path), args.rows)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(0)
@@ -0,0 +1,154 @@
+"""
+SQLite 连接调优前后的并发读写吞吐对比
+
+生成一份回滚日志模式的测试数据库，分别以“不执行 PRAGMA”（原有默认配置）和 sqlite_tuning.py 的默认配置，
+启动多个进程模拟 gunicorn 工作进程，在同一数据库上混合执行动态列表读取、点赞和评论，
+输出每秒成功的读/写请求数、"database is locked" 错误数和延迟。
+
+用法: python bench_sqlite.py [--workers 9] [--seconds 10] [--write-ratio 0.3] [--users 500] [--posts 3000]
+"""
+
+import argparse
+import contextlib
+import io
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+
+def seed(db_file, user_total, post_total):
+    os.environ['CAMPUS_DATABASE_URI'] = 'sqlite:///' + db_file
+    os.environ['CAMPUS_SQLITE_PRAGMAS'] = ''
+    from app import app, db, User, Post, Comment
+
+    start = datetime(2024, 9, 1)
+    users = [{
+        'id': i, 'username': f'student{i:06d}', 'password_hash': 'x', 'real_name': f'学生{i}',
+        'is_teacher': False, 'is_admin': False, 'is_active': True, 'is_first_login': False,
+        'can_post': True, 'created_at': start
+    } for i in range(1, user_total + 1)]
+    posts = [{
+        'id': i, 'user_id': i % user_total + 1, 'content': f'动态内容 {i}', 'images': '',
+        'created_at': start + timedelta(minutes=i), 'comments_disabled': False,
+        'like_count': 0, 'comment_count': 2
+    } for i in range(1, post_total + 1)]
+    comments = [{
+        'post_id': i // 2 + 1, 'user_id': i % user_total + 1, 'content': f'评论 {i}',
+        'created_at': start + timedelta(minutes=i // 2 + 1, seconds=i % 2)
+    } for i in range(post_total * 2)]
+    with app.app_context():
+        db.create_all()
+        for model, rows in ((User, users), (Post, posts), (Comment, comments)):
+            db.session.execute(model.__table__.insert(), rows)
+        db.session.commit()
+        db.engine.dispose()
+
+
+def worker(db_file, pragmas, args, index, start_at, results):
+    # 每个进程独立导入应用，等同于一个 gunicorn 工作进程
+    os.environ['CAMPUS_DATABASE_URI'] = 'sqlite:///' + db_file
+    os.environ['CAMPUS_SQLITE_PRAGMAS'] = pragmas
+    from app import app
+
+    rng = random.Random(index)
+    client = app.test_client()
+    stats = {'read': 0, 'write': 0, 'locked': 0, 'failed': 0, 'latencies': {'read': [], 'write': []}}
+    with contextlib.redirect_stdout(io.StringIO()) as quiet, contextlib.redirect_stderr(io.StringIO()):
+        while time.time() < start_at:
+            time.sleep(0.001)
+        deadline = start_at + args.seconds
+        while time.time() < deadline:
+            user_id = rng.randint(1, args.users)
+            post_id = rng.randint(max(1, args.posts - 200), args.posts)
+            kind = 'write' if rng.random() < args.write_ratio else 'read'
+            began = time.perf_counter()
+            if kind == 'read':
+                response = client.get(f'/api/posts?user_id={user_id}&limit=20')
+            elif rng.random() < 0.5:
+                response = client.post(f'/api/posts/{post_id}/like', json={'user_id': user_id})
+            else:
+                response = client.post(f'/api/posts/{post_id}/comments',
+                                       json={'user_id': user_id, 'content': f'压测评论 {index}'})
+            elapsed = time.perf_counter() - began
+            if response.status_code < 400:
+                stats[kind] += 1
+                stats['latencies'][kind].append(elapsed)
+            elif b'locked' in response.data:
+                stats['locked'] += 1
+            else:
+                stats['failed'] += 1
+            # 请求日志输出到内存中，定期清空避免占用过多内存
+            quiet.seek(0)
+            quiet.truncate()
+    results.put(stats)
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(label, base_file, pragmas, args):
+    db_file = os.path.join(os.path.dirname(base_file), f'{label}.db')
+    shutil.copy2(base_file, db_file)
+
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    # 预留进程启动和导入应用的时间，所有进程同时开始
+    start_at = time.time() + 3 + args.workers * 0.3
+    processes = [context.Process(target=worker, args=(db_file, pragmas, args, i, start_at, results))
+                 for i in range(args.workers)]
+    for process in processes:
+        process.start()
+    collected = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    reads = sum(s['read'] for s in collected)
+    writes = sum(s['write'] for s in collected)
+    read_latency = [x for s in collected for x in s['latencies']['read']]
+    write_latency = [x for s in collected for x in s['latencies']['write']]
+    return {
+        'label': label,
+        'reads_per_sec': reads / args.seconds,
+        'writes_per_sec': writes / args.seconds,
+        'locked': sum(s['locked'] for s in collected),
+        'failed': sum(s['failed'] for s in collected),
+        'read_p95_ms': percentile(read_latency, 0.95) * 1000,
+        'write_p95_ms': percentile(write_latency, 0.95) * 1000
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='SQLite 调优前后并发读写对比')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count() * 2 + 1)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--write-ratio', type=float, default=0.3)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--posts', type=int, default=3000)
+    args = parser.parse_args()
+
+    from sqlite_tuning import DEFAULT_SQLITE_PRAGMAS
+    tuned = ','.join(f'{name}={value}' for name, value in DEFAULT_SQLITE_PRAGMAS.items())
+
+    workdir = tempfile.mkdtemp(prefix='campus_sqlite_bench_')
+    try:
+        base_file = os.path.join(workdir, 'base.db')
+        print(f"生成测试数据: {args.users} 个用户, {args.posts} 条动态")
+        seed(base_file, args.users, args.posts)
+        print(f"{args.workers} 个进程, 每轮 {args.seconds} 秒, 写请求占比 {args.write_ratio}\n")
+
+        print(f"{'配置':<10}{'读/秒':>10}{'写/秒':>10}{'锁错误':>8}{'其他错误':>10}{'读P95(ms)':>12}{'写P95(ms)':>12}")
+        for label, pragmas in (('default', ''), ('tuned', tuned)):
+            r = run(label, base_file, pragmas, args)
+            print(f"{r['label']:<10}{r['reads_per_sec']:>10.1f}{r['writes_per_sec']:>10.1f}{r['locked']:>8}"
+                  f"{r['failed']:>10}{r['read_p95_ms']:>12.1f}{r['write_p95_ms']:>12.1f}")
+        print(f"\ntuned: {tuned}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,143 @@
+"""
+写队列（组提交）突发写入压测
+
+启动多个进程模拟 gunicorn 工作进程，同时发起大量点赞和评论，
+分别测试“请求中直接提交”和“交给 write_queue.py 合并提交”两种方式，
+输出写入吞吐、P50/P99 延迟、错误数以及写队列的平均批大小。
+
+用法: python bench_write_queue.py [--workers 9] [--requests 200] [--users 500] [--posts 3000] [--max-wait-ms 2]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench_sqlite import seed, percentile
+
+
+def worker(db_file, queue_socket, args, index, start_at, results):
+    os.environ['CAMPUS_DATABASE_URI'] = 'sqlite:///' + db_file
+    os.environ['CAMPUS_WRITE_QUEUE_SOCKET'] = queue_socket
+    os.environ['CAMPUS_FEED_EVENT_SOCKET'] = ''
+    from app import app
+
+    rng = random.Random(index)
+    client = app.test_client()
+    latencies, errors = [], []
+    with contextlib.redirect_stdout(io.StringIO()) as quiet, contextlib.redirect_stderr(io.StringIO()):
+        while time.time() < start_at:
+            time.sleep(0.001)
+        for _ in range(args.requests):
+            user_id = rng.randint(1, args.users)
+            post_id = rng.randint(max(1, args.posts - 50), args.posts)
+            began = time.perf_counter()
+            if rng.random() < 0.6:
+                response = client.post(f'/api/posts/{post_id}/like', json={'user_id': user_id})
+            else:
+                response = client.post(f'/api/posts/{post_id}/comments',
+                                       json={'user_id': user_id, 'content': f'压测评论 {index}'})
+            latencies.append(time.perf_counter() - began)
+            if response.status_code >= 400:
+                errors.append(response.get_json().get('error', '')[:80])
+            quiet.seek(0)
+            quiet.truncate()
+    results.put({'latencies': latencies, 'errors': errors, 'finished': time.time()})
+
+
+def queue_stats(socket_path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        sock.sendall(b'{"kind": "stats"}\n')
+        return json.loads(sock.makefile('rb').readline())['result']
+    finally:
+        sock.close()
+
+
+def start_write_queue(db_file, socket_path, args):
+    env = dict(os.environ, CAMPUS_DATABASE_URI='sqlite:///' + db_file, CAMPUS_FEED_EVENT_SOCKET='')
+    process = subprocess.Popen(
+        [sys.executable, 'write_queue.py', '--socket', socket_path, '--max-wait-ms', str(args.max_wait_ms)],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        if os.path.exists(socket_path):
+            return process
+        time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('写队列启动失败')
+
+
+def run(label, base_file, args, use_queue):
+    workdir = os.path.dirname(base_file)
+    db_file = os.path.join(workdir, f'{label}.db')
+    shutil.copy2(base_file, db_file)
+    socket_path = os.path.join(workdir, 'write_queue.sock') if use_queue else ''
+    writer = start_write_queue(db_file, socket_path, args) if use_queue else None
+
+    try:
+        context = multiprocessing.get_context('spawn')
+        results = context.Queue()
+        start_at = time.time() + 3 + args.workers * 0.3
+        processes = [context.Process(target=worker, args=(db_file, socket_path, args, i, start_at, results))
+                     for i in range(args.workers)]
+        for process in processes:
+            process.start()
+        collected = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+        stats = queue_stats(socket_path) if use_queue else None
+    finally:
+        if writer:
+            writer.terminate()
+            writer.wait()
+
+    latencies = [x for r in collected for x in r['latencies']]
+    errors = [e for r in collected for e in r['errors']]
+    elapsed = max(r['finished'] for r in collected) - start_at
+    return {
+        'label': label,
+        'throughput': (len(latencies) - len(errors)) / elapsed,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'errors': len(errors),
+        'sample_error': errors[0] if errors else '',
+        'avg_batch': stats['avg_batch'] if stats else 1.0
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='写队列突发写入压测')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count() * 2 + 1)
+    parser.add_argument('--requests', type=int, default=200, help='每个进程发起的写请求数')
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--posts', type=int, default=3000)
+    parser.add_argument('--max-wait-ms', type=float, default=2)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='campus_write_bench_')
+    try:
+        base_file = os.path.join(workdir, 'base.db')
+        print(f"生成测试数据: {args.users} 个用户, {args.posts} 条动态")
+        seed(base_file, args.users, args.posts)
+        print(f"{args.workers} 个进程, 每个进程 {args.requests} 个写请求（60% 点赞, 40% 评论）\n")
+
+        print(f"{'方式':<10}{'写/秒':>10}{'P50(ms)':>10}{'P99(ms)':>10}{'错误':>8}{'平均批大小':>12}")
+        for label, use_queue in (('direct', False), ('queue', True)):
+            r = run(label, base_file, args, use_queue)
+            print(f"{r['label']:<10}{r['throughput']:>10.1f}{r['p50_ms']:>10.1f}{r['p99_ms']:>10.1f}"
+                  f"{r['errors']:>8}{r['avg_batch']:>12.2f}")
+            if r['sample_error']:
+                print(f"  错误示例: {r['sample_error']}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
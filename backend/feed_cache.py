@@ -0,0 +1,92 @@
+"""
+动态列表共享缓存
+
+缓存与浏览者无关的动态列表页面（不含 is_liked），按动态版本号整体失效。
+每个 gunicorn 工作进程各自持有一份缓存，版本号保存在数据库中，因此任意进程的写操作都能让其他进程的缓存失效。
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class FeedCache:
+    def __init__(self, max_entries=128):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.rebuilds = 0
+        self.rebuild_time_total = 0.0
+        self.rebuild_time_max = 0.0
+        self.last_rebuild_time = 0.0
+
+    def _sync_version(self, version):
+        # 版本号变化时丢弃全部旧页面
+        if version != self._version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._version = version
+
+    def get(self, version, key):
+        """命中返回缓存的页面，未命中返回 None"""
+        with self._lock:
+            self._sync_version(version)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, version, key, entry, rebuild_seconds=0.0):
+        with self._lock:
+            self.rebuilds += 1
+            self.rebuild_time_total += rebuild_seconds
+            self.rebuild_time_max = max(self.rebuild_time_max, rebuild_seconds)
+            self.last_rebuild_time = rebuild_seconds
+
+            self._sync_version(version)
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def build(self, version, key, builder):
+        """读取缓存，未命中时调用 builder() 重建并记录耗时"""
+        entry = self.get(version, key)
+        if entry is None:
+            start = time.perf_counter()
+            entry = builder()
+            self.put(version, key, entry, time.perf_counter() - start)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._version = None
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'pid': os.getpid(),
+                'version': self._version,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'invalidations': self.invalidations,
+                'rebuilds': self.rebuilds,
+                'rebuild_ms_total': round(self.rebuild_time_total * 1000, 3),
+                'rebuild_ms_avg': round(self.rebuild_time_total * 1000 / self.rebuilds, 3) if self.rebuilds else 0.0,
+                'rebuild_ms_max': round(self.rebuild_time_max * 1000, 3),
+                'rebuild_ms_last': round(self.last_rebuild_time * 1000, 3)
+            }
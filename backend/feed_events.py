@@ -0,0 +1,43 @@
+"""
+动态实时事件发布
+
+各 gunicorn 工作进程在事务提交后把动态变更以 JSON 数据报的形式发送到本机的 Unix 套接字，
+由独立的 sse_hub.py 进程接收并推送给所有 SSE 连接。发送是非阻塞的，推送服务未启动时事件直接丢弃，
+客户端可以通过 /api/posts/changes 增量接口补齐。
+"""
+
+import json
+import os
+import socket
+
+DEFAULT_EVENT_SOCKET = os.environ.get('CAMPUS_FEED_EVENT_SOCKET', '/tmp/campus_feed_events.sock')
+
+
+class FeedEventPublisher:
+    def __init__(self, socket_path=DEFAULT_EVENT_SOCKET):
+        self.socket_path = socket_path
+        self._sock = None
+        self._pid = None
+        self.sent = 0
+        self.dropped = 0
+
+    def _socket(self):
+        # preload_app 模式下应用在 fork 前导入，每个工作进程各自创建套接字
+        if self._sock is None or self._pid != os.getpid():
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._sock.setblocking(False)
+            self._pid = os.getpid()
+        return self._sock
+
+    def publish(self, event):
+        """发送一条事件，推送服务不可用或缓冲区已满时丢弃"""
+        if not self.socket_path:
+            return False
+        try:
+            data = json.dumps(event, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            self._socket().sendto(data, self.socket_path)
+            self.sent += 1
+            return True
+        except OSError:
+            self.dropped += 1
+            return False
@@ -36,4 +36,11 @@ preload_app = True
 # 限制请求行大小
 limit_request_line = 4096
 limit_request_fields = 100
-limit_request_field_size = 8190 
\ No newline at end of file
+limit_request_field_size = 8190 
+
+# 预加载时主进程已创建连接池，fork 后每个工作进程丢弃继承的连接，各自新建
+# （共享同一个 PostgreSQL 连接会导致协议错乱）
+def post_fork(server, worker):
+    from app import app, db
+    with app.app_context():
+        db.engine.dispose(close=False)
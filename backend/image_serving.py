@@ -0,0 +1,111 @@
+"""
+图片文件的发送
+
+上传的图片按内容命名（见 image_store.py），同一个文件名的内容永远不变，各尺寸版本生成后也不再改动，
+因此响应带强 ETag（与 nginx 静态文件相同的“修改时间-大小”格式，两种发送方式得到的 ETag 一致）、
+Last-Modified 和 Cache-Control: public, max-age=一年, immutable，浏览器之后不再请求。
+请求的尺寸还没有生成、暂时返回原图时不加 immutable，只允许带 ETag 重新验证，生成后浏览器能拿到新版本。
+
+两种发送方式：
+    IMAGE_ACCEL_REDIRECT 为 nginx 中 internal 的 location 前缀（如 /images/_files/）时，
+    只返回 X-Accel-Redirect 头，由 nginx 直接从磁盘发送文件（含 Range 请求），不占用 gunicorn 工作进程；
+    置空（没有 nginx，如开发环境）时由工作进程发送，gunicorn 对文件响应使用 sendfile，不经过 Python 复制数据，
+    Range 请求返回 206。
+If-None-Match / If-Modified-Since 命中时直接返回 304，不打开文件。
+
+每个工作进程缓存文件名到路径和 stat 结果的映射，重复访问同一张图片不再查找和 stat 文件；
+文件只会被 purger.py 删除（已经没有动态引用）或在迁移时移入分层目录，缓存条目在 ttl 秒后过期，
+由工作进程发送时打开失败会立即重新查找。用 image_variants.py --force 重新生成各尺寸后，
+已缓存的浏览器仍使用旧版本，直到 max-age 过期或清除缓存。
+"""
+
+import mimetypes
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timezone
+
+from image_variants import variant_path, webp_variant_path
+from upload_storage import find_original
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+ImageFile = namedtuple('ImageFile', ['path', 'size', 'mtime', 'etag', 'mimetype', 'immutable'])
+
+
+class ImageStatCache:
+    def __init__(self, max_entries=4096, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """命中返回 ImageFile，未命中或已过期返回 None"""
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None or item[0] < time.monotonic():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key, image):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, image)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def stat_image(path, immutable):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    etag = f'{int(stat.st_mtime):x}-{stat.st_size:x}'
+    mtime = datetime.fromtimestamp(int(stat.st_mtime), timezone.utc)
+    return ImageFile(path, stat.st_size, mtime, etag, mimetype, immutable)
+
+
+def locate_image(upload_folder, filename, size, webp):
+    """查找要发送的文件：请求的尺寸（支持时优先 WebP），还没有生成时为原图；原图不存在返回 None"""
+    original = find_original(upload_folder, filename)
+    if not original:
+        return None
+    if size == 'original':
+        return stat_image(original, immutable=True)
+    candidates = [variant_path(upload_folder, filename, size)]
+    if webp:
+        candidates.insert(0, webp_variant_path(upload_folder, filename, size))
+    for path in candidates:
+        image = stat_image(path, immutable=True)
+        if image:
+            return image
+    return stat_image(original, immutable=False)
+
+
+def set_cache_headers(response, image):
+    response.set_etag(image.etag)
+    response.last_modified = image.mtime
+    if image.immutable:
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
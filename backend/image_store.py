@@ -0,0 +1,164 @@
+"""
+按内容寻址的图片存储
+
+上传的图片以内容哈希命名（sha256 的前 32 位十六进制 + 扩展名），同一张图片被多个学生转发时只保存一份，
+已存在时上传接口不再写盘，备份也只复制一份。image_blob 表记录每个文件被多少条动态（含已删除待清理、已归档的动态）引用：
+发布动态时加一，purger.py 清理动态或删除用户的归档内容时减一，
+引用数为零且超过宽限期没有再被上传的文件由 purger.py 删除（上传后还没有发布动态的图片也在宽限期内保留）。
+
+旧规则命名（原文件名_时间戳_随机串.扩展名）的文件由版本 11 的迁移调用 fold_uploads 统一改名、合并重复，
+同时改写动态中的文件名并重算引用数；恢复备份后同样调用一次。本模块不依赖 app.py。
+"""
+
+import hashlib
+import os
+import re
+import shutil
+from collections import Counter
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+
+from image_variants import IMAGE_VARIANTS, variant_root, variant_path, webp_variant_path, remove_variants
+from upload_storage import original_path, find_original, iter_originals
+
+IMAGE_HASH_LENGTH = 32
+# 同一种格式的不同扩展名统一，避免相同内容因扩展名不同保存两份
+CANONICAL_EXTENSIONS = {'jpeg': 'jpg', 'tif': 'tiff'}
+HASH_CHUNK_SIZE = 1024 * 1024
+
+_BLOB_NAME = re.compile(r'^[0-9a-f]{%d}\.[a-z0-9]+$' % IMAGE_HASH_LENGTH)
+
+
+def canonical_extension(filename):
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    return CANONICAL_EXTENSIONS.get(extension, extension)
+
+
+def is_blob_name(filename):
+    return bool(_BLOB_NAME.match(filename))
+
+
+def hash_stream(stream):
+    """计算文件对象内容的哈希，读取后回到开头"""
+    digest = hashlib.sha256()
+    stream.seek(0)
+    for chunk in iter(lambda: stream.read(HASH_CHUNK_SIZE), b''):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()[:IMAGE_HASH_LENGTH]
+
+
+def blob_name(digest, filename):
+    return f'{digest}.{canonical_extension(filename)}'
+
+
+def image_names(images):
+    """动态 images 字段中不重复的文件名"""
+    names = (os.path.basename(name.strip()) for name in (images or '').split(','))
+    return list(dict.fromkeys(name for name in names if name))
+
+
+def remove_blob_files(upload_folder, name):
+    """删除图片文件及其各尺寸版本，返回是否删除了原图"""
+    remove_variants(upload_folder, name)
+    path = find_original(upload_folder, name)
+    if not path:
+        return False
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def move_variants(upload_folder, old_name, new_name):
+    """旧文件名的各尺寸版本改用新文件名，新文件名已有的直接删除"""
+    for size in IMAGE_VARIANTS:
+        for path in (variant_path, webp_variant_path):
+            old_path, new_path = path(upload_folder, old_name, size), path(upload_folder, new_name, size)
+            # 还没有移入分层目录的旧版本平铺在尺寸目录下
+            flat_path = os.path.join(variant_root(upload_folder, size), os.path.basename(old_path))
+            for old_path in (old_path, flat_path):
+                if not os.path.exists(old_path):
+                    continue
+                if os.path.exists(new_path):
+                    os.remove(old_path)
+                else:
+                    os.makedirs(os.path.dirname(new_path), exist_ok=True)
+                    os.replace(old_path, new_path)
+
+
+def link_or_copy(source, target):
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def fold_uploads(connection, metadata, upload_folder):
+    """
+    把上传目录中旧规则命名的文件改为按内容命名，内容相同的只保留一份，改写动态和归档动态中的文件名，
+    再按全部动态的引用重算 image_blob，返回 (改名的文件数, 删除的重复文件数)。
+    connection 应为自动提交：先建立新文件名，再改写动态，最后删除旧文件，中途出错时动态引用的文件都存在，重新执行即可
+    """
+    renamed = {}
+    paths = {}
+    duplicates = 0
+    for filename, path in sorted(iter_originals(upload_folder)):
+        if is_blob_name(filename):
+            continue
+        with open(path, 'rb') as image:
+            name = blob_name(hash_stream(image), filename)
+        target = original_path(upload_folder, name)
+        if os.path.exists(target):
+            duplicates += 1
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            link_or_copy(path, target)
+        renamed[filename] = name
+        paths[filename] = path
+
+    if renamed:
+        for table in (metadata.tables['post'], metadata.tables['post_archive']):
+            rows = connection.execute(sa.select(table.c.id, table.c.images).where(
+                table.c.images.isnot(None), table.c.images != '')).fetchall()
+            for row in rows:
+                names = [renamed.get(name, name) for name in image_names(row.images)]
+                images = ','.join(dict.fromkeys(names))
+                if images != row.images:
+                    connection.execute(table.update().where(table.c.id == row.id).values(images=images))
+        for filename, name in renamed.items():
+            os.remove(paths[filename])
+            move_variants(upload_folder, filename, name)
+        print(f"改名 {len(renamed) - duplicates} 个图片文件，合并 {duplicates} 个重复文件")
+
+    recount_image_blobs(connection, metadata, upload_folder)
+    return len(renamed) - duplicates, duplicates
+
+
+def recount_image_blobs(connection, metadata, upload_folder):
+    """按上传目录中的文件和全部动态的引用重建 image_blob"""
+    references = Counter()
+    for table in (metadata.tables['post'], metadata.tables['post_archive']):
+        for row in connection.execute(sa.select(table.c.images).where(
+                table.c.images.isnot(None), table.c.images != '')):
+            references.update(image_names(row.images))
+
+    blobs = metadata.tables['image_blob']
+    rows = {}
+    for filename, path in iter_originals(upload_folder):
+        # 迁移到分层目录期间同一文件可能同时出现在两个位置
+        if is_blob_name(filename) and filename not in rows:
+            stat = os.stat(path)
+            rows[filename] = {
+                'name': filename,
+                'size': stat.st_size,
+                'ref_count': references[filename],
+                'uploaded_at': datetime.utcfromtimestamp(stat.st_mtime) + timedelta(hours=8)  # 与 beijing_time 一致
+            }
+    rows = list(rows.values())
+    connection.execute(blobs.delete())
+    for i in range(0, len(rows), 500):
+        connection.execute(blobs.insert(), rows[i:i + 500])
+    print(f"图片引用计数已重算: {len(rows)} 个文件，其中 {sum(1 for row in rows if not row['ref_count'])} 个未被引用")
@@ -0,0 +1,166 @@
+"""
+上传图片的多尺寸版本
+
+原图最大 16MB，动态列表中却只需要几百像素宽的图片。上传后按原图生成几种固定尺寸，
+保存在上传目录的 variants/<尺寸>/ 下（与原图一样分两级子目录，见 upload_storage.py）：
+    thumb  最长边 320 像素，九宫格中的小图
+    feed   最长边 1080 像素，单张图片和列表中的大图
+    full   最长边 2048 像素，点开预览
+每种尺寸保存两份：与原图同名、同格式的一份（JPEG、PNG 等），以及文件名后加 .webp 的 WebP 版本（原图是 WebP 时只有一份）。
+/api/images/<文件名>?size=thumb|feed|full 对支持 WebP 的浏览器返回 WebP，否则返回同格式版本，还没有生成时返回原图。
+生成时按 EXIF 方向旋转并去掉 EXIF（拍摄位置等）信息；比目标尺寸小的图片只重新编码，不放大。
+GIF 和动图（可能包含多帧）、SVG 不生成其他尺寸，始终返回原图。
+生成由 image_worker.py 在请求之外的进程池中完成。
+
+备份只复制上传目录下的原图，其他尺寸可以随时重新生成：
+用法: python image_variants.py            # 为缺少其他尺寸的原图补生成（如恢复备份后）
+     python image_variants.py --force    # 全部重新生成（如调整了尺寸）
+"""
+
+import argparse
+import os
+import shutil
+import time
+
+from PIL import Image, ImageOps
+
+from upload_storage import shard_path, find_original, iter_originals
+
+# 每种尺寸的最长边像素，从大到小排列，小尺寸由上一个尺寸缩小得到
+IMAGE_VARIANTS = {'full': 2048, 'feed': 1080, 'thumb': 320}
+VARIANTS_DIRNAME = 'variants'
+RESIZABLE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp', 'bmp', 'tiff'}
+JPEG_QUALITY = 82
+WEBP_QUALITY = 80
+
+
+def variant_root(upload_folder, size):
+    return os.path.join(upload_folder, VARIANTS_DIRNAME, size)
+
+
+def variant_path(upload_folder, filename, size):
+    return shard_path(variant_root(upload_folder, size), filename)
+
+
+def webp_variant_path(upload_folder, filename, size):
+    path = variant_path(upload_folder, filename, size)
+    return path if filename.lower().endswith('.webp') else path + '.webp'
+
+
+def variant_paths(upload_folder, filename, size):
+    return {variant_path(upload_folder, filename, size), webp_variant_path(upload_folder, filename, size)}
+
+
+def can_resize(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in RESIZABLE_EXTENSIONS
+
+
+def save_image(image, path, image_format):
+    """先写临时文件再替换，读取中的请求不会读到写了一半的图片"""
+    # 保留色彩配置（手机照片常用 Display P3），否则颜色会偏淡
+    options = {'icc_profile': image.info.get('icc_profile')} if image.info.get('icc_profile') else {}
+    if image_format == 'JPEG':
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        options.update(quality=JPEG_QUALITY, optimize=True, progressive=True)
+    elif image_format == 'WEBP':
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+        options.update(quality=WEBP_QUALITY)
+    elif image_format == 'PNG':
+        options.update(optimize=True)
+    temporary_path = f'{path}.{os.getpid()}.tmp'
+    image.save(temporary_path, format=image_format, **options)
+    os.replace(temporary_path, path)
+
+
+def generate_variants(upload_folder, filename, overwrite=True):
+    """为原图生成各尺寸版本，返回生成的尺寸列表；不需要或无法生成（非图片、动图、文件损坏）时返回空列表"""
+    if not can_resize(filename):
+        return []
+    sizes = [size for size in IMAGE_VARIANTS
+             if overwrite or not all(os.path.exists(path) for path in variant_paths(upload_folder, filename, size))]
+    if not sizes:
+        return []
+
+    source = find_original(upload_folder, filename)
+    if not source:
+        return []
+    try:
+        with Image.open(source) as original:
+            # iPhone 的 MPO 照片第二帧是深度图等附加数据，按普通 JPEG 处理
+            image_format = 'JPEG' if original.format == 'MPO' else original.format
+            if getattr(original, 'is_animated', False) and original.format != 'MPO':
+                return []
+            # JPEG 可以在解码时直接按 1/2、1/4、1/8 缩小，大照片省去大部分解码时间
+            largest = IMAGE_VARIANTS[sizes[0]]
+            original.draft('RGB', (largest, largest))
+            image = ImageOps.exif_transpose(original)
+            image.info.pop('exif', None)
+            if image.mode == 'P':
+                # 调色板图片缩放时只能取最近像素，先转换为 RGBA
+                image = image.convert('RGBA')
+
+            for size in sizes:
+                edge = IMAGE_VARIANTS[size]
+                image.thumbnail((edge, edge), Image.LANCZOS)
+                path = variant_path(upload_folder, filename, size)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                save_image(image, path, image_format)
+                if image_format != 'WEBP':
+                    save_image(image, webp_variant_path(upload_folder, filename, size), 'WEBP')
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        print(f"生成图片 {filename} 的其他尺寸失败: {e}")
+        return []
+    # 生成期间原图被删除（图片已清理）时，删除刚生成的文件
+    if not find_original(upload_folder, filename):
+        remove_variants(upload_folder, filename)
+        return []
+    return sizes
+
+
+def remove_variants(upload_folder, filename):
+    for size in IMAGE_VARIANTS:
+        for path in variant_paths(upload_folder, filename, size):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def missing_variants(upload_folder):
+    """上传目录中缺少某个尺寸的原图文件名"""
+    for filename, _ in iter_originals(upload_folder):
+        if not can_resize(filename):
+            continue
+        if not all(os.path.exists(path) for size in IMAGE_VARIANTS
+                   for path in variant_paths(upload_folder, filename, size)):
+            yield filename
+
+
+def clear_variants(upload_folder):
+    shutil.rmtree(os.path.join(upload_folder, VARIANTS_DIRNAME), ignore_errors=True)
+
+
+def backfill_variants(upload_folder, force=False):
+    """为上传目录中的原图补生成其他尺寸（force 时全部重新生成），返回 (处理的图片数, 生成的尺寸数)"""
+    images = sizes_created = 0
+    filenames = (filename for filename, _ in iter_originals(upload_folder)) if force else missing_variants(upload_folder)
+    for filename in filenames:
+        start = time.perf_counter()
+        sizes = generate_variants(upload_folder, filename, overwrite=force)
+        if sizes:
+            images += 1
+            sizes_created += len(sizes)
+            print(f"{filename}: {', '.join(sizes)} ({(time.perf_counter() - start) * 1000:.0f}ms)")
+    return images, sizes_created
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='为已上传的图片生成其他尺寸')
+    parser.add_argument('--force', action='store_true', help='已存在的尺寸也重新生成')
+    args = parser.parse_args()
+
+    from app import app
+    images, files = backfill_variants(app.config['UPLOAD_FOLDER'], args.force)
+    print(f"完成，共为 {images} 张图片生成 {files} 个尺寸")
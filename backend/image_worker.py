@@ -0,0 +1,179 @@
+"""
+图片处理服务
+
+解码、缩放、重新编码图片是 CPU 密集的，一张大照片需要零点几秒到数秒，
+在上传请求中处理会让同步的 gunicorn 工作进程在这段时间内无法处理其他请求。
+上传接口保存原图后只把文件名以 JSON 数据报发送到本服务的 Unix 套接字并立即返回，
+本服务在有上限的进程池中生成各尺寸的 JPEG/PNG 和 WebP 版本（见 image_variants.py），生成完成前图片接口返回原图。
+
+排队的图片数超过 --max-pending 时本服务暂停接收，套接字缓冲区满后工作进程发送失败，
+退回到在请求中生成，与本服务未启动时相同。
+启动时以及收到 {"backfill": true}（恢复备份后发送）时，在后台为缺少尺寸的原图补生成，
+补生成同时最多占用 --workers 个排队位置，不影响新上传的图片。
+
+用法: python image_worker.py [--socket /tmp/campus_image_worker.sock] [--workers 2] [--max-pending 64]
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from image_variants import generate_variants, missing_variants
+
+DEFAULT_IMAGE_WORKER_SOCKET = os.environ.get('CAMPUS_IMAGE_WORKER_SOCKET', '/tmp/campus_image_worker.sock')
+DEFAULT_UPLOAD_FOLDER = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'uploads')
+DEFAULT_MAX_PENDING = 64
+
+
+class ImageTaskPublisher:
+    def __init__(self, socket_path=DEFAULT_IMAGE_WORKER_SOCKET):
+        self.socket_path = socket_path
+        self._sock = None
+        self._pid = None
+
+    def _socket(self):
+        # preload_app 模式下应用在 fork 前导入，每个工作进程各自创建套接字
+        if self._sock is None or self._pid != os.getpid():
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._sock.setblocking(False)
+            self._pid = os.getpid()
+        return self._sock
+
+    def _send(self, message):
+        if not self.socket_path:
+            return False
+        try:
+            self._socket().sendto(json.dumps(message, ensure_ascii=False).encode('utf-8'), self.socket_path)
+            return True
+        except OSError:
+            return False
+
+    def submit(self, filename):
+        """交给图片处理服务生成各尺寸，服务未启动或队列已满时返回 False，由调用方自行生成"""
+        return self._send({'filename': filename})
+
+    def request_backfill(self):
+        return self._send({'backfill': True})
+
+
+class ImageWorker:
+    def __init__(self, upload_folder, workers, max_pending=DEFAULT_MAX_PENDING):
+        self.upload_folder = upload_folder
+        self.workers = workers
+        self.pool = self.create_pool()
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.backfill_slots = threading.BoundedSemaphore(workers)
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.backfilling = False
+
+    def create_pool(self):
+        # 本服务有接收线程和补生成线程，用 spawn 启动子进程，避免 fork 时复制其他线程持有的锁
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def submit(self, filename):
+        """子进程异常退出（如处理超大图片时内存不足被杀死）后进程池不再可用，重建后重新提交"""
+        pool = self.pool
+        try:
+            return pool.submit(generate_variants, self.upload_folder, filename)
+        except BrokenProcessPool:
+            with self.lock:
+                # 其他线程可能已经重建，只替换提交失败的那个进程池
+                if self.pool is pool:
+                    print("进程池已损坏，重新创建")
+                    self.pool = self.create_pool()
+                    pool.shutdown(wait=False)
+            return self.pool.submit(generate_variants, self.upload_folder, filename)
+
+    def enqueue(self, filename, background=False):
+        """排队生成一张图片的各尺寸，排队数达到上限时阻塞；已在队列中的图片不重复排队"""
+        filename = os.path.basename(filename)
+        with self.lock:
+            if not filename or filename in self.pending:
+                return
+            self.pending.add(filename)
+        if background:
+            self.backfill_slots.acquire()
+        self.slots.acquire()
+        started = time.perf_counter()
+        try:
+            future = self.submit(filename)
+        except Exception as e:
+            print(f"提交图片 {filename} 失败: {e}")
+            self.release(filename, background)
+            return
+        future.add_done_callback(lambda future: self.finished(filename, background, started, future))
+
+    def release(self, filename, background):
+        with self.lock:
+            self.pending.discard(filename)
+        self.slots.release()
+        if background:
+            self.backfill_slots.release()
+
+    def finished(self, filename, background, started, future):
+        self.release(filename, background)
+        try:
+            sizes = future.result()
+        except Exception as e:
+            print(f"处理图片 {filename} 失败: {e}")
+            return
+        if sizes:
+            print(f"{filename}: {', '.join(sizes)} ({(time.perf_counter() - started) * 1000:.0f}ms)")
+
+    def backfill(self):
+        """在后台线程中为缺少尺寸的原图补生成，已在进行时忽略"""
+        with self.lock:
+            if self.backfilling:
+                return
+            self.backfilling = True
+
+        def run():
+            try:
+                count = 0
+                for filename in missing_variants(self.upload_folder):
+                    self.enqueue(filename, background=True)
+                    count += 1
+                print(f"补生成: 已排队 {count} 张图片")
+            finally:
+                with self.lock:
+                    self.backfilling = False
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def serve(self, socket_path):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(socket_path)
+        os.chmod(socket_path, 0o660)
+        print(f"图片处理服务已启动，套接字: {socket_path}, 上传目录: {self.upload_folder}")
+        self.backfill()
+        while True:
+            data = sock.recv(65536)
+            try:
+                message = json.loads(data)
+            except ValueError:
+                continue
+            if not isinstance(message, dict):
+                continue
+            if message.get('backfill'):
+                self.backfill()
+            elif message.get('filename'):
+                self.enqueue(message['filename'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='图片处理服务')
+    parser.add_argument('--socket', default=DEFAULT_IMAGE_WORKER_SOCKET)
+    parser.add_argument('--upload-folder', default=DEFAULT_UPLOAD_FOLDER)
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) - 1), help='进程池大小')
+    parser.add_argument('--max-pending', type=int, default=DEFAULT_MAX_PENDING, help='最多排队的图片数')
+    args = parser.parse_args()
+    ImageWorker(args.upload_folder, args.workers, args.max_pending).serve(args.socket)
@@ -0,0 +1,342 @@
+"""
+版本化数据库迁移
+
+每个迁移有一个递增的版本号，执行成功后记录在 schema_migration 表中，已执行的迁移不会重复执行。
+早期由 migrate_db.py、migrate_user_table.py 手工添加的列在这里作为前几个版本保留，
+每个迁移在执行前都会检查表结构，因此对已经手工迁移过的数据库同样安全。
+
+索引迁移按“在线”方式执行：SQLite 在 WAL 模式下建索引期间读操作不受影响，写操作等待 busy_timeout；
+PostgreSQL 使用 CREATE INDEX CONCURRENTLY，不锁表。
+
+用法:
+    python migrations.py            # 执行所有未执行的迁移
+    python migrations.py status     # 查看各版本的执行情况
+    python migrations.py verify     # 用 EXPLAIN QUERY PLAN 检查热点查询是否都使用了索引
+"""
+
+import sys
+import time
+from collections import namedtuple
+from datetime import datetime
+
+import sqlalchemy as sa
+
+Migration = namedtuple('Migration', ['version', 'name', 'apply', 'online'])
+
+migration_table = sa.Table(
+    'schema_migration', sa.MetaData(),
+    sa.Column('version', sa.Integer, primary_key=True, autoincrement=False),
+    sa.Column('name', sa.String(100), nullable=False),
+    sa.Column('applied_at', sa.DateTime, nullable=False),
+    sa.Column('duration_ms', sa.Integer, nullable=False, default=0)
+)
+
+MIGRATIONS = []
+
+
+def migration(version, online=False):
+    """注册迁移函数，函数接收 (connection, metadata)"""
+    def register(func):
+        MIGRATIONS.append(Migration(version, func.__name__, func, online))
+        return func
+    return register
+
+
+def quote(connection, name):
+    return connection.dialect.identifier_preparer.quote(name)
+
+
+def column_names(connection, table):
+    return {column['name'] for column in sa.inspect(connection).get_columns(table)}
+
+
+def add_missing_column(connection, table, column, ddl):
+    """列不存在时添加，返回是否添加了新列"""
+    if column in column_names(connection, table):
+        print(f"{table}.{column} 列已存在")
+        return False
+    connection.execute(sa.text(f"ALTER TABLE {quote(connection, table)} ADD COLUMN {column} {ddl}"))
+    print(f"添加 {table}.{column} 列")
+    return True
+
+
+@migration(1)
+def create_missing_tables(connection, metadata):
+    # 新数据库在这里按当前模型建出全部表和索引，后续迁移检查后直接跳过
+    metadata.create_all(connection, checkfirst=True)
+
+
+@migration(2)
+def user_first_login_flags(connection, metadata):
+    add_missing_column(connection, 'user', 'is_first_login', 'BOOLEAN DEFAULT false')
+    add_missing_column(connection, 'user', 'can_post', 'BOOLEAN DEFAULT true')
+
+
+@migration(3)
+def post_comments_disabled(connection, metadata):
+    add_missing_column(connection, 'post', 'comments_disabled', 'BOOLEAN DEFAULT false')
+
+
+@migration(4)
+def post_counters(connection, metadata):
+    added = [add_missing_column(connection, 'post', counter, 'INTEGER NOT NULL DEFAULT 0')
+             for counter in ('like_count', 'comment_count')]
+    if any(added):
+        like, comment = quote(connection, 'like'), quote(connection, 'comment')
+        connection.execute(sa.text(f"""
+            UPDATE post SET
+                like_count = (SELECT COUNT(*) FROM {like} WHERE {like}.post_id = post.id),
+                comment_count = (SELECT COUNT(*) FROM {comment} WHERE {comment}.post_id = post.id)
+        """))
+        print("回填动态计数")
+
+
+@migration(5)
+def feed_change_user_id(connection, metadata):
+    add_missing_column(connection, 'feed_change', 'user_id', 'INTEGER')
+
+
+@migration(6)
+def default_system_config(connection, metadata):
+    config = metadata.tables['system_config']
+    exists = connection.execute(
+        sa.select(config.c.id).where(config.c.key == 'register_enabled')).first()
+    if not exists:
+        connection.execute(config.insert().values(
+            key='register_enabled', value='true', description='是否开启用户注册功能', updated_at=datetime.now()))
+        print("添加默认配置: register_enabled = true")
+
+
+# 热点查询依赖的索引，定义与模型中的 __table_args__ 保持一致
+# （动态列表的 ix_post_created_at_id 已由版本 10 的部分索引 ix_post_live_created_at_id 取代）
+HOT_QUERY_INDEXES = (
+    ('post', 'ix_post_user_id_created_at'),
+    ('comment', 'ix_comment_post_parent_created'),
+    ('comment', 'ix_comment_parent_created'),
+    ('like', 'ix_like_post_id'),
+)
+
+
+def create_index_online(connection, index):
+    table = quote(connection, index.table.name)
+    columns = ', '.join(quote(connection, column.name) for column in index.columns)
+    concurrently = 'CONCURRENTLY ' if connection.dialect.name == 'postgresql' else ''
+    # 部分索引（sqlite_where / postgresql_where）
+    where = None
+    if connection.dialect.name in ('sqlite', 'postgresql'):
+        where = index.dialect_options[connection.dialect.name]['where']
+    condition = f" WHERE {where}" if where is not None else ''
+    start = time.perf_counter()
+    connection.execute(sa.text(
+        f"CREATE INDEX {concurrently}IF NOT EXISTS {quote(connection, index.name)} ON {table} ({columns}){condition}"))
+    print(f"索引 {index.name} 就绪 ({(time.perf_counter() - start) * 1000:.0f}ms)")
+
+
+def drop_index_online(connection, name):
+    concurrently = 'CONCURRENTLY ' if connection.dialect.name == 'postgresql' else ''
+    connection.execute(sa.text(f"DROP INDEX {concurrently}IF EXISTS {quote(connection, name)}"))
+    print(f"索引 {name} 已删除")
+
+
+@migration(7, online=True)
+def hot_query_indexes(connection, metadata):
+    for table_name, index_name in HOT_QUERY_INDEXES:
+        index = next(index for index in metadata.tables[table_name].indexes if index.name == index_name)
+        create_index_online(connection, index)
+
+
+@migration(8)
+def archive_tables(connection, metadata):
+    # 归档表是新表，建表时同时建出索引
+    for table_name in ('post_archive', 'comment_archive', 'like_archive'):
+        metadata.tables[table_name].create(connection, checkfirst=True)
+
+
+@migration(9)
+def soft_delete_columns(connection, metadata):
+    add_missing_column(connection, 'post', 'deleted_at', 'TIMESTAMP')
+    add_missing_column(connection, 'user', 'deleted_at', 'TIMESTAMP')
+
+
+@migration(10, online=True)
+def live_post_indexes(connection, metadata):
+    # 动态列表只读取未删除的动态，改用只包含这些行的部分索引；已删除的动态另建部分索引供清理任务查找
+    for index in metadata.tables['post'].indexes:
+        if index.name in ('ix_post_live_created_at_id', 'ix_post_deleted_at'):
+            create_index_online(connection, index)
+    drop_index_online(connection, 'ix_post_created_at_id')
+
+
+@migration(11, online=True)
+def image_blobs(connection, metadata):
+    # 已上传的图片改为按内容命名并合并重复文件（见 image_store.py），文件操作不能随事务回滚，按自动提交逐步执行
+    from flask import current_app
+    from image_store import fold_uploads
+
+    metadata.tables['image_blob'].create(connection, checkfirst=True)
+    fold_uploads(connection, metadata, current_app.config['UPLOAD_FOLDER'])
+
+
+@migration(12, online=True)
+def sharded_uploads(connection, metadata):
+    # 平铺的图片移入两级子目录（见 upload_storage.py），图片访问同时查找两个位置，迁移期间不影响服务
+    from flask import current_app
+    from image_variants import IMAGE_VARIANTS, variant_root
+    from upload_storage import shard_uploads
+
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    shard_uploads(upload_folder, [variant_root(upload_folder, size) for size in IMAGE_VARIANTS])
+
+
+def applied_versions(engine):
+    with engine.begin() as connection:
+        migration_table.create(connection, checkfirst=True)
+        return {row.version: row for row in connection.execute(sa.select(migration_table))}
+
+
+def record_version(connection, item, duration):
+    connection.execute(migration_table.insert().values(
+        version=item.version, name=item.name, applied_at=datetime.now(), duration_ms=int(duration * 1000)))
+
+
+def upgrade_database(db):
+    """执行所有未执行的迁移，返回本次执行的版本号列表"""
+    engine = db.engine
+    done = applied_versions(engine)
+    executed = []
+    for item in sorted(MIGRATIONS, key=lambda m: m.version):
+        if item.version in done:
+            continue
+        print(f"执行迁移 {item.version}: {item.name}")
+        start = time.perf_counter()
+        if item.online:
+            # 在线迁移不能放在事务中（PostgreSQL CONCURRENTLY 的要求，文件操作也无法回滚），这些迁移均可重复执行
+            with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+                item.apply(connection, db.metadata)
+            with engine.begin() as connection:
+                record_version(connection, item, time.perf_counter() - start)
+        else:
+            # 结构变更与版本记录在同一事务中提交，失败时整体回滚
+            with engine.begin() as connection:
+                item.apply(connection, db.metadata)
+                record_version(connection, item, time.perf_counter() - start)
+        executed.append(item.version)
+    return executed
+
+
+def migration_status(db):
+    done = applied_versions(db.engine)
+    return [{
+        'version': item.version,
+        'name': item.name,
+        'applied_at': done[item.version].applied_at.strftime('%Y-%m-%d %H:%M:%S') if item.version in done else None
+    } for item in sorted(MIGRATIONS, key=lambda m: m.version)]
+
+
+# 需要检查的数据量随使用增长的表；用户列表本身就是全量读取，不检查 user 表
+CHECKED_TABLES = {'post', 'comment', 'like', 'feed_change', 'post_archive', 'comment_archive', 'like_archive'}
+
+
+def unindexed_scans(plan_rows):
+    """返回查询计划中没有使用索引的全表扫描"""
+    problems = []
+    for row in plan_rows:
+        detail = row[-1]
+        if detail.startswith('SCAN ') and 'USING' not in detail:
+            # SQLite 3.36 之前输出 "SCAN TABLE <表名>"，之后输出 "SCAN <表名>"
+            words = detail.split()
+            table = words[2] if words[1] == 'TABLE' and len(words) > 2 else words[1]
+            if table.strip('"') in CHECKED_TABLES:
+                problems.append(detail)
+    return problems
+
+
+def verify_query_plans(app, db):
+    """
+    通过测试客户端访问各个热点只读接口，记录实际执行的 SELECT 语句，
+    逐条执行 EXPLAIN QUERY PLAN，返回 [(接口, SQL, 问题列表)]
+    """
+    if db.engine.dialect.name != 'sqlite':
+        raise RuntimeError('EXPLAIN QUERY PLAN 检查仅支持 SQLite')
+
+    with app.app_context():
+        viewer = db.session.execute(sa.text(
+            "SELECT id FROM user WHERE is_active = 1 ORDER BY is_admin DESC, id LIMIT 1")).scalar()
+        post_id = db.session.execute(sa.text("SELECT post_id FROM comment ORDER BY id DESC LIMIT 1")).scalar()
+        comment_id = db.session.execute(sa.text(
+            "SELECT parent_id FROM comment WHERE parent_id IS NOT NULL ORDER BY id DESC LIMIT 1")).scalar()
+    if not viewer:
+        raise RuntimeError('数据库中没有用户，无法检查')
+
+    urls = [
+        f'/api/posts?user_id={viewer}',
+        f'/api/posts?user_id={viewer}&limit=20',
+        f'/api/posts/changes?user_id={viewer}&since=0',
+        f'/api/users?user_id={viewer}',
+        f'/api/archive/posts?user_id={viewer}',
+    ]
+    if post_id:
+        urls.append(f'/api/posts/{post_id}/comments?user_id={viewer}')
+    if comment_id:
+        urls.append(f'/api/comments/{comment_id}/replies?user_id={viewer}')
+
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+            captured.append((statement, parameters))
+
+    client = app.test_client()
+    results = []
+    with app.app_context():
+        sa.event.listen(db.engine, 'before_cursor_execute', capture)
+        try:
+            for url in urls:
+                captured.clear()
+                response = client.get(url)
+                body = response.get_json(silent=True)
+                next_cursor = body.get('next_cursor') if isinstance(body, dict) else None
+                if next_cursor:
+                    # 第二页走游标条件，单独检查
+                    client.get(f'{url}&cursor={next_cursor}')
+                statements = list(captured)
+                for statement, parameters in statements:
+                    plan = db.session.connection().exec_driver_sql(
+                        'EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+                    results.append((url, statement, unindexed_scans(plan)))
+        finally:
+            sa.event.remove(db.engine, 'before_cursor_execute', capture)
+            db.session.rollback()
+    return results
+
+
+if __name__ == '__main__':
+    import contextlib
+    import io
+    from app import app, db
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'upgrade'
+    with app.app_context():
+        if command == 'upgrade':
+            print("开始数据库迁移...")
+            executed = upgrade_database(db)
+            print(f"数据库迁移完成，本次执行 {len(executed)} 个迁移" if executed else "数据库已是最新版本")
+        elif command == 'status':
+            for item in migration_status(db):
+                print(f"{item['version']:>4}  {item['name']:<28}{item['applied_at'] or '未执行'}")
+        elif command == 'verify':
+            # 屏蔽接口的请求日志输出
+            with contextlib.redirect_stdout(io.StringIO()):
+                results = verify_query_plans(app, db)
+            failures = [(url, statement, problems) for url, statement, problems in results if problems]
+            print(f"共检查 {len(results)} 条查询")
+            for url, statement, problems in failures:
+                print(f"\n[未使用索引] {url}\n{' '.join(statement.split())}")
+                for problem in problems:
+                    print(f"  {problem}")
+            if failures:
+                sys.exit(1)
+            print("所有热点查询均使用了索引")
+        else:
+            print(__doc__)
+            sys.exit(2)
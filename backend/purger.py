@@ -0,0 +1,153 @@
+"""
+已删除动态和用户的后台清理
+
+删除动态、删除用户的接口只记录 deleted_at 并立即返回，读取时这些行被视为不存在。
+本脚本在后台分批物理删除：每批最多 --batch-size 条动态，连同它们的点赞、评论及回复在一个短事务中删除，
+同时减少动态引用的图片的引用数；动态已全部清理的已删除用户随后删除。
+图片按内容保存、可能被多条动态引用（见 image_store.py），引用数为零且超过 UNREFERENCED_IMAGE_GRACE_HOURS 没有再上传的图片最后删除。
+每批之间暂停 --pause 秒，让请求中的写操作有机会取得写锁。
+
+用法: python purger.py              # 常驻运行，每 --interval 秒检查一次
+     python purger.py --once       # 清理完当前积压后退出
+"""
+
+import argparse
+import time
+from datetime import timedelta
+
+from app import (app, db, Post, Comment, Like, User, ImageBlob, beijing_time, comment_post_ids,
+                 delete_comments_where, refresh_post_counters, record_feed_changes, release_image_references)
+from image_store import remove_blob_files
+
+DEFAULT_BATCH_SIZE = 20
+DEFAULT_PAUSE = 0.2
+DEFAULT_INTERVAL = 10
+
+
+def purge_post_batch(batch_size):
+    """物理删除一批已删除的动态及其点赞、评论，释放动态引用的图片，返回动态数"""
+    rows = (db.session.query(Post.id, Post.images).filter(Post.deleted_at.isnot(None))
+            .order_by(Post.deleted_at, Post.id).limit(batch_size).all())
+    if not rows:
+        return 0
+
+    post_ids = [row.id for row in rows]
+    try:
+        post_comments = lambda comment: comment.post_id.in_(post_ids)
+        affected_post_ids = comment_post_ids(post_comments) - set(post_ids)
+        Like.query.filter(Like.post_id.in_(post_ids)).delete(synchronize_session=False)
+        delete_comments_where(post_comments)
+        Post.query.filter(Post.id.in_(post_ids)).delete(synchronize_session=False)
+        release_image_references(row.images for row in rows)
+
+        # 挂在其他动态下的回复也会一起删除，重算这些动态的计数
+        refresh_post_counters(affected_post_ids)
+        record_feed_changes('recount', affected_post_ids)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return len(post_ids)
+
+
+def purge_image_batch(batch_size):
+    """删除一批没有动态引用且超过宽限期的图片，返回删除的图片数"""
+    cutoff = beijing_time() - timedelta(hours=app.config['UNREFERENCED_IMAGE_GRACE_HOURS'])
+    names = [row.name for row in db.session.query(ImageBlob.name).filter(
+        ImageBlob.ref_count <= 0, ImageBlob.uploaded_at <= cutoff).limit(batch_size)]
+    if not names:
+        return 0
+
+    removed = 0
+    for name in names:
+        # 查询后可能刚被重新上传或引用，删除时再次检查条件；先删除文件再提交，
+        # 同时上传相同图片的请求会等到这里提交后发现文件不存在并重新写入
+        try:
+            deleted = ImageBlob.query.filter(ImageBlob.name == name, ImageBlob.ref_count <= 0,
+                                             ImageBlob.uploaded_at <= cutoff).delete(synchronize_session=False)
+            if deleted:
+                remove_blob_files(app.config['UPLOAD_FOLDER'], name)
+                removed += 1
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    return removed
+
+
+def purge_user_batch(batch_size):
+    """删除动态已全部清理的已删除用户，返回用户数"""
+    user_ids = [row.id for row in db.session.query(User.id).filter(
+        User.deleted_at.isnot(None), ~db.exists().where(Post.user_id == User.id)).limit(batch_size)]
+    if not user_ids:
+        return 0
+
+    try:
+        # 删除用户时已删除该用户的点赞和评论，这里只处理之后仍然引用该用户的行
+        Like.query.filter(Like.user_id.in_(user_ids)).delete(synchronize_session=False)
+        delete_comments_where(lambda comment: comment.user_id.in_(user_ids))
+        Comment.query.filter(Comment.replied_to_user_id.in_(user_ids)).update(
+            {Comment.replied_to_user_id: None}, synchronize_session=False)
+        User.query.filter(User.id.in_(user_ids)).delete(synchronize_session=False)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return len(user_ids)
+
+
+def purge_deleted(batch_size=DEFAULT_BATCH_SIZE, pause=0):
+    """清理当前全部积压，返回 (动态数, 图片数, 用户数)"""
+    posts = 0
+    while True:
+        start = time.perf_counter()
+        batch_posts = purge_post_batch(batch_size)
+        if not batch_posts:
+            break
+        posts += batch_posts
+        print(f"清理 {batch_posts} 条动态 ({(time.perf_counter() - start) * 1000:.0f}ms)")
+        time.sleep(pause)
+
+    images = 0
+    while True:
+        batch_images = purge_image_batch(batch_size)
+        if not batch_images:
+            break
+        images += batch_images
+        print(f"清理 {batch_images} 张图片")
+        time.sleep(pause)
+
+    users = 0
+    while True:
+        batch_users = purge_user_batch(batch_size)
+        if not batch_users:
+            break
+        users += batch_users
+        print(f"清理 {batch_users} 个用户")
+        time.sleep(pause)
+    return posts, images, users
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='后台清理已删除的动态和用户')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='每个事务清理的动态数')
+    parser.add_argument('--pause', type=float, default=DEFAULT_PAUSE, help='每批之间暂停的秒数')
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL, help='常驻运行时的检查间隔（秒）')
+    parser.add_argument('--once', action='store_true', help='清理完当前积压后退出')
+    args = parser.parse_args()
+
+    with app.app_context():
+        while True:
+            try:
+                posts, images, users = purge_deleted(args.batch_size, args.pause)
+                if posts or images or users:
+                    print(f"本轮清理完成: {posts} 条动态、{images} 张图片、{users} 个用户")
+            except Exception as e:
+                # 常驻运行时出错（如数据库忙）等待下一轮重试
+                if args.once:
+                    raise
+                print(f"清理失败: {e}")
+            if args.once:
+                break
+            db.session.remove()
+            time.sleep(args.interval)
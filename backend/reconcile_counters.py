@@ -0,0 +1,30 @@
+import sys
+from app import app, db, Post, refresh_post_counters
+
+# 根据点赞表和评论表重新计算所有动态的 like_count / comment_count
+# 用法: python reconcile_counters.py [--dry-run]
+
+def reconcile_counters(dry_run=False):
+    with app.app_context():
+        before = {post_id: (likes, comments) for post_id, likes, comments in
+                  db.session.query(Post.id, Post.like_count, Post.comment_count)}
+        
+        updated = refresh_post_counters()
+        
+        after = {post_id: (likes, comments) for post_id, likes, comments in
+                 db.session.query(Post.id, Post.like_count, Post.comment_count)}
+        drifted = [post_id for post_id in after if before.get(post_id) != after[post_id]]
+        
+        for post_id in drifted:
+            print(f"动态 {post_id}: {before.get(post_id)} -> {after[post_id]}")
+        
+        if dry_run:
+            db.session.rollback()
+            print(f"检查完成（未写入），共 {updated} 条动态，其中 {len(drifted)} 条计数不一致")
+        else:
+            db.session.commit()
+            print(f"计数重算完成，共 {updated} 条动态，修正 {len(drifted)} 条")
+        return drifted
+
+if __name__ == '__main__':
+    reconcile_counters(dry_run='--dry-run' in sys.argv)
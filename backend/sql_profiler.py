@@ -0,0 +1,147 @@
+"""
+按请求统计 SQL
+
+在 SQLAlchemy 引擎上挂 before/after_cursor_execute 钩子，记录每个请求执行的语句数、SQL 总耗时和最慢的一条语句。
+语句按“形状”（参数占位符统一为 ?、IN 列表合并为一个占位符、数字常量替换为 ? 后的 SQL）计数，
+同一形状在一个请求中执行超过阈值次数，通常是在循环里逐条查询，标记为 N+1。
+
+调试模式（app.debug 或 SQL_DEBUG_HEADERS）下统计结果写入 X-SQL-* 响应头；
+任何模式下，耗时超过 SLOW_REQUEST_MS 或出现 N+1 的请求都以一行 JSON 追加到 SLOW_REQUEST_LOG。
+请求之外（脚本、写队列进程）执行的语句不统计。
+"""
+
+import json
+import os
+import re
+import time
+from collections import Counter
+from datetime import datetime
+
+from flask import g, has_request_context, request
+
+DEFAULT_N_PLUS_ONE_THRESHOLD = 10
+DEFAULT_SLOW_REQUEST_MS = 500
+DEFAULT_SLOW_REQUEST_LOG = '/var/log/campus_yzx/slow_requests.log'
+
+_NAMED_PARAMETER = re.compile(r'%\(\w+\)s|%s|:\w+\b')
+_PARAMETER_LIST = re.compile(r'\?(?:\s*,\s*\?)+')
+_NUMBER = re.compile(r'(?<![\w."])\d+(?:\.\d+)?\b')
+_WHITESPACE = re.compile(r'\s+')
+
+# 响应头中展示的 SQL 最大长度
+HEADER_SQL_LENGTH = 200
+
+
+def statement_shape(statement):
+    """去掉参数差异后的 SQL，用于判断是否为同一条查询反复执行"""
+    shape = _NAMED_PARAMETER.sub('?', statement)
+    shape = _NUMBER.sub('?', shape)
+    shape = _PARAMETER_LIST.sub('?', shape)
+    return _WHITESPACE.sub(' ', shape).strip()
+
+
+class RequestSqlStats:
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.count = 0
+        self.sql_time = 0.0
+        self.slowest_time = 0.0
+        self.slowest_statement = None
+        self.shapes = Counter()
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.sql_time += duration
+        if duration >= self.slowest_time:
+            self.slowest_time = duration
+            self.slowest_statement = statement
+        self.shapes[statement_shape(statement)] += 1
+
+    def repeated_shapes(self, threshold):
+        """执行次数超过 threshold 的语句形状，按次数从多到少"""
+        return [(shape, count) for shape, count in self.shapes.most_common() if count > threshold]
+
+
+class RequestSqlProfiler:
+    def __init__(self):
+        self.app = None
+
+    def init_app(self, app, engine):
+        self.app = app
+        app.config.setdefault('SQL_N_PLUS_ONE_THRESHOLD', DEFAULT_N_PLUS_ONE_THRESHOLD)
+        app.config.setdefault('SLOW_REQUEST_MS', DEFAULT_SLOW_REQUEST_MS)
+        app.config.setdefault('SLOW_REQUEST_LOG', DEFAULT_SLOW_REQUEST_LOG)
+        app.config.setdefault('SQL_DEBUG_HEADERS', False)
+
+        from sqlalchemy import event
+        event.listen(engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self.after_cursor_execute)
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+
+    def start_request(self):
+        g.sql_stats = RequestSqlStats()
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        # 开始时间保存在本次执行的 context 上，语句出错时随 context 一起丢弃，不会残留在连接上
+        context._sql_profiler_started = time.perf_counter()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, '_sql_profiler_started', None)
+        if started is not None and has_request_context():
+            stats = g.get('sql_stats')
+            if stats is not None:
+                stats.record(statement, time.perf_counter() - started)
+
+    def finish_request(self, response):
+        stats = g.pop('sql_stats', None)
+        if stats is None:
+            return response
+
+        config = self.app.config
+        elapsed = time.perf_counter() - stats.started_at
+        repeated = stats.repeated_shapes(config['SQL_N_PLUS_ONE_THRESHOLD'])
+
+        if self.app.debug or config['SQL_DEBUG_HEADERS']:
+            response.headers['X-Request-Time-Ms'] = f'{elapsed * 1000:.1f}'
+            response.headers['X-SQL-Count'] = str(stats.count)
+            response.headers['X-SQL-Time-Ms'] = f'{stats.sql_time * 1000:.1f}'
+            if stats.slowest_statement:
+                response.headers['X-SQL-Slowest-Ms'] = f'{stats.slowest_time * 1000:.1f}'
+                response.headers['X-SQL-Slowest'] = header_value(stats.slowest_statement)
+            if repeated:
+                shape, count = repeated[0]
+                response.headers['X-SQL-N-Plus-One'] = f'{count}x {header_value(shape)}'
+
+        if repeated or elapsed * 1000 >= config['SLOW_REQUEST_MS']:
+            self.write_slow_request(config['SLOW_REQUEST_LOG'], {
+                'time': datetime.now().isoformat(timespec='seconds'),
+                'pid': os.getpid(),
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'duration_ms': round(elapsed * 1000, 1),
+                'sql_count': stats.count,
+                'sql_ms': round(stats.sql_time * 1000, 1),
+                'slowest_sql_ms': round(stats.slowest_time * 1000, 1),
+                'slowest_sql': _WHITESPACE.sub(' ', stats.slowest_statement or '').strip(),
+                'n_plus_one': [{'count': count, 'sql': shape} for shape, count in repeated]
+            })
+        return response
+
+    @staticmethod
+    def write_slow_request(path, record):
+        line = json.dumps(record, ensure_ascii=False)
+        try:
+            # 每条记录一次写入一整行，多个工作进程追加同一文件不会交错
+            with open(path, 'a', encoding='utf-8') as log_file:
+                log_file.write(line + '\n')
+        except OSError:
+            print('慢请求:', line)
+
+
+def header_value(statement):
+    """响应头只能包含单行 ASCII 字符"""
+    value = _WHITESPACE.sub(' ', statement).strip()
+    value = value.encode('ascii', 'replace').decode('ascii')
+    return value if len(value) <= HEADER_SQL_LENGTH else value[:HEADER_SQL_LENGTH - 3] + '...'
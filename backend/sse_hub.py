@@ -0,0 +1,239 @@
+"""
+动态实时推送服务（Server-Sent Events）
+
+独立于 gunicorn 运行的单进程 asyncio 服务：
+- 在 Unix 数据报套接字上接收各工作进程发布的动态事件（见 feed_events.py）
+- 通过 GET /api/stream 以 SSE 向所有连接的客户端广播新动态、点赞数变化和新评论
+- 保留最近的事件，客户端重连时按 Last-Event-ID 补发；超出范围时发送 reset 事件，
+  客户端改用 /api/posts/changes?since=<Last-Event-ID> 增量同步
+
+所有连接都由事件循环处理，不占用 gunicorn 的同步工作进程。
+由 nginx 将 /api/stream 代理到本服务（需关闭 proxy_buffering）。
+
+用法: python sse_hub.py [--host 127.0.0.1] [--port 5001] [--socket /tmp/campus_feed_events.sock]
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import os
+import socket
+import time
+from urllib.parse import urlsplit, parse_qs
+
+from feed_events import DEFAULT_EVENT_SOCKET
+
+HEARTBEAT_SECONDS = 15
+CLIENT_QUEUE_SIZE = 256
+REPLAY_BUFFER_SIZE = 1000
+MAX_CLIENTS = 5000
+
+# 客户端需要重新同步的标记
+RESET = object()
+
+
+class FeedHub:
+    def __init__(self, replay_size=REPLAY_BUFFER_SIZE):
+        self.clients = set()
+        self.recent = collections.deque(maxlen=replay_size)
+        # 各工作进程的事件到达顺序不一定与序号（即动态版本号）一致，补发范围按序号判断：
+        # first_seq 为启动以来收到的最小序号，evicted_seq 为已移出缓冲区的最大序号
+        self.first_seq = None
+        self.evicted_seq = None
+        self.last_seq = None
+        self.started_at = time.time()
+        self.published = 0
+        self.overflowed = 0
+        self.connections = 0
+
+    def publish(self, event):
+        seq = event['seq']
+        if len(self.recent) == self.recent.maxlen:
+            evicted = self.recent[0]['seq']
+            self.evicted_seq = evicted if self.evicted_seq is None else max(self.evicted_seq, evicted)
+        self.recent.append(event)
+        self.first_seq = seq if self.first_seq is None else min(self.first_seq, seq)
+        self.last_seq = seq if self.last_seq is None else max(self.last_seq, seq)
+        self.published += 1
+        for queue in list(self.clients):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # 客户端消费过慢：丢弃积压，通知其重新同步后断开
+                self.overflowed += 1
+                self.clients.discard(queue)
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(RESET)
+
+    def can_replay(self, last_event_id):
+        """缓冲区能否证明 last_event_id 之后的事件都还在：
+        启动以来收到过不晚于 last_event_id + 1 的事件，且移出缓冲区的事件都不晚于 last_event_id。
+        服务重启后缓冲区为空，无法证明，客户端需要重新同步"""
+        if not self.recent or self.first_seq > last_event_id + 1:
+            return False
+        return self.evicted_seq is None or self.evicted_seq <= last_event_id
+
+    def subscribe(self, last_event_id=None):
+        """注册新客户端，返回其队列；按 Last-Event-ID 预先放入需要补发的事件，无法补发时放入 reset"""
+        queue = asyncio.Queue(maxsize=CLIENT_QUEUE_SIZE)
+        if last_event_id is not None:
+            missed = sorted((event for event in self.recent if event['seq'] > last_event_id),
+                            key=lambda event: event['seq'])
+            if not self.can_replay(last_event_id) or len(missed) >= CLIENT_QUEUE_SIZE:
+                queue.put_nowait(RESET)
+            else:
+                for event in missed:
+                    queue.put_nowait(event)
+        self.clients.add(queue)
+        self.connections += 1
+        return queue
+
+    def unsubscribe(self, queue):
+        self.clients.discard(queue)
+
+    def stats(self):
+        return {
+            'pid': os.getpid(),
+            'clients': len(self.clients),
+            'connections': self.connections,
+            'published': self.published,
+            'overflowed': self.overflowed,
+            'buffered': len(self.recent),
+            'last_seq': self.last_seq,
+            'uptime': round(time.time() - self.started_at, 1)
+        }
+
+
+class EventReceiver(asyncio.DatagramProtocol):
+    def __init__(self, hub):
+        self.hub = hub
+
+    def datagram_received(self, data, addr):
+        try:
+            event = json.loads(data.decode('utf-8'))
+        except ValueError:
+            return
+        if isinstance(event, dict) and isinstance(event.get('seq'), int):
+            self.hub.publish(event)
+
+
+def format_event(event):
+    if event is RESET:
+        return b'event: reset\ndata: {}\n\n'
+    data = json.dumps(event, ensure_ascii=False, separators=(',', ':'))
+    return f"id: {event['seq']}\nevent: {event['kind']}\ndata: {data}\n\n".encode('utf-8')
+
+
+async def send_response(writer, status, body, content_type='application/json'):
+    payload = body.encode('utf-8')
+    writer.write(
+        f"HTTP/1.1 {status}\r\n"
+        f"Content-Type: {content_type}; charset=utf-8\r\n"
+        f"Content-Length: {len(payload)}\r\n"
+        "Connection: close\r\n\r\n".encode('utf-8') + payload
+    )
+    await writer.drain()
+
+
+async def handle_client(hub, reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=10)
+        headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout=10)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        parts = request_line.decode('latin-1').split()
+        if len(parts) < 2 or parts[0] != 'GET':
+            await send_response(writer, '405 Method Not Allowed', '{"error": "只支持GET请求"}')
+            return
+
+        url = urlsplit(parts[1])
+        params = parse_qs(url.query)
+
+        if url.path.rstrip('/') == '/api/stream/stats':
+            await send_response(writer, '200 OK', json.dumps(hub.stats()))
+            return
+
+        if url.path.rstrip('/') != '/api/stream':
+            await send_response(writer, '404 Not Found', '{"error": "接口不存在"}')
+            return
+
+        if not params.get('user_id'):
+            await send_response(writer, '401 Unauthorized', '{"error": "用户ID不能为空"}')
+            return
+
+        if len(hub.clients) >= MAX_CLIENTS:
+            await send_response(writer, '503 Service Unavailable', '{"error": "连接数已满，请稍后重试"}')
+            return
+
+        last_event_id = headers.get('last-event-id') or (params.get('last_event_id') or [None])[0]
+        try:
+            last_event_id = int(last_event_id) if last_event_id else None
+        except ValueError:
+            last_event_id = None
+
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream; charset=utf-8\r\n"
+            b"Cache-Control: no-cache\r\n"
+            b"Connection: keep-alive\r\n"
+            b"X-Accel-Buffering: no\r\n"
+            b"Access-Control-Allow-Origin: *\r\n\r\n"
+            b"retry: 3000\n\n"
+        )
+        await writer.drain()
+
+        queue = hub.subscribe(last_event_id)
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    # 心跳注释行，保持连接并及时发现断开的客户端
+                    writer.write(b': ping\n\n')
+                    await writer.drain()
+                    continue
+                writer.write(format_event(event))
+                await writer.drain()
+                if event is RESET:
+                    break
+        finally:
+            hub.unsubscribe(queue)
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+def bind_event_socket(path):
+    if os.path.exists(path):
+        os.remove(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.bind(path)
+    os.chmod(path, 0o660)
+    return sock
+
+
+async def serve(host, port, socket_path):
+    hub = FeedHub()
+    loop = asyncio.get_running_loop()
+    await loop.create_datagram_endpoint(lambda: EventReceiver(hub), sock=bind_event_socket(socket_path))
+    server = await asyncio.start_server(lambda r, w: handle_client(hub, r, w), host, port)
+    print(f"实时推送服务已启动: http://{host}:{port}/api/stream, 事件套接字: {socket_path}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='动态实时推送服务')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--socket', default=DEFAULT_EVENT_SOCKET)
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port, args.socket))
@@ -0,0 +1,198 @@
+"""
+级联删除测试
+
+delete_post、delete_comment、delete_user 改为批量 DELETE（动态和用户先标记删除，由 purger.py 清理）后，
+与原来逐条加载并 db.session.delete 的做法对比清理完成后的全部数据，并检查冗余计数与实际数量一致。
+设置 CAMPUS_TEST_DATABASE_URI 可在本地 PostgreSQL 测试库上运行（见 conftest.py）。
+
+用法: python -m pytest -q test_cascade_delete.py
+"""
+
+import contextlib
+import io
+
+from app import app, db, User, Post, Comment, Like, refresh_post_counters
+from purger import purge_deleted
+
+ADMIN = 1
+
+# (id, 作者)
+POSTS = [(1, 2), (2, 3), (3, 2), (4, 4)]
+# (id, 动态, 父评论, 作者)：包含回复的回复、父评论在其他动态下的评论等边界情况
+COMMENTS = [
+    (1, 1, None, 3), (2, 1, 1, 4), (3, 1, 2, 2),
+    (4, 2, None, 2), (5, 2, 4, 3), (6, 2, 5, 4), (7, 2, None, 4),
+    (8, 4, None, 3), (9, 3, 8, 4), (10, 4, 8, 2), (11, 3, None, 5), (12, 4, 1, 5),
+]
+# (用户, 动态)
+LIKES = [(2, 2), (3, 1), (4, 1), (2, 4), (3, 3), (5, 2), (4, 3)]
+
+
+def build_dataset():
+    with app.app_context():
+        for user_id in range(1, 6):
+            db.session.add(User(id=user_id, username=f'user{user_id}', password_hash='x', real_name=f'用户{user_id}',
+                                is_admin=user_id == ADMIN, is_teacher=user_id == ADMIN))
+        for post_id, author in POSTS:
+            db.session.add(Post(id=post_id, user_id=author, content=f'动态{post_id}'))
+        db.session.flush()
+        for comment_id, post_id, parent_id, author in COMMENTS:
+            db.session.add(Comment(id=comment_id, post_id=post_id, parent_id=parent_id, user_id=author,
+                                   content=f'评论{comment_id}'))
+        for user_id, post_id in LIKES:
+            db.session.add(Like(user_id=user_id, post_id=post_id))
+        db.session.flush()
+        refresh_post_counters()
+        db.session.commit()
+
+
+def snapshot():
+    return {
+        'users': sorted(row.id for row in db.session.query(User.id)),
+        'posts': sorted(tuple(row) for row in db.session.query(Post.id, Post.user_id)),
+        'comments': sorted(tuple(row) for row in db.session.query(
+            Comment.id, Comment.post_id, Comment.parent_id, Comment.user_id)),
+        'likes': sorted(tuple(row) for row in db.session.query(Like.user_id, Like.post_id)),
+    }
+
+
+def counter_drift(include_deleted=False):
+    """返回冗余计数与实际数量不一致的动态（默认不含已删除、等待清理的动态）"""
+    drift = []
+    query = Post.query if include_deleted else Post.query.filter(Post.deleted_at.is_(None))
+    for post in query:
+        likes = Like.query.filter_by(post_id=post.id).count()
+        comments = Comment.query.filter_by(post_id=post.id).count()
+        if (post.like_count, post.comment_count) != (likes, comments):
+            drift.append((post.id, post.like_count, likes, post.comment_count, comments))
+    return drift
+
+
+# 以下为改动前的逐条删除逻辑，作为期望结果
+
+def legacy_delete_post(post_id):
+    post = Post.query.get(post_id)
+    for like in Like.query.filter_by(post_id=post.id).all():
+        db.session.delete(like)
+    for comment in Comment.query.filter_by(post_id=post.id).all():
+        for reply in Comment.query.filter_by(parent_id=comment.id).all():
+            db.session.delete(reply)
+        db.session.delete(comment)
+    db.session.delete(post)
+
+
+def legacy_delete_comment(comment_id):
+    comment = Comment.query.get(comment_id)
+    for reply in Comment.query.filter_by(parent_id=comment.id).all():
+        db.session.delete(reply)
+    db.session.delete(comment)
+
+
+def legacy_delete_user(target_user_id):
+    for like in Like.query.filter_by(user_id=target_user_id).all():
+        db.session.delete(like)
+    for comment in Comment.query.filter_by(user_id=target_user_id).all():
+        for reply in Comment.query.filter_by(parent_id=comment.id).all():
+            db.session.delete(reply)
+        db.session.delete(comment)
+    for post in Post.query.filter_by(user_id=target_user_id).all():
+        for like in Like.query.filter_by(post_id=post.id).all():
+            db.session.delete(like)
+        for comment in Comment.query.filter_by(post_id=post.id).all():
+            for reply in Comment.query.filter_by(parent_id=comment.id).all():
+                db.session.delete(reply)
+            db.session.delete(comment)
+        db.session.delete(post)
+    db.session.delete(User.query.get(target_user_id))
+
+
+def expected_state(legacy, target_id):
+    """在事务中执行原删除逻辑并记录结果，然后回滚"""
+    with app.app_context():
+        with contextlib.redirect_stderr(io.StringIO()):
+            legacy(target_id)
+            db.session.flush()
+        state = snapshot()
+        db.session.rollback()
+    return state
+
+
+def check_delete(legacy, target_id, url):
+    build_dataset()
+    expected = expected_state(legacy, target_id)
+    client = app.test_client()
+    with contextlib.redirect_stdout(io.StringIO()):
+        response = client.delete(url)
+    assert response.status_code == 200, response.get_json()
+    with app.app_context():
+        with contextlib.redirect_stdout(io.StringIO()):
+            purge_deleted()
+        actual = snapshot()
+        drift = counter_drift()
+    assert actual == expected, f'{url}\n期望: {expected}\n实际: {actual}'
+    assert not drift, f'{url} 计数不一致: {drift}'
+
+
+def test_delete_post_by_author():
+    check_delete(legacy_delete_post, 1, '/api/posts/1?user_id=2')
+
+
+def test_delete_post_with_reply_on_other_post():
+    check_delete(legacy_delete_post, 4, f'/api/posts/4?user_id={ADMIN}')
+
+
+def test_delete_top_level_comment():
+    check_delete(legacy_delete_comment, 1, '/api/comments/1?user_id=3')
+
+
+def test_delete_comment_with_nested_replies():
+    check_delete(legacy_delete_comment, 4, '/api/comments/4?user_id=2')
+
+
+def test_delete_reply():
+    check_delete(legacy_delete_comment, 2, '/api/comments/2?user_id=4')
+
+
+def test_delete_user_with_posts_comments_and_likes():
+    check_delete(legacy_delete_user, 2, f'/api/users/2?user_id={ADMIN}')
+
+
+def test_delete_user_without_posts():
+    check_delete(legacy_delete_user, 5, f'/api/users/5?user_id={ADMIN}')
+
+
+def test_delete_user_with_replies_on_other_posts():
+    check_delete(legacy_delete_user, 3, f'/api/users/3?user_id={ADMIN}')
+
+
+def test_deleted_post_hidden_before_purge():
+    build_dataset()
+    client = app.test_client()
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert client.delete('/api/posts/2?user_id=3').status_code == 200
+        feed = client.get('/api/posts?user_id=2').get_json()
+        comments = client.get('/api/posts/2/comments?user_id=2')
+        like = client.post('/api/posts/2/like', json={'user_id': 2})
+    assert 2 not in {post['id'] for post in feed}
+    assert comments.status_code == 404 and like.status_code == 404
+    with app.app_context():
+        # 清理前数据仍在，只是带有删除标记
+        assert db.session.get(Post, 2).deleted_at is not None
+
+
+def test_deleted_user_hidden_before_purge():
+    build_dataset()
+    client = app.test_client()
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert client.delete(f'/api/users/3?user_id={ADMIN}').status_code == 200
+        feed = client.get('/api/posts?user_id=2').get_json()
+        users = client.get(f'/api/users?user_id={ADMIN}').get_json()
+        login = client.post('/api/login', json={'username': 'user3', 'password': 'x'})
+    assert 2 not in {post['id'] for post in feed}
+    assert all(comment['user_id'] != 3 for post in feed for comment in post['comments'])
+    assert 3 not in {user['id'] for user in users}
+    assert login.status_code == 401
+    with app.app_context():
+        # 用户自己在已标记删除的动态下的评论也已删除，这些动态的计数同样要正确，归档或恢复时才不出错
+        assert db.session.get(Post, 2).deleted_at is not None
+        assert not counter_drift(include_deleted=True)
@@ -0,0 +1,185 @@
+"""
+按内容寻址的图片存储测试
+
+相同内容的图片重复上传只保存一份、第二次上传不写盘；发布动态增加引用数，清理动态减少引用数，
+最后一条引用清理后文件才被删除，删除用户时归档动态的引用同样释放；
+旧规则命名的文件经 fold_uploads 合并重复、改写动态和归档动态中的文件名并重算引用数；
+文件保存在两级子目录中，平铺的旧文件在移入子目录前后都能访问，平铺的旧备份按分层目录复制。
+
+用法: python -m pytest -q test_image_store.py
+"""
+
+import contextlib
+import io
+import os
+
+import pytest
+
+from app import app, db, User, Post, ArchivedPost, ImageBlob
+from image_store import fold_uploads, is_blob_name, blob_name, hash_stream
+from upload_storage import find_original, iter_originals, clear_originals, copy_originals, shard_uploads
+from purger import purge_deleted
+
+
+@pytest.fixture(autouse=True)
+def no_grace_period():
+    app.config['UNREFERENCED_IMAGE_GRACE_HOURS'] = 0
+
+
+# 不是有效图片，不会生成其他尺寸，只检查存储本身
+MEME = b'GIF89a meme forwarded by the whole class'
+OTHER = b'GIF89a another picture'
+
+
+def build_dataset():
+    with app.app_context():
+        db.session.add(User(id=1, username='teacher01', password_hash='x', real_name='老师', is_teacher=True, is_admin=True))
+        for user_id in (2, 3):
+            db.session.add(User(id=user_id, username=f'student0{user_id}', password_hash='x', real_name=f'学生{user_id}'))
+        db.session.commit()
+
+
+def stored():
+    return sorted(name for name, _ in iter_originals(app.config['UPLOAD_FOLDER']))
+
+
+def call(method, url, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        response = getattr(app.test_client(), method)(url, **kwargs)
+    return response, output.getvalue()
+
+
+def upload(content, filename='meme.gif', user_id=2):
+    response, output = call('post', '/api/uploads', data={
+        'user_id': str(user_id), 'file': (io.BytesIO(content), filename)
+    }, content_type='multipart/form-data')
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()['filenames'][0], output
+
+
+def create_post(user_id, images):
+    response, _ = call('post', '/api/posts', json={'user_id': user_id, 'content': '转发', 'images': images})
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()['post_id']
+
+
+def blobs():
+    with app.app_context():
+        return {blob.name: blob.ref_count for blob in ImageBlob.query}
+
+
+def purge():
+    with app.app_context(), contextlib.redirect_stdout(io.StringIO()):
+        return purge_deleted()
+
+
+def test_same_image_is_stored_once(upload_folder):
+    build_dataset()
+    name, _ = upload(MEME)
+    assert is_blob_name(name), name
+    path = find_original(upload_folder, name)
+    inode = os.stat(path).st_ino
+
+    again, output = upload(MEME, 'forwarded.GIF', user_id=3)
+    assert again == name and '图片已存在，复用' in output
+    assert os.stat(path).st_ino == inode and stored() == [name]
+    assert upload(OTHER)[0] != name
+
+
+def test_file_removed_after_last_reference(upload_folder):
+    build_dataset()
+    name, _ = upload(MEME)
+    other, _ = upload(OTHER)
+    first = create_post(2, name)
+    second = create_post(3, f'{name},{other}')
+    assert blobs() == {name: 2, other: 1}
+
+    assert call('delete', f'/api/posts/{first}?user_id=2')[0].status_code == 200
+    assert purge() == (1, 0, 0)
+    assert blobs() == {name: 1, other: 1} and find_original(upload_folder, name)
+
+    assert call('delete', f'/api/posts/{second}?user_id=3')[0].status_code == 200
+    assert purge() == (1, 2, 0)
+    assert blobs() == {} and stored() == []
+
+
+def test_delete_user_releases_archived_images(upload_folder):
+    build_dataset()
+    name, _ = upload(MEME)
+    create_post(2, name)
+    with app.app_context():
+        db.session.add(ArchivedPost(id=100, user_id=3, content='旧动态', images=name))
+        db.session.query(ImageBlob).update({ImageBlob.ref_count: ImageBlob.ref_count + 1})
+        db.session.commit()
+    assert blobs() == {name: 2}
+
+    assert call('delete', '/api/users/3?user_id=1')[0].status_code == 200
+    assert purge() == (0, 0, 1)
+    assert blobs() == {name: 1} and find_original(upload_folder, name)
+
+
+def test_fold_legacy_uploads(upload_folder):
+    build_dataset()
+    legacy = ['meme_1700000000_aaaa1111.gif', 'meme_1700000100_bbbb2222.gif', 'other_1700000200_cccc3333.gif']
+    for filename, content in zip(legacy, (MEME, MEME, OTHER)):
+        with open(os.path.join(upload_folder, filename), 'wb') as image:
+            image.write(content)
+    # 上传目录中不是图片的文件不改名
+    for filename in ('.gitkeep', 'README.txt'):
+        with open(os.path.join(upload_folder, filename), 'wb') as other_file:
+            other_file.write(b'')
+    with app.app_context():
+        db.session.add(Post(id=1, user_id=2, content='原图', images=legacy[0]))
+        db.session.add(Post(id=2, user_id=3, content='转发', images=f'{legacy[1]},{legacy[0]},{legacy[2]}'))
+        db.session.add(ArchivedPost(id=3, user_id=3, content='归档', images=legacy[1]))
+        db.session.commit()
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+                assert fold_uploads(connection, db.metadata, upload_folder) == (2, 1)
+                # 再次执行不再改名
+                assert fold_uploads(connection, db.metadata, upload_folder) == (0, 0)
+        meme, other = (blob_name(hash_stream(io.BytesIO(content)), 'image.gif') for content in (MEME, OTHER))
+        assert stored() == sorted([meme, other])
+        assert os.path.exists(os.path.join(upload_folder, '.gitkeep'))
+        assert os.path.exists(os.path.join(upload_folder, 'README.txt'))
+        assert db.session.get(Post, 1).images == meme
+        assert db.session.get(Post, 2).images == f'{meme},{other}'
+        assert db.session.get(ArchivedPost, 3).images == meme
+    assert blobs() == {meme: 3, other: 1}
+
+
+def test_sharded_layout_and_legacy_names(upload_folder, tmp_path):
+    build_dataset()
+    name, _ = upload(MEME)
+    assert find_original(upload_folder, name) == os.path.join(upload_folder, name[0:2], name[2:4], name)
+
+    # 还没有迁移的旧文件平铺在上传目录下，动态中保存的仍是旧文件名
+    legacy = 'photo_1700000000_aaaa1111.gif'
+    with open(os.path.join(upload_folder, legacy), 'wb') as image:
+        image.write(OTHER)
+    assert call('get', f'/api/images/{legacy}')[0].data == OTHER
+    # 不是图片的文件不移动、不复制，清空上传目录时保留
+    gitkeep = os.path.join(upload_folder, '.gitkeep')
+    with open(gitkeep, 'wb') as other_file:
+        other_file.write(b'')
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert shard_uploads(upload_folder) == 1
+        assert shard_uploads(upload_folder) == 0
+    assert not os.path.exists(os.path.join(upload_folder, legacy))
+    assert os.path.exists(gitkeep) and stored() == sorted([name, legacy])
+    assert call('get', f'/api/images/{legacy}')[0].data == OTHER
+    assert call('get', f'/api/images/{name}')[0].data == MEME
+    assert call('get', '/api/images/missing.gif')[0].status_code == 404
+
+    # 平铺的旧备份恢复时按分层目录复制
+    backup = str(tmp_path / 'old_backup')
+    os.makedirs(backup, exist_ok=True)
+    with open(os.path.join(backup, legacy), 'wb') as image:
+        image.write(OTHER)
+    with open(os.path.join(backup, '.gitkeep'), 'wb') as other_file:
+        other_file.write(b'')
+    clear_originals(upload_folder)
+    assert os.path.exists(gitkeep)
+    assert copy_originals(backup, upload_folder) == 1
+    assert stored() == [legacy] and os.path.dirname(find_original(upload_folder, legacy)) != upload_folder
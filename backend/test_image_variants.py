@@ -0,0 +1,182 @@
+"""
+图片多尺寸版本测试
+
+上传图片后检查 thumb、feed、full 三种尺寸：最长边、EXIF 方向已旋转且去掉了 EXIF；
+GIF 等不生成其他尺寸的图片以及还没有生成时返回原图；支持 WebP 的浏览器得到 WebP 版本；
+清理动态时各尺寸一起删除；补生成命令只补缺少的尺寸；启动图片处理服务后上传不再在请求中生成；
+图片响应的强 ETag、immutable 缓存、304、Range，以及交给 nginx 发送时的 X-Accel-Redirect。
+
+用法: python -m pytest -q test_image_variants.py
+"""
+
+import contextlib
+import io
+import os
+import threading
+import time
+
+import pytest
+from PIL import Image
+
+import app as app_module
+from app import app, db, User, Post, ImageBlob
+from image_variants import IMAGE_VARIANTS, variant_path, webp_variant_path, backfill_variants
+from image_serving import stat_image
+from image_worker import ImageWorker
+from purger import purge_deleted
+from upload_storage import find_original
+
+
+@pytest.fixture(autouse=True)
+def no_grace_period():
+    app.config['UNREFERENCED_IMAGE_GRACE_HOURS'] = 0
+
+
+def image_bytes(size, image_format='JPEG', orientation=None):
+    image = Image.new('RGB' if image_format == 'JPEG' else 'P', size, 'red' if image_format == 'JPEG' else 0)
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, exif=exif)
+    return buffer.getvalue()
+
+
+def upload(content, filename):
+    with contextlib.redirect_stdout(io.StringIO()):
+        response = app.test_client().post('/api/uploads', data={
+            'user_id': '1', 'file': (io.BytesIO(content), filename)
+        }, content_type='multipart/form-data')
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()['filenames'][0]
+
+
+def fetch(filename, size, accept='image/*'):
+    with contextlib.redirect_stdout(io.StringIO()):
+        response = app.test_client().get(f'/api/images/{filename}?size={size}', headers={'Accept': accept})
+    return response.status_code, response.data
+
+
+def test_upload_generates_rotated_variants():
+    # 横拍 4000x3000，EXIF 方向 6 表示需要顺时针旋转 90 度
+    name = upload(image_bytes((4000, 3000), orientation=6), 'photo.jpg')
+    for size, edge in IMAGE_VARIANTS.items():
+        status, data = fetch(name, size)
+        assert status == 200, size
+        with Image.open(io.BytesIO(data)) as image:
+            assert image.size == (edge * 3 // 4, edge), (size, image.size)
+            assert 0x0112 not in image.getexif(), size
+    status, data = fetch(name, 'original')
+    assert status == 200 and Image.open(io.BytesIO(data)).size == (4000, 3000)
+    assert fetch(name, 'huge')[0] == 400
+
+    status, data = fetch(name, 'feed', accept='image/avif,image/webp,*/*')
+    assert status == 200 and Image.open(io.BytesIO(data)).format == 'WEBP'
+    assert Image.open(io.BytesIO(fetch(name, 'feed')[1])).format == 'JPEG'
+
+
+def test_gif_and_missing_variants_fall_back_to_original(upload_folder):
+    gif = image_bytes((800, 600), 'GIF')
+    name = upload(gif, 'animation.gif')
+    assert not os.path.exists(variant_path(upload_folder, name, 'thumb'))
+    assert fetch(name, 'thumb') == (200, gif)
+
+    name = upload(image_bytes((800, 600)), 'photo.jpg')
+    os.remove(variant_path(upload_folder, name, 'feed'))
+    status, data = fetch(name, 'feed')
+    assert status == 200 and Image.open(io.BytesIO(data)).size == (800, 600)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert backfill_variants(upload_folder) == (1, 1)
+    assert os.path.exists(variant_path(upload_folder, name, 'feed'))
+
+
+def test_purge_removes_variants(upload_folder):
+    name = upload(image_bytes((1200, 900)), 'photo.jpg')
+    with app.app_context():
+        db.session.add(User(id=1, username='student01', password_hash='x', real_name='学生'))
+        db.session.add(Post(id=1, user_id=1, content='动态', images=name, deleted_at=db.func.now()))
+        # 上传时已登记文件，发布动态后引用数为 1
+        db.session.get(ImageBlob, name).ref_count = 1
+        db.session.commit()
+        with contextlib.redirect_stdout(io.StringIO()):
+            purge_deleted()
+    assert not find_original(upload_folder, name)
+    for size in IMAGE_VARIANTS:
+        assert not os.path.exists(variant_path(upload_folder, name, size)), size
+
+
+def test_cache_headers_conditional_and_range(upload_folder):
+    content = image_bytes((1600, 1200))
+    name = upload(content, 'photo.jpg')
+    client = app.test_client()
+    with contextlib.redirect_stdout(io.StringIO()):
+        response = client.get(f'/api/images/{name}')
+        etag = response.headers['ETag']
+        assert response.data == content and not response.headers['ETag'].startswith('W/')
+        assert response.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+
+        response = client.get(f'/api/images/{name}', headers={'If-None-Match': etag})
+        assert response.status_code == 304 and response.data == b''
+        response = client.get(f'/api/images/{name}', headers={'Range': 'bytes=100-199'})
+        assert response.status_code == 206 and response.data == content[100:200]
+        assert response.headers['Content-Range'] == f'bytes 100-199/{len(content)}'
+        assert client.get(f'/api/images/{name}', headers={'Range': 'bytes=99999999-'}).status_code == 416
+
+        # 没有其他尺寸（或还没有生成）时返回的原图不能被浏览器永久缓存
+        gif = upload(image_bytes((800, 600), 'GIF'), 'animation.gif')
+        response = client.get(f'/api/images/{gif}?size=thumb', headers={'Accept': 'image/webp'})
+        assert response.mimetype == 'image/gif' and response.headers['Cache-Control'] == 'no-cache'
+
+        app.config['IMAGE_ACCEL_REDIRECT'] = '/images/_files/'
+        try:
+            response = client.get(f'/api/images/{name}?size=feed')
+        finally:
+            app.config['IMAGE_ACCEL_REDIRECT'] = ''
+    assert response.status_code == 200 and response.data == b''
+    assert response.headers['X-Accel-Redirect'] == '/images/_files/' + os.path.relpath(
+        variant_path(upload_folder, name, 'feed'), upload_folder)
+    assert response.mimetype == 'image/jpeg' and 'immutable' in response.headers['Cache-Control']
+
+
+def test_image_vanishing_while_served(upload_folder, monkeypatch):
+    content = image_bytes((400, 300))
+    name = upload(content, 'vanish.jpg')
+    original = find_original(upload_folder, name)
+    stale = stat_image(original, immutable=True)._replace(path=original + '.moved')
+    client = app.test_client()
+    # 缓存中的路径已失效时重新查找一次
+    app_module.image_stats.put((name, 'original', False), stale)
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert client.get(f'/api/images/{name}').data == content
+
+    # 文件一直在消失（如正在合并或清理）时返回 404，不再反复重试
+    monkeypatch.setattr(app_module, 'locate_image', lambda *args: stale)
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert client.get(f'/api/images/{name}').status_code == 404
+
+
+def test_upload_hands_off_to_image_worker(upload_folder, tmp_path):
+    socket_path = str(tmp_path / 'image_worker.sock')
+    worker = ImageWorker(upload_folder, workers=1, max_pending=4)
+    with contextlib.redirect_stdout(io.StringIO()):
+        threading.Thread(target=worker.serve, args=(socket_path,), daemon=True).start()
+        deadline = time.time() + 10
+        while not os.path.exists(socket_path) and time.time() < deadline:
+            time.sleep(0.01)
+    app_module.image_tasks.socket_path = socket_path
+    try:
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            response = app.test_client().post('/api/uploads', data={
+                'user_id': '1', 'file': (io.BytesIO(image_bytes((3000, 2000))), 'photo.jpg')
+            }, content_type='multipart/form-data')
+        name = response.get_json()['filenames'][0]
+        assert '已提交图片处理服务' in output.getvalue() and '生成其他尺寸:' not in output.getvalue()
+
+        deadline = time.time() + 30
+        while not os.path.exists(webp_variant_path(upload_folder, name, 'thumb')) and time.time() < deadline:
+            time.sleep(0.05)
+    finally:
+        app_module.image_tasks.socket_path = ''
+    status, data = fetch(name, 'thumb')
+    assert status == 200 and Image.open(io.BytesIO(data)).size == (320, 213), 'image worker did not finish'
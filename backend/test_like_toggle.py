@@ -0,0 +1,76 @@
+"""
+点赞切换测试
+
+点赞改为“先删除、没有再插入并忽略唯一约束冲突”后，检查重复点赞不会产生多余的行或报错，
+多个线程同时点赞同一条动态时 like_count 与实际点赞数一致。
+设置 CAMPUS_TEST_DATABASE_URI 可在本地 PostgreSQL 测试库上运行（见 conftest.py）。
+
+用法: python -m pytest -q test_like_toggle.py
+"""
+
+import contextlib
+import io
+import threading
+
+from app import app, db, User, Post, Like, insert_like_ignoring_conflict
+
+USERS = 8
+
+
+def build_dataset():
+    with app.app_context():
+        for user_id in range(1, USERS + 1):
+            db.session.add(User(id=user_id, username=f'user{user_id}', password_hash='x', real_name=f'用户{user_id}'))
+        db.session.add(Post(id=1, user_id=1, content='动态1'))
+        db.session.commit()
+
+
+def like_state(post_id=1):
+    with app.app_context():
+        post = db.session.get(Post, post_id)
+        return post.like_count, Like.query.filter_by(post_id=post_id).count()
+
+
+def toggle(user_id, post_id=1):
+    response = app.test_client().post(f'/api/posts/{post_id}/like', json={'user_id': user_id})
+    assert response.status_code in (200, 201), response.get_json()
+    return response.get_json()
+
+
+def test_toggle_on_and_off():
+    build_dataset()
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert toggle(2)['is_liked'] is True
+        assert like_state() == (1, 1)
+        result = toggle(2)
+    assert result['is_liked'] is False and result['likes'] == 0
+    assert like_state() == (0, 0)
+
+
+def test_duplicate_insert_is_ignored():
+    build_dataset()
+    with app.app_context():
+        assert insert_like_ignoring_conflict(3, 1) is True
+        assert insert_like_ignoring_conflict(3, 1) is False
+        db.session.commit()
+        assert Like.query.filter_by(user_id=3, post_id=1).count() == 1
+
+
+def test_concurrent_likes_keep_counter_consistent():
+    build_dataset()
+    errors = []
+
+    def run(user_id):
+        try:
+            toggle(user_id)
+        except AssertionError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=run, args=(user_id,)) for user_id in range(1, USERS + 1)]
+    with contextlib.redirect_stdout(io.StringIO()):
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    assert not errors, errors
+    assert like_state() == (USERS, USERS)
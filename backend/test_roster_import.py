@@ -0,0 +1,137 @@
+"""
+花名册批量导入测试
+
+通过 /api/user/batch_import 上传 CSV（UTF-8、GBK）和 xlsx 花名册，检查分块导入的结果、
+跨块的重复账号、错误信息中的行号、进度文件，以及缺少列、文件损坏和权限不足时的返回。
+
+用法: python -m pytest -q test_roster_import.py
+"""
+
+import contextlib
+import io
+import os
+import time
+
+import pytest
+
+import app as app_module
+from app import app, db, User
+from bench_import import write_xlsx
+
+
+ROSTER = [
+    ['登录账号', '姓名', '年级', '班级', '密码'],
+    ['student01', '张三', '1', '2', ''],
+    ['student02', '', '3', '4', 'abc12345'],
+    ['', '', '', '', ''],
+    ['student01', '李四', '2', '2', ''],     # 与第 2 行重复，分在下一块
+    ['teacher01', '王五', '2', '2', ''],     # 已存在
+    ['student03', '赵六', '8', '1', ''],     # 年级不合法
+    ['s1', '钱七', '1', '1', ''],            # 用户名太短
+    ['student04', '孙八', '5', '6', 'short'],
+]
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    # 每块两行，花名册分成多块导入
+    monkeypatch.setattr(app_module, 'IMPORT_ROSTER_CHUNK_SIZE', 2)
+
+
+def build_dataset():
+    with app.app_context():
+        db.session.add(User(id=1, username='admin01', password_hash='x', real_name='管理员', is_admin=True))
+        db.session.add(User(id=2, username='teacher01', password_hash='x', real_name='老师', is_teacher=True))
+        db.session.commit()
+
+
+def roster_csv(encoding='utf-8-sig', rows=ROSTER):
+    return '\n'.join(','.join(row) for row in rows).encode(encoding)
+
+
+def upload(content, filename, admin_id='1', import_id=None):
+    data = {'admin_id': admin_id, 'file': (io.BytesIO(content), filename)}
+    if import_id:
+        data['import_id'] = import_id
+    with contextlib.redirect_stdout(io.StringIO()):
+        response = app.test_client().post('/api/user/batch_import', data=data, content_type='multipart/form-data')
+    return response.status_code, response.get_json()
+
+
+def imported_users():
+    with app.app_context():
+        return {user.username: (user.real_name, user.grade, user.class_name, user.is_first_login)
+                for user in User.query.filter(User.id > 2)}
+
+
+def check_roster_result(status, data):
+    assert status == 200, data
+    assert (data['processed'], data['created'], data['failed']) == (7, 2, 5), data
+    assert data['errors'] == [
+        '行 5: 用户名 student01 已存在',
+        '行 6: 用户名 teacher01 已存在',
+        '行 7: 年级必须在1-5年级之间，班级必须在1-6班之间',
+        '行 8: 用户名长度必须在6-16个字符之间',
+        '行 9: 密码长度不能少于7位',
+    ], data['errors']
+    assert imported_users() == {
+        'student01': ('张三', 1, 2, True),
+        'student02': ('student02', 3, 4, True),
+    }
+
+
+def test_csv_import_in_chunks():
+    build_dataset()
+    check_roster_result(*upload(roster_csv(), 'roster.csv', import_id='test-csv'))
+    with contextlib.redirect_stdout(io.StringIO()):
+        progress = app.test_client().get('/api/user/batch_import/test-csv?user_id=1').get_json()
+    assert progress['done'] is True and progress['created'] == 2 and progress['processed'] == 7, progress
+
+
+def test_import_id_cannot_be_reused():
+    build_dataset()
+    assert upload(roster_csv(), 'roster.csv', import_id='test-reuse')[0] == 200
+    status, data = upload(roster_csv(), 'roster.csv', import_id='test-reuse')
+    assert status == 409, data
+    assert len(imported_users()) == 2
+
+
+def test_old_progress_files_expire():
+    build_dataset()
+    stale = os.path.join(app.config['IMPORT_PROGRESS_DIR'], 'stale.json')
+    with open(stale, 'w', encoding='utf-8') as progress_file:
+        progress_file.write('{}')
+    old = time.time() - app.config['IMPORT_PROGRESS_RETENTION_HOURS'] * 3600 - 60
+    os.utime(stale, (old, old))
+    assert upload(roster_csv(), 'roster.csv', import_id='test-fresh')[0] == 200
+    assert not os.path.exists(stale)
+    assert os.path.exists(os.path.join(app.config['IMPORT_PROGRESS_DIR'], 'test-fresh.json'))
+
+
+def test_gbk_csv_import():
+    build_dataset()
+    check_roster_result(*upload(roster_csv('gbk'), 'roster.csv'))
+
+
+def test_xlsx_import(tmp_path):
+    build_dataset()
+    path = str(tmp_path / 'roster.xlsx')
+    # 年级、班级写成数字单元格，空单元格不写入文件
+    write_xlsx(path, [[int(value) if value.isdigit() else value for value in row] for row in ROSTER[1:]])
+    with open(path, 'rb') as roster:
+        check_roster_result(*upload(roster.read(), 'roster.xlsx'))
+
+
+def test_rejected_uploads():
+    build_dataset()
+    status, data = upload(roster_csv(rows=[['账号', '年级', '班级'], ['student01', '1', '1']]), 'roster.csv')
+    assert status == 400 and '必须包含' in data['error'], data
+    status, data = upload(b'not a zip file', 'roster.xlsx')
+    assert status == 400 and '无法解析' in data['error'], data
+    status, data = upload(roster_csv(), 'roster.xls')
+    assert status == 400, data
+    status, data = upload(roster_csv(), 'roster.csv', admin_id='2')
+    assert status == 403, data
+    status, data = upload(roster_csv(), 'roster.csv', import_id='../escape')
+    assert status == 400, data
+    assert imported_users() == {}
@@ -0,0 +1,91 @@
+"""
+按请求统计 SQL 的测试
+
+检查语句形状的归一化、X-SQL-* 调试响应头，以及循环中逐条查询时能否识别为 N+1 并写入慢请求日志。
+
+用法: python -m pytest -q test_sql_profiler.py
+"""
+
+import contextlib
+import io
+import json
+import os
+
+import pytest
+
+from app import app, db, User, Post
+from sql_profiler import statement_shape
+
+
+@pytest.fixture(autouse=True)
+def profiler_config():
+    # 配置由 conftest.py 的 app_env 在测试结束后恢复
+    app.config.update(SQL_DEBUG_HEADERS=True, SQL_N_PLUS_ONE_THRESHOLD=3)
+
+
+def build_dataset():
+    with app.app_context():
+        for user_id in range(1, 7):
+            db.session.add(User(id=user_id, username=f'user{user_id}', password_hash='x', real_name=f'用户{user_id}'))
+            db.session.add(Post(user_id=user_id, content=f'动态{user_id}'))
+        db.session.commit()
+
+
+def get(url):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return app.test_client().get(url)
+
+
+def slow_log_records():
+    path = app.config['SLOW_REQUEST_LOG']
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as log_file:
+        return [json.loads(line) for line in log_file]
+
+
+def test_statement_shape_ignores_parameters():
+    assert statement_shape('SELECT * FROM post WHERE id IN (?, ?, ?)') == statement_shape(
+        'SELECT * FROM post WHERE id IN (?)')
+    assert statement_shape('SELECT *\n  FROM post LIMIT 20 OFFSET 40') == 'SELECT * FROM post LIMIT ? OFFSET ?'
+    assert statement_shape('SELECT * FROM "user" WHERE id = %(id_1)s') == 'SELECT * FROM "user" WHERE id = ?'
+
+
+def test_feed_reports_sql_headers_without_n_plus_one():
+    build_dataset()
+    response = get('/api/posts?user_id=1&limit=20')
+    assert response.status_code == 200
+    assert int(response.headers['X-SQL-Count']) > 0
+    assert float(response.headers['X-SQL-Time-Ms']) >= 0
+    assert response.headers['X-SQL-Slowest'].startswith(('SELECT', 'WITH'))
+    assert 'X-SQL-N-Plus-One' not in response.headers
+    assert not slow_log_records()
+
+
+def n_plus_one_request(path):
+    """不注册接口，在请求上下文中经过应用的请求钩子，逐条读取动态作者（典型的 N+1 写法）"""
+    with app.test_request_context(path), contextlib.redirect_stdout(io.StringIO()):
+        app.preprocess_request()
+        posts = Post.query.all()
+        authors = [db.session.get(User, post.user_id).username for post in posts]
+        return app.process_response(app.make_response({'authors': authors}))
+
+
+def test_loop_queries_flagged_as_n_plus_one():
+    build_dataset()
+    response = n_plus_one_request('/api/test/n-plus-one')
+    assert response.status_code == 200
+    count, shape = response.headers['X-SQL-N-Plus-One'].split('x ', 1)
+    assert int(count) == 6 and shape.startswith('SELECT user.id')
+    records = slow_log_records()
+    assert len(records) == 1 and records[0]['path'] == '/api/test/n-plus-one'
+    assert records[0]['n_plus_one'] == [{'count': 6, 'sql': records[0]['n_plus_one'][0]['sql']}]
+    assert records[0]['n_plus_one'][0]['sql'].endswith('FROM user WHERE user.id = ?')
+
+
+def test_slow_request_logged():
+    build_dataset()
+    app.config['SLOW_REQUEST_MS'] = 0
+    get('/api/posts?user_id=1')
+    records = slow_log_records()
+    assert len(records) == 1 and records[0]['sql_count'] > 0 and not records[0]['n_plus_one']
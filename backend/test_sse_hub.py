@@ -0,0 +1,49 @@
+"""
+实时推送服务的补发测试
+
+客户端带 Last-Event-ID 重连时，缓冲区能证明没有遗漏才补发，否则发送 reset：
+服务重启后缓冲区为空、缺失的事件已移出缓冲区，或最早收到的事件晚于 Last-Event-ID + 1；
+各工作进程的事件乱序到达时按序号判断并按序号补发。
+"""
+
+from sse_hub import FeedHub, RESET
+
+
+def event(seq):
+    return {'seq': seq, 'kind': 'post_update', 'post_id': seq}
+
+
+def queued(queue):
+    items = []
+    while not queue.empty():
+        item = queue.get_nowait()
+        items.append(item if item is RESET else item['seq'])
+    return items
+
+
+def test_replay_missed_events_in_seq_order():
+    hub = FeedHub()
+    for seq in (1, 3, 2, 5, 4):
+        hub.publish(event(seq))
+    assert queued(hub.subscribe(2)) == [3, 4, 5]
+    assert queued(hub.subscribe(5)) == []
+    assert queued(hub.subscribe()) == []
+
+
+def test_reset_after_restart():
+    hub = FeedHub()
+    assert queued(hub.subscribe(10)) == [RESET]
+    # 重启后收到的第一个事件之前的事件服务没有见过
+    hub.publish(event(13))
+    assert queued(hub.subscribe(10)) == [RESET]
+    assert queued(hub.subscribe(12)) == [13]
+
+
+def test_reset_when_missed_events_left_the_buffer():
+    hub = FeedHub(replay_size=3)
+    # 序号 4 先到达，先被移出缓冲区，缓冲区中最小的序号 1 不能证明 4 还在
+    for seq in (4, 1, 2, 3):
+        hub.publish(event(seq))
+    assert queued(hub.subscribe(0)) == [RESET]
+    assert queued(hub.subscribe(3)) == [RESET]
+    assert queued(hub.subscribe(4)) == []
@@ -0,0 +1,129 @@
+"""
+上传目录的分层存储
+
+上传的图片不再全部平铺在 uploads/ 下：按文件名的哈希取前四位十六进制分两级子目录，
+如 uploads/48/e8/48e8d3d637150478b2d35a80df420111.gif，每级最多 256 个子目录，
+几十万张图片时每个目录也只有几个文件，查找、新建文件不再随总数变慢。
+文件名以四位十六进制开头（按内容命名的文件，见 image_store.py）时直接取前四位，旧规则命名的文件取文件名 MD5 的前四位；
+只用第一个点之前的部分，各尺寸的 WebP 版本（原文件名加 .webp）与原图在同一个子目录中。
+各尺寸版本按同样的规则保存在 variants/<尺寸>/ 下。
+
+上传、图片访问、备份、清空和恢复都通过本模块读写原图：
+    original_path   保存新文件的位置
+    find_original   查找已有的文件，找不到分层位置时再查平铺位置（兼容还没有迁移的目录和旧备份）
+    iter_originals  遍历全部原图（分层和平铺的都包括）
+    copy_originals  备份、恢复时复制原图，目标目录按分层结构保存
+版本 12 的迁移调用 shard_uploads 把平铺的文件移入子目录，迁移期间服务照常运行，两个位置都能找到。
+"""
+
+import hashlib
+import os
+import re
+import shutil
+
+# 上传接口允许的图片扩展名，上传目录中的其他文件（如 .gitkeep）不属于原图
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp', 'bmp', 'svg', 'tiff'}
+
+_SHARD_DIR = re.compile(r'^[0-9a-f]{2}$')
+_HASH_PREFIX = re.compile(r'^[0-9a-f]{4}')
+
+
+def is_image_file(filename):
+    """是否为上传的图片：扩展名在 IMAGE_EXTENSIONS 中，且不是隐藏文件"""
+    return (not filename.startswith('.') and '.' in filename
+            and filename.rsplit('.', 1)[1].lower() in IMAGE_EXTENSIONS)
+
+
+def shard_key(filename):
+    """文件名对应的两级子目录名"""
+    key = filename.split('.', 1)[0]
+    if not _HASH_PREFIX.match(key):
+        key = hashlib.md5(key.encode('utf-8')).hexdigest()
+    return key[0:2], key[2:4]
+
+
+def shard_path(root, filename):
+    return os.path.join(root, *shard_key(filename), filename)
+
+
+def original_path(upload_folder, filename):
+    return shard_path(upload_folder, filename)
+
+
+def find_original(upload_folder, filename):
+    """返回原图的路径，不存在时返回 None"""
+    path = original_path(upload_folder, filename)
+    if os.path.isfile(path):
+        return path
+    flat_path = os.path.join(upload_folder, filename)
+    if os.path.isfile(flat_path):
+        return flat_path
+    # 迁移中的文件可能刚从平铺位置移走，再查一次分层位置
+    return path if os.path.isfile(path) else None
+
+
+def iter_originals(upload_folder):
+    """遍历上传目录中的原图，返回 (文件名, 路径)；跳过 variants 等其他目录、写入中的临时文件和不是图片的文件"""
+    for entry in os.scandir(upload_folder):
+        if entry.is_file():
+            if is_image_file(entry.name):
+                yield entry.name, entry.path
+        elif entry.is_dir() and _SHARD_DIR.match(entry.name):
+            for child in os.scandir(entry.path):
+                if not (child.is_dir() and _SHARD_DIR.match(child.name)):
+                    continue
+                for item in os.scandir(child.path):
+                    if item.is_file() and is_image_file(item.name):
+                        yield item.name, item.path
+
+
+def shard_dirs(upload_folder):
+    return [entry.path for entry in os.scandir(upload_folder) if entry.is_dir() and _SHARD_DIR.match(entry.name)]
+
+
+def copy_originals(source_folder, target_folder):
+    """把原图复制到目标目录（按分层结构），返回复制的文件数"""
+    copied = 0
+    for filename, path in iter_originals(source_folder):
+        target = shard_path(target_folder, filename)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copy2(path, target)
+        copied += 1
+    return copied
+
+
+def clear_originals(upload_folder):
+    """删除全部原图，保留上传目录本身和其中不是图片的文件"""
+    for entry in os.scandir(upload_folder):
+        if entry.is_file() and is_image_file(entry.name):
+            os.remove(entry.path)
+    for path in shard_dirs(upload_folder):
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def move_into_shards(root):
+    """把 root 下平铺的图片移入两级子目录，返回移动的文件数"""
+    if not os.path.isdir(root):
+        return 0
+    moved = 0
+    entries = [entry for entry in os.scandir(root) if entry.is_file() and is_image_file(entry.name)]
+    for entry in entries:
+        target = shard_path(root, entry.name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if os.path.exists(target):
+            # 分层位置已有同名文件（内容相同），平铺的一份直接删除
+            os.remove(entry.path)
+        else:
+            os.replace(entry.path, target)
+        moved += 1
+    return moved
+
+
+def shard_uploads(upload_folder, variant_roots=()):
+    """把平铺的原图和各尺寸版本移入子目录，可以重复执行，返回移动的原图数"""
+    moved = move_into_shards(upload_folder)
+    for root in variant_roots:
+        move_into_shards(root)
+    if moved:
+        print(f"已将 {moved} 个图片文件移入分层目录")
+    return moved
@@ -1,385 +1,292 @@
 """
-用户账号管理相关API
+用户账号批量导入（Excel/CSV 花名册）
+
+按行流式读取 xlsx 或 CSV，每次只在内存中保留一个数据块：逐块校验、一次查询块内的用户名是否已存在、
+批量插入并提交，每块完成后通过回调报告进度。内存占用与文件行数无关（xlsx 的共享字符串表除外）。
+xlsx 用标准库（zipfile + iterparse）解析，不依赖 pandas 或 openpyxl；旧版 .xls 需另存为 xlsx 或 CSV。
+
+本模块不依赖 app.py：校验、查询已存在用户名和写入数据库都由调用方以函数形式传入，
+接口见 app.py 中的 /api/user/batch_import。
 """
 
-import pandas as pd
-from werkzeug.utils import secure_filename
+import codecs
+import csv
+import io
+import json
 import os
+import re
+import time
+import zipfile
+from xml.etree import ElementTree
+
+ROSTER_EXTENSIONS = {'xlsx', 'csv'}
+REQUIRED_COLUMNS = ('登录账号', '年级', '班级')
+OPTIONAL_COLUMNS = ('密码', '姓名')
+DEFAULT_CHUNK_SIZE = 1000
+# 返回给前端的错误信息条数上限，超出部分只计数
+MAX_ERROR_MESSAGES = 1000
+
+XLSX_MAIN = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+XLSX_DOC_REL = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+XLSX_PKG_REL = '{http://schemas.openxmlformats.org/package/2006/relationships}'
 
-# 添加文件上传配置
-UPLOAD_FOLDER = 'uploads'
-ALLOWED_EXTENSIONS = {'xlsx', 'xls'}
+_CELL_COLUMN = re.compile(r'[A-Z]+')
+
+
+class RosterError(Exception):
+    """花名册无法读取或缺少必需的列"""
 
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
 
 def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
-
-# 超级管理员添加用户
-@app.route('/api/admin/users', methods=['POST'])
-def admin_add_user():
-    data = request.get_json()
-    
-    if not data or not data.get('admin_id'):
-        return jsonify({'error': '管理员ID不能为空'}), 400
-    
-    admin_id = data.get('admin_id')
-    
-    # 验证操作者是否为超级管理员
-    admin = User.query.get(admin_id)
-    if not admin or not admin.is_admin:
-        return jsonify({'error': '权限不足，只有超级管理员可以添加用户'}), 403
-    
-    # 验证必需字段
-    if not data.get('username') or not data.get('password'):
-        return jsonify({'error': '用户名和密码不能为空'}), 400
-    
-    # 验证用户名：6-16个字符，首字符必须是字母
-    username = data['username']
-    if not (6 <= len(username) <= 16):
-        return jsonify({'error': '用户名长度必须在6-16个字符之间'}), 400
-    if not username[0].isalpha():
-        return jsonify({'error': '用户名必须以字母开头'}), 400
-    
-    # 验证密码：最少7位的字母和数字组合
-    password = data['password']
-    if len(password) < 7:
-        return jsonify({'error': '密码长度不能少于7位'}), 400
-    if not any(c.isalpha() for c in password) or not any(c.isdigit() for c in password):
-        return jsonify({'error': '密码必须包含字母和数字'}), 400
-    
-    # 检查用户名是否已存在
-    existing_user = User.query.filter_by(username=username).first()
-    if existing_user:
-        return jsonify({'error': '用户名已存在'}), 400
-    
-    # 处理可选的真实姓名
-    real_name = data.get('real_name')
-    
-    # 如果提供了真实姓名，进行验证
-    if real_name and len(real_name) > 5:
-        return jsonify({'error': '姓名昵称长度不能超过5个汉字'}), 400
-    
-    # 获取其他字段
-    is_teacher = bool(data.get('is_teacher', False))
-    is_active = bool(data.get('is_active', True))
-    can_post = bool(data.get('can_post', True))
-    is_first_login = bool(data.get('is_first_login', True))
-    grade = data.get('grade') if not is_teacher else None
-    class_name = data.get('class_name') if not is_teacher else None
-    
-    # 如果是学生账号，验证年级和班级
-    if not is_teacher:
-        if not grade or not class_name:
-            return jsonify({'error': '学生账号必须提供年级和班级'}), 400
-        if not (1 <= int(grade) <= 5 and 1 <= int(class_name) <= 6):
-            return jsonify({'error': '年级必须在1-5年级之间，班级必须在1-6班之间'}), 400
-        
-        # 转换为整数
-        grade = int(grade)
-        class_name = int(class_name)
-    
-    # 创建新用户
-    new_user = User(
-        username=username,
-        password_hash=generate_password_hash(password),
-        real_name=real_name,
-        is_teacher=is_teacher,
-        is_admin=False,  # 管理员创建的用户不能是管理员
-        is_active=is_active,
-        can_post=can_post,
-        is_first_login=is_first_login,
-        grade=grade,
-        class_name=class_name
-    )
-    
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ROSTER_EXTENSIONS
+
+
+# CSV
+
+def detect_csv_encoding(stream, sample_size=65536):
+    """Excel 导出的中文 CSV 可能是 UTF-8（带 BOM）或 GBK，按开头的内容判断，读取后回到开头"""
+    sample = stream.read(sample_size)
+    stream.seek(0)
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
     try:
-        db.session.add(new_user)
-        db.session.commit()
-        
-        # 返回新创建的用户信息
-        user_data = {
-            'id': new_user.id,
-            'username': new_user.username,
-            'real_name': new_user.real_name,
-            'is_teacher': new_user.is_teacher,
-            'is_admin': new_user.is_admin,
-            'is_active': new_user.is_active,
-            'is_first_login': new_user.is_first_login,
-            'can_post': new_user.can_post,
-            'grade': new_user.grade,
-            'class_name': new_user.class_name
-        }
-        
-        return jsonify({'message': '用户创建成功', 'user': user_data}), 201
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'error': f'创建用户失败: {str(e)}'}), 500
-
-# 批量导入学生账号
-@app.route('/api/admin/import-students', methods=['POST'])
-def import_students():
-    data = request.get_json()
-    
-    if not data or not data.get('admin_id') or not data.get('students'):
-        return jsonify({'error': '管理员ID和学生数据不能为空'}), 400
-    
-    admin_id = data.get('admin_id')
-    students = data.get('students')
-    
-    # 验证操作者是否为超级管理员
-    admin = User.query.get(admin_id)
-    if not admin or not admin.is_admin:
-        return jsonify({'error': '权限不足，只有超级管理员可以批量导入账号'}), 403
-    
-    # 验证学生数据
-    if not isinstance(students, list) or len(students) == 0:
-        return jsonify({'error': '学生数据格式不正确或为空'}), 400
-    
-    # 创建的用户列表
-    created_users = []
-    errors = []
-    
-    for i, student in enumerate(students):
-        # 验证必需字段
-        if not student.get('username') or not student.get('password') or not student.get('grade') or not student.get('class_name'):
-            errors.append({
-                'index': i,
-                'error': '用户名、密码、年级和班级不能为空',
-                'data': student
-            })
-            continue
-        
-        # 验证用户名：6-16个字符，首字符必须是字母
-        username = student['username']
-        if not (6 <= len(username) <= 16):
-            errors.append({
-                'index': i,
-                'error': '用户名长度必须在6-16个字符之间',
-                'data': student
-            })
-            continue
-        
-        if not username[0].isalpha():
-            errors.append({
-                'index': i,
-                'error': '用户名必须以字母开头',
-                'data': student
-            })
-            continue
-        
-        # 验证密码：最少7位的字母和数字组合
-        password = student['password']
-        if len(password) < 7:
-            errors.append({
-                'index': i,
-                'error': '密码长度不能少于7位',
-                'data': student
-            })
-            continue
-        
-        if not any(c.isalpha() for c in password) or not any(c.isdigit() for c in password):
-            errors.append({
-                'index': i,
-                'error': '密码必须包含字母和数字',
-                'data': student
-            })
+        # 样本末尾可能截断在多字节字符中间，用增量解码器忽略最后不完整的字符
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'gb18030'
+
+
+def iter_csv_rows(stream):
+    """逐行读取 CSV，生成 (行号, 单元格列表)"""
+    text = io.TextIOWrapper(stream, encoding=detect_csv_encoding(stream), newline='')
+    try:
+        for row_number, values in enumerate(csv.reader(text), start=1):
+            yield row_number, values
+    finally:
+        # 文件对象仍由调用方关闭
+        text.detach()
+
+
+# xlsx
+
+def column_index(cell_reference):
+    """单元格引用中的列号，如 'C12' -> 2"""
+    index = 0
+    for letter in _CELL_COLUMN.match(cell_reference).group():
+        index = index * 26 + ord(letter) - ord('A') + 1
+    return index - 1
+
+
+def first_sheet_path(archive):
+    workbook = ElementTree.fromstring(archive.read('xl/workbook.xml'))
+    sheet = workbook.find(f'{XLSX_MAIN}sheets/{XLSX_MAIN}sheet')
+    if sheet is None:
+        raise RosterError('Excel文件中没有工作表')
+    relation_id = sheet.get(f'{XLSX_DOC_REL}id')
+    relations = ElementTree.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+    for relation in relations.iter(f'{XLSX_PKG_REL}Relationship'):
+        if relation.get('Id') == relation_id:
+            target = relation.get('Target')
+            return target.lstrip('/') if target.startswith('/') else 'xl/' + target
+    raise RosterError('Excel文件中没有工作表')
+
+
+def load_shared_strings(archive):
+    if 'xl/sharedStrings.xml' not in archive.namelist():
+        return []
+    strings = []
+    with archive.open('xl/sharedStrings.xml') as shared:
+        for _, element in ElementTree.iterparse(shared):
+            if element.tag == f'{XLSX_MAIN}si':
+                # 纯文本为 <t>，富文本为多个 <r><t>；拼音注释 <rPh> 中的文字不属于单元格内容
+                parts = element.findall(f'{XLSX_MAIN}t') + element.findall(f'{XLSX_MAIN}r/{XLSX_MAIN}t')
+                strings.append(''.join(part.text or '' for part in parts))
+                element.clear()
+    return strings
+
+
+def cell_value(cell, shared_strings):
+    cell_type = cell.get('t')
+    if cell_type == 'inlineStr':
+        return ''.join(part.text or '' for part in cell.iter(f'{XLSX_MAIN}t'))
+    value = cell.findtext(f'{XLSX_MAIN}v')
+    if value is None or cell_type == 'e':
+        return None
+    if cell_type == 's':
+        return shared_strings[int(value)]
+    if cell_type in ('str', 'b'):
+        return value
+    # 数字：整数值去掉 Excel 存储时的小数部分，如 '3.0' -> '3'
+    try:
+        number = float(value)
+    except ValueError:
+        return value
+    return str(int(number)) if number.is_integer() else value
+
+
+def iter_xlsx_rows(stream):
+    """逐行读取 xlsx 的第一个工作表，生成 (行号, 单元格列表)"""
+    archive = zipfile.ZipFile(stream)
+    shared_strings = load_shared_strings(archive)
+    sheet_data = None
+    with archive.open(first_sheet_path(archive)) as sheet:
+        for event, element in ElementTree.iterparse(sheet, events=('start', 'end')):
+            if event == 'start':
+                if element.tag == f'{XLSX_MAIN}sheetData':
+                    sheet_data = element
+                continue
+            if element.tag != f'{XLSX_MAIN}row':
+                continue
+            values = []
+            for cell in element.iter(f'{XLSX_MAIN}c'):
+                reference = cell.get('r')
+                index = column_index(reference) if reference else len(values)
+                values.extend([None] * (index - len(values)))
+                values.append(cell_value(cell, shared_strings))
+            yield int(element.get('r') or 0), values
+            # 已处理的行从树中移除，内存中只保留当前行
+            sheet_data.clear()
+
+
+def iter_roster_rows(stream, filename):
+    """按扩展名逐行读取花名册，文件损坏或编码无法识别时抛出 RosterError"""
+    extension = filename.rsplit('.', 1)[-1].lower()
+    if extension == 'csv':
+        rows = iter_csv_rows(stream)
+    elif extension == 'xlsx':
+        rows = iter_xlsx_rows(stream)
+    else:
+        raise RosterError('不支持的文件格式，请上传 xlsx 或 CSV 文件')
+    try:
+        yield from rows
+    except (zipfile.BadZipFile, KeyError, IndexError, ValueError, ElementTree.ParseError, UnicodeDecodeError, csv.Error):
+        raise RosterError('文件内容无法解析，请检查文件格式')
+
+
+def iter_roster_records(rows):
+    """
+    第一个非空行作为表头，之后每行生成 (行号, {列名: 去掉首尾空白的文本})，跳过空行；
+    缺少必需的列时抛出 RosterError
+    """
+    columns = None
+    for row_number, values in rows:
+        texts = ['' if value is None else str(value).strip() for value in values]
+        if not any(texts):
             continue
-        
-        # 检查用户名是否已存在
-        existing_user = User.query.filter_by(username=username).first()
-        if existing_user:
-            errors.append({
-                'index': i,
-                'error': '用户名已存在',
-                'data': student
-            })
+        if columns is None:
+            missing = [name for name in REQUIRED_COLUMNS if name not in texts]
+            if missing:
+                raise RosterError(f"文件格式不正确，必须包含：{'、'.join(REQUIRED_COLUMNS)}")
+            columns = {name: texts.index(name) for name in REQUIRED_COLUMNS + OPTIONAL_COLUMNS if name in texts}
             continue
-        
-        # 验证年级和班级
-        try:
-            grade = int(student['grade'])
-            class_name = int(student['class_name'])
-            
-            if not (1 <= grade <= 5 and 1 <= class_name <= 6):
-                errors.append({
-                    'index': i,
-                    'error': '年级必须在1-5年级之间，班级必须在1-6班之间',
-                    'data': student
-                })
+        yield row_number, {name: texts[index] if index < len(texts) else '' for name, index in columns.items()}
+    if columns is None:
+        raise RosterError('文件中没有数据')
+
+
+# 导入流程
+
+class RosterImportStats:
+    def __init__(self, import_id):
+        self.import_id = import_id
+        self.started_at = time.time()
+        self.processed = 0
+        self.created = 0
+        self.failed = 0
+        self.errors = []
+        self.done = False
+
+    def add_error(self, row_number, message):
+        self.failed += 1
+        if len(self.errors) < MAX_ERROR_MESSAGES:
+            self.errors.append(f'行 {row_number}: {message}')
+
+    def to_dict(self):
+        return {
+            'import_id': self.import_id,
+            'processed': self.processed,
+            'created': self.created,
+            'failed': self.failed,
+            'done': self.done,
+            'elapsed': round(time.time() - self.started_at, 2)
+        }
+
+
+def import_roster(records, validate, find_existing, insert_users, stats,
+                  chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+    """
+    分块导入花名册记录：
+    validate(记录) -> (错误信息, 待插入的行)，find_existing(用户名集合) -> 已存在的用户名集合，
+    insert_users(行列表) 写入并提交一块；每块完成后调用 progress(stats)。
+    每块提交后才读取下一块，文件中后出现的重复用户名由 find_existing 查到
+    """
+    chunk = []
+
+    def flush():
+        validated = []
+        for row_number, record in chunk:
+            error, row = validate(record)
+            if error:
+                stats.add_error(row_number, error)
+            else:
+                validated.append((row_number, row))
+
+        existing = find_existing({row['username'] for _, row in validated})
+        accepted = []
+        for row_number, row in validated:
+            if row['username'] in existing:
+                stats.add_error(row_number, f"用户名 {row['username']} 已存在")
                 continue
-        except (ValueError, TypeError):
-            errors.append({
-                'index': i,
-                'error': '年级和班级必须是数字',
-                'data': student
-            })
+            existing.add(row['username'])
+            accepted.append(row)
+
+        if accepted:
+            insert_users(accepted)
+        stats.processed += len(chunk)
+        stats.created += len(accepted)
+        chunk.clear()
+        if progress:
+            progress(stats)
+
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+    stats.done = True
+    if progress:
+        progress(stats)
+    return stats
+
+
+def create_progress(path, stats):
+    """新建进度文件，同一个 import_id 的文件已存在时抛出 FileExistsError，不会覆盖另一次导入的进度"""
+    with open(path, 'x', encoding='utf-8') as progress_file:
+        json.dump(stats.to_dict(), progress_file)
+
+
+def write_progress(path, stats):
+    """以替换文件的方式写入进度，其他工作进程读取时不会读到写了一半的内容"""
+    temporary_path = f'{path}.{os.getpid()}.tmp'
+    with open(temporary_path, 'w', encoding='utf-8') as progress_file:
+        json.dump(stats.to_dict(), progress_file)
+    os.replace(temporary_path, path)
+
+
+def expire_progress(directory, max_age):
+    """删除超过 max_age 秒未更新的进度文件（包括中断时留下的临时文件），返回删除的文件数"""
+    expired = 0
+    deadline = time.time() - max_age
+    for entry in os.scandir(directory):
+        if not entry.name.endswith(('.json', '.tmp')):
             continue
-        
-        # 创建新用户
-        new_user = User(
-            username=username,
-            password_hash=generate_password_hash(password),
-            real_name=None,  # 批量创建的学生账号不设置姓名昵称
-            is_teacher=False,  # 一定是学生
-            is_admin=False,  # 一定不是管理员
-            is_active=True,  # 默认启用
-            can_post=False,  # 默认禁止发布内容
-            is_first_login=True,  # 必须首次登录修改密码和姓名
-            grade=grade,
-            class_name=class_name
-        )
-        
         try:
-            db.session.add(new_user)
-            created_users.append({
-                'username': new_user.username,
-                'grade': new_user.grade,
-                'class_name': new_user.class_name
-            })
-        except Exception as e:
-            errors.append({
-                'index': i,
-                'error': f'创建用户失败: {str(e)}',
-                'data': student
-            })
-    
-    # 提交事务
-    try:
-        db.session.commit()
-        return jsonify({
-            'message': f'成功导入 {len(created_users)} 个学生账号',
-            'created_users': created_users,
-            'errors': errors
-        }), 201
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'error': f'批量导入失败: {str(e)}'}), 500
-
-# 更新用户密码和个人信息（首次登录使用）
-@app.route('/api/users/update-profile', methods=['POST'])
-def update_first_login_profile():
-    data = request.get_json()
-    
-    if not data or not data.get('user_id') or not data.get('password') or not data.get('real_name'):
-        return jsonify({'error': '用户ID、新密码和姓名昵称不能为空'}), 400
-    
-    user_id = data.get('user_id')
-    password = data.get('password')
-    real_name = data.get('real_name')
-    
-    # 验证密码：最少7位的字母和数字组合
-    if len(password) < 7:
-        return jsonify({'error': '密码长度不能少于7位'}), 400
-    if not any(c.isalpha() for c in password) or not any(c.isdigit() for c in password):
-        return jsonify({'error': '密码必须包含字母和数字'}), 400
-    
-    # 验证真实姓名：2-5个汉字
-    if not (2 <= len(real_name) <= 5):
-        return jsonify({'error': '姓名昵称长度必须在2-5个汉字之间'}), 400
-    if not all('\u4e00' <= char <= '\u9fff' for char in real_name):
-        return jsonify({'error': '姓名昵称必须是汉字'}), 400
-    
-    user = User.query.get(user_id)
-    if not user:
-        return jsonify({'error': '用户不存在'}), 404
-    
-    try:
-        # 更新用户信息
-        user.password_hash = generate_password_hash(password)
-        user.real_name = real_name
-        user.is_first_login = False  # 标记为非首次登录
-        
-        db.session.commit()
-        
-        # 返回更新后的用户信息
-        user_data = {
-            'id': user.id,
-            'username': user.username,
-            'real_name': user.real_name,
-            'is_teacher': user.is_teacher,
-            'is_admin': user.is_admin,
-            'is_active': user.is_active,
-            'is_first_login': user.is_first_login,
-            'can_post': user.can_post,
-            'grade': user.grade,
-            'class_name': user.class_name
-        }
-        
-        return jsonify({
-            'message': '个人信息更新成功',
-            'user': user_data
-        }), 200
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'error': f'更新个人信息失败: {str(e)}'}), 500
-
-@user_bp.route('/batch_import', methods=['POST'])
-@login_required
-def batch_import_users():
-    if not current_user.is_admin:
-        return jsonify({'error': '权限不足'}), 403
-        
-    if 'file' not in request.files:
-        return jsonify({'error': '没有上传文件'}), 400
-        
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({'error': '没有选择文件'}), 400
-        
-    if not allowed_file(file.filename):
-        return jsonify({'error': '不支持的文件格式'}), 400
-        
-    try:
-        # 读取Excel文件
-        df = pd.read_excel(file)
-        required_columns = ['登录账号', '年级', '班级']
-        
-        # 验证必要的列是否存在
-        if not all(col in df.columns for col in required_columns):
-            return jsonify({'error': 'Excel文件格式不正确，必须包含：登录账号、年级、班级'}), 400
-            
-        success_count = 0
-        error_messages = []
-        
-        for _, row in df.iterrows():
-            try:
-                username = str(row['登录账号']).strip()
-                grade = str(row['年级']).strip()
-                class_name = str(row['班级']).strip()
-                
-                # 验证数据
-                if not username or not grade or not class_name:
-                    error_messages.append(f'行 {_ + 2}: 数据不完整')
-                    continue
-                    
-                # 检查用户名是否已存在
-                if User.query.filter_by(username=username).first():
-                    error_messages.append(f'行 {_ + 2}: 用户名 {username} 已存在')
-                    continue
-                    
-                # 创建新用户
-                new_user = User(
-                    username=username,
-                    password=generate_password_hash('123456'),  # 默认密码
-                    grade=grade,
-                    class_name=class_name,
-                    is_admin=False,
-                    is_first_login=True
-                )
-                db.session.add(new_user)
-                success_count += 1
-                
-            except Exception as e:
-                error_messages.append(f'行 {_ + 2}: {str(e)}')
-                
-        db.session.commit()
-        
-        return jsonify({
-            'message': f'成功导入 {success_count} 个用户',
-            'errors': error_messages if error_messages else None
-        })
-        
-    except Exception as e:
-        return jsonify({'error': f'导入失败：{str(e)}'}), 500 
\ No newline at end of file
+            if entry.stat().st_mtime < deadline:
+                os.remove(entry.path)
+                expired += 1
+        except FileNotFoundError:
+            # 其他工作进程同时清理
+            pass
+    return expired
@@ -0,0 +1,85 @@
+"""
+用户摘要缓存
+
+进程内的有界 LRU 缓存，按用户ID保存发布者、评论者、权限检查所需的少量字段。
+写操作通过 invalidate() 显式失效本进程的条目，并在数据库中递增全局代数；
+其他 gunicorn 工作进程在下一次请求时发现代数变化后清空整个缓存。
+"""
+
+import threading
+from collections import OrderedDict, namedtuple
+
+UserSummary = namedtuple('UserSummary', [
+    'id', 'username', 'real_name', 'is_teacher', 'is_admin',
+    'is_active', 'is_first_login', 'can_post'
+])
+
+
+class UserSummaryCache:
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._generation = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+        self.invalidations = 0
+
+    def check_generation(self, generation):
+        """代数与缓存时不同说明其他进程修改过用户，清空全部条目"""
+        with self._lock:
+            if generation != self._generation:
+                if self._entries:
+                    self.flushes += 1
+                self._entries.clear()
+                self._generation = generation
+
+    def get_many(self, user_ids, load_missing):
+        """返回 {id: UserSummary}，缓存未命中的ID交给 load_missing(ids) 一次加载，不存在的用户不出现在结果中"""
+        result = {}
+        missing = []
+        with self._lock:
+            for user_id in user_ids:
+                summary = self._entries.get(user_id)
+                if summary is None:
+                    missing.append(user_id)
+                else:
+                    self._entries.move_to_end(user_id)
+                    result[user_id] = summary
+            self.hits += len(result)
+            self.misses += len(missing)
+
+        if missing:
+            loaded = list(load_missing(missing))
+            with self._lock:
+                for summary in loaded:
+                    self._entries[summary.id] = summary
+                    self._entries.move_to_end(summary.id)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            result.update((summary.id, summary) for summary in loaded)
+        return result
+
+    def invalidate(self, user_id=None):
+        """失效单个用户，user_id 为空时清空全部"""
+        with self._lock:
+            self.invalidations += 1
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'generation': self._generation,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'flushes': self.flushes,
+                'invalidations': self.invalidations
+            }
@@ -0,0 +1,186 @@
+"""
+高频写操作的单写入队列（组提交）
+
+各 gunicorn 工作进程各自提交点赞、评论时，每次提交都要单独竞争 SQLite 唯一的写锁并刷盘。
+开启写队列后，工作进程只在请求中完成参数和权限检查，把写操作通过 Unix 套接字交给本服务；
+本服务在一个线程中依次执行，把短时间内到达的多个写操作放进同一个事务提交，
+每个操作使用独立的保存点，失败只影响它自己，各调用方分别收到自己的结果或错误。
+
+工作进程在写队列服务未启动时退回到请求中直接提交；请求已发出但没有收到结果时不会重试，直接返回错误，避免重复写入。
+
+用法: python write_queue.py [--socket /tmp/campus_write_queue.sock] [--max-batch 64] [--max-wait-ms 2]
+并在 gunicorn 的环境中设置 CAMPUS_WRITE_QUEUE_SOCKET 为同一路径以启用。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+WRITE_QUEUE_SOCKET_PATH = '/tmp/campus_write_queue.sock'
+# 工作进程默认不启用写队列
+DEFAULT_WRITE_QUEUE_SOCKET = os.environ.get('CAMPUS_WRITE_QUEUE_SOCKET', '')
+DEFAULT_MAX_BATCH = 64
+DEFAULT_MAX_WAIT_MS = 2
+
+
+class WriteQueueUnavailable(Exception):
+    """写队列服务不可用，请求没有发出，调用方可以自行执行"""
+
+
+class WriteQueueError(Exception):
+    """写操作执行失败，或已发出但没有收到结果"""
+
+
+class WriteQueueClient:
+    def __init__(self, socket_path=DEFAULT_WRITE_QUEUE_SOCKET, timeout=10):
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    @property
+    def enabled(self):
+        return bool(self.socket_path)
+
+    def submit(self, kind, params):
+        """提交一个写操作并等待结果，返回操作函数的返回值"""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            try:
+                sock.connect(self.socket_path)
+            except OSError as e:
+                raise WriteQueueUnavailable(str(e))
+            try:
+                payload = json.dumps({'kind': kind, 'params': params}, ensure_ascii=False) + '\n'
+                sock.sendall(payload.encode('utf-8'))
+                line = sock.makefile('rb').readline()
+            except OSError:
+                raise WriteQueueError('写队列无响应')
+        finally:
+            sock.close()
+
+        if not line:
+            raise WriteQueueError('写队列连接已断开')
+        response = json.loads(line.decode('utf-8'))
+        if not response.get('ok'):
+            raise WriteQueueError(response.get('error') or '写操作失败')
+        return response['result']
+
+
+class WriteQueueServer:
+    def __init__(self, execute_batch, max_batch=DEFAULT_MAX_BATCH, max_wait_ms=DEFAULT_MAX_WAIT_MS):
+        # execute_batch([(kind, params)]) -> [(成功与否, 结果或错误信息)]，在唯一的写线程中调用
+        self.execute_batch = execute_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.queue = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='campus-writer')
+        self.started_at = time.time()
+        self.batches = 0
+        self.operations = 0
+        self.failures = 0
+        self.largest_batch = 0
+
+    def stats(self):
+        return {
+            'pid': os.getpid(),
+            'batches': self.batches,
+            'operations': self.operations,
+            'failures': self.failures,
+            'avg_batch': round(self.operations / self.batches, 2) if self.batches else 0.0,
+            'largest_batch': self.largest_batch,
+            'queued': self.queue.qsize() if self.queue else 0,
+            'uptime': round(time.time() - self.started_at, 1)
+        }
+
+    async def collect_batch(self):
+        """等待第一个写操作，然后在 max_wait 内继续收集，最多 max_batch 个"""
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def run_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self.collect_batch()
+            items = [(kind, params) for kind, params, _ in batch]
+            try:
+                # 提交期间事件循环继续接收新的写操作，作为下一批
+                results = await loop.run_in_executor(self.executor, self.execute_batch, items)
+            except Exception as e:
+                results = [(False, str(e))] * len(batch)
+            self.batches += 1
+            self.operations += len(batch)
+            self.largest_batch = max(self.largest_batch, len(batch))
+            for (_, _, future), (ok, value) in zip(batch, results):
+                if not ok:
+                    self.failures += 1
+                if not future.done():
+                    future.set_result({'ok': True, 'result': value} if ok else {'ok': False, 'error': value})
+
+    async def handle_client(self, reader, writer):
+        try:
+            line = await reader.readline()
+            if not line:
+                return
+            try:
+                request = json.loads(line.decode('utf-8'))
+                kind, params = request['kind'], request.get('params') or {}
+            except (ValueError, KeyError, TypeError):
+                response = {'ok': False, 'error': '无效的写请求'}
+            else:
+                if kind == 'stats':
+                    response = {'ok': True, 'result': self.stats()}
+                else:
+                    future = asyncio.get_running_loop().create_future()
+                    await self.queue.put((kind, params, future))
+                    response = await future
+            writer.write((json.dumps(response, ensure_ascii=False) + '\n').encode('utf-8'))
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, socket_path):
+        self.queue = asyncio.Queue()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = await asyncio.start_unix_server(self.handle_client, path=socket_path)
+        os.chmod(socket_path, 0o660)
+        print(f"写队列已启动: {socket_path}, 每批最多 {self.max_batch} 个, 等待 {self.max_wait * 1000:g}ms")
+        async with server:
+            await asyncio.gather(server.serve_forever(), self.run_batches())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='高频写操作的单写入队列')
+    parser.add_argument('--socket', default=DEFAULT_WRITE_QUEUE_SOCKET or WRITE_QUEUE_SOCKET_PATH)
+    parser.add_argument('--max-batch', type=int, default=DEFAULT_MAX_BATCH)
+    parser.add_argument('--max-wait-ms', type=float, default=DEFAULT_MAX_WAIT_MS)
+    args = parser.parse_args()
+
+    # 写队列进程本身直接执行写操作，不能再转发给自己
+    os.environ['CAMPUS_WRITE_QUEUE_SOCKET'] = ''
+    from app import app, execute_write_batch
+
+    def execute_batch(items):
+        with app.app_context():
+            return execute_write_batch(items)
+
+    asyncio.run(WriteQueueServer(execute_batch, args.max_batch, args.max_wait_ms).serve(args.socket))